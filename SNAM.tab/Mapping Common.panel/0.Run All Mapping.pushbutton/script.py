@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Esegue in sequenza le mappature standard (Project Information, Parametri
+Comuni, IFC, Pipe, AP Accessories) in un solo TransactionGroup: un solo
+annulla, workbook letti una volta, una sola passata del collector e handle
+dei parametri condivisi tra gli stadi (snam.pipeline). Alla fine riporta
+esito e tempo di ogni stadio.
+
+SHIFT+click = dry run di tutti gli stadi; CTRL+click = scelta dell'ambito
+e delle opzioni degli stadi (valori IFC sul tipo, scegli di nuovo Allegato 2).
+"""
+__title__ = 'Run all\n mapping'
+__author__ = 'Valerio Mascia'
+
+import os
+import runpy
+from Autodesk.Revit.DB import BuiltInCategory, TransactionGroup, TransactionStatus
+from Autodesk.Revit.UI import TaskDialog
+from snam import pipeline, scope, timing, writeset
+
+TAB_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# stadi in ordine: (nome, cartella del pulsante sotto SNAM.tab)
+STAGES = [
+    ("Project Information", "Mapping Common.panel/1.Project Information Mapping.pushbutton"),
+    ("Parametri Comuni", "Mapping Common.panel/2.Parametri Comuni_Mapping.pushbutton"),
+    ("IFC Class/Name/Object", "Mapping Ifc.panel/IfcClassNameObject.pushbutton"),
+    ("Pipe mapping", "Mapping Element.panel/1.BarreMapping.pushbutton"),
+    ("AP Accessories mapping", "Mapping Element.panel/2.AccessoriesMapping.pushbutton"),
+]
+
+# categorie di tutti gli stadi per la passata comune del collector: quelle di
+# IfcClassNameObject comprendono quelle di Parametri Comuni, Pipe e AP
+CATEGORIES = [
+    BuiltInCategory.OST_DuctTerminal, BuiltInCategory.OST_DuctCurves,
+    BuiltInCategory.OST_DuctFitting, BuiltInCategory.OST_DuctAccessory,
+    BuiltInCategory.OST_DuctInsulations, BuiltInCategory.OST_DuctLinings,
+    BuiltInCategory.OST_ElectricalEquipment, BuiltInCategory.OST_Furniture,
+    BuiltInCategory.OST_FlexDuctCurves, BuiltInCategory.OST_GenericModel,
+    BuiltInCategory.OST_PipeCurves, BuiltInCategory.OST_PipeFitting,
+    BuiltInCategory.OST_PipeAccessory, BuiltInCategory.OST_PipeInsulations,
+    BuiltInCategory.OST_FlexPipeCurves, BuiltInCategory.OST_CableTray,
+    BuiltInCategory.OST_CableTrayFitting, BuiltInCategory.OST_Conduit,
+    BuiltInCategory.OST_ConduitFitting, BuiltInCategory.OST_MechanicalEquipment,
+    BuiltInCategory.OST_Doors, BuiltInCategory.OST_Floors,
+]
+
+
+def run_stage(folder, dry_run):
+    """Esegue lo script del pulsante come un click; False se lo stadio si e' interrotto."""
+    path = os.path.join(TAB_DIR, folder, "script.py")
+    try:
+        runpy.run_path(path, init_globals={
+            "__revit__": __revit__,
+            "__shiftclick__": dry_run,
+            "__forceddebugmode__": False,
+        }, run_name="__main__")
+    except SystemExit:
+        return False
+    return True
+
+
+uidoc = __revit__.ActiveUIDocument
+doc = uidoc.Document
+DRY_RUN = writeset.is_dry_run(globals())
+run_scope = scope.choose(doc, uidoc, scope.wants_choice(globals()),
+                         switches=[scope.ON_TYPE, scope.REPICK_ALLEGATO2])
+
+session = pipeline.start(run_scope, [int(c) for c in CATEGORIES])
+results = []
+t_all = timing.clock()
+tg = TransactionGroup(doc, "Run all mapping")
+tg.Start()
+try:
+    for name, folder in STAGES:
+        t0 = timing.clock()
+        completed = run_stage(folder, DRY_RUN)
+        msgs = session.take_messages()
+        # un dry run termina con SystemExit dopo il messaggio finale
+        status = "completato" if completed or msgs else "interrotto"
+        results.append((name, timing.clock() - t0, status, msgs))
+    if DRY_RUN:
+        # nessuno stadio deve toccare il modello: il gruppo si annulla comunque
+        # e le azioni rimandate (impronte) si scartano con pipeline.finish()
+        tg.RollBack()
+    else:
+        tg.Assimilate()
+        # impronte degli stadi (snam.fingerprint) salvate solo a gruppo confermato
+        pipeline.commit()
+except:
+    if tg.GetStatus() == TransactionStatus.Started:
+        tg.RollBack()
+    raise
+finally:
+    pipeline.finish()
+
+lines = []
+for name, secs, status, msgs in results:
+    lines.append("{0}: {1} ({2:.1f} s)".format(name, status, secs))
+    for _, msg in msgs:
+        first = (msg or "").splitlines()
+        if first:
+            lines.append("    " + first[0])
+lines.append("")
+lines.append("Totale: {0:.1f} s{1}".format(timing.clock() - t_all, " - dry run" if DRY_RUN else ""))
+if not run_scope.whole:
+    lines.append("Ambito: {0}".format(run_scope.label))
+TaskDialog.Show("Run all mapping", "\n".join(lines))
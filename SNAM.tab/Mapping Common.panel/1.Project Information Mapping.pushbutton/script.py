@@ -22,53 +22,45 @@ clr.AddReference('System.Windows.Forms')
 from System.Windows.Forms import OpenFileDialog, DialogResult
 
 # Excel
-import xlrd
+from snam import allegato2, pipeline, scope, timing, writeset
+from snam.table import col_letter_to_index
 
 def scegli_file_excel(titolo):
+    # in "Run all mapping" lo stesso file si chiede una volta sola
+    path = pipeline.remembered_file(titolo)
+    if path:
+        return path
     dialog = OpenFileDialog()
     dialog.Title = titolo
     dialog.Filter = "Excel Files (*.xls;*.xlsx)|*.xls;*.xlsx"
     dialog.Multiselect = False
     if dialog.ShowDialog() == DialogResult.OK:
-        return dialog.FileName
+        return pipeline.remember_file(titolo, dialog.FileName)
     else:
         TaskDialog.Show("Errore", "Operazione annullata: file non selezionato.")
         raise SystemExit
 
-def col_letter_to_index(letter):
-    idx = 0
-    for c in letter:
-        if c.isalpha():
-            idx = idx*26 + (ord(c.upper()) - ord('A') + 1)
-    return idx - 1
-
-def _norm_cell(val):
-    """Normalizza celle Excel per confronti: xlrd legge i numeri come float,
-    quindi 13037 diventa 13037.0 e senza questa pulizia non matcha mai."""
-    if val is None:
-        return ""
-    if isinstance(val, float):
-        return str(int(val)) if val == int(val) else str(val)
-    return str(val).strip()
-
-def leggi_colonne(path, sheet_name):
-    wb = xlrd.open_workbook(path)
-    ws = wb.sheet_by_name(sheet_name)
-    cols = []
-    for c in range(ws.ncols):
-        cols.append([ws.cell(r, c).value for r in range(ws.nrows)])
-    return cols
-
 # CONFIGURAZIONE DINAMICA
-ALLEGATO_PATH = scegli_file_excel("Seleziona il file Allegato 2 - Lista Asset Affidamento")
-SHEET_ALLEGATO = "Lista Asset Affidamento"
+# Allegato 2: l'ultimo file scelto si riusa. Il pulsante non ha ambito, quindi
+# CTRL+click = scegli di nuovo; in "Run all mapping" vale l'interruttore
+# "Scegli di nuovo Allegato 2" dell'elenco dell'orchestratore
+session = pipeline.current()
+if session is not None:
+    repick = scope.REPICK_ALLEGATO2 in session.scope.options
+else:
+    repick = scope.wants_choice(globals())
+ALLEGATO_PATH = allegato2.choose_path(lambda: scegli_file_excel(allegato2.TITLE), repick)
+
+# tempi per fase (attivi con SNAM_TIMING=1), dopo la scelta del file
+timer = timing.Timer("ProjectInformation")
 
-# Legge colonne Allegato2
+# Allegato2 indicizzato per codice edificio (e codice + impianto), da cache
 try:
-    cols_allegato = leggi_colonne(ALLEGATO_PATH, SHEET_ALLEGATO)
+    allegato_index = allegato2.load_index(ALLEGATO_PATH)
 except Exception as e:
     TaskDialog.Show('Errore', 'Non posso leggere Excel:\n' + str(e))
     raise SystemExit
+timer.lap("excel")
 
 # Inizio esecuzione
 uiapp = __revit__
@@ -92,23 +84,16 @@ def estrai_segmento_finale(txt):
     return ''
 chiave = estrai_segmento_finale(base)
 
-# Trova righe Allegato con codice e match su colonna J
-colF = cols_allegato[5]
-colJ_idx = col_letter_to_index('J')
-colJ = cols_allegato[colJ_idx]
-
-rows = [i for i in range(1, len(colF)) if _norm_cell(colF[i]) == codice]
+# Trova righe Allegato con codice (indice su colonna F) e match su colonna J
+rows = allegato_index.rows(codice)
 if not rows:
     TaskDialog.Show('Errore', "Codice edificio '" + codice + "' non trovato in Allegato")
     raise SystemExit
 
-# Se piu righe, filtra per chiave su colonna J
+# Se piu righe, filtra per chiave su colonna J (indice codice + impianto)
 sel = rows[0]
 if len(rows) > 1:
-    for i in rows:
-        if _norm_cell(colJ[i]) == chiave:
-            sel = i
-            break
+    sel = allegato_index.row(codice, chiave) or sel
 
 # Estrai e normalizza valori
 title = doc.Title
@@ -139,7 +124,7 @@ project_number = "SNAM-DAM"
 
 # 5) BuildingDescription = colonna G
 idxG = col_letter_to_index('G')
-building_desc = str(cols_allegato[idxG][sel]).strip()
+building_desc = str(allegato2.cell(sel, idxG)).strip()
 
 # 6) IfcDescription = valore fisso
 ifc_desc = "SNAM - Digitalizzazione Patrimonio"
@@ -165,7 +150,7 @@ site_land_title = "[EPSG: 6875]"
 
 # 9) SiteLongName = colonna E
 idxE = col_letter_to_index('E')
-site_long = str(cols_allegato[idxE][sel]).strip()
+site_long = str(allegato2.cell(sel, idxE)).strip()
 
 # 10) SiteName = tutto doc.Title
 site_name = title
@@ -173,7 +158,7 @@ site_name = title
 # 11) BuildingLongName = colonna J + " - " + colonna K
 idxJ = col_letter_to_index('J')
 idxK = col_letter_to_index('K')
-building_long_name = str(cols_allegato[idxJ][sel]).strip() + " - " + str(cols_allegato[idxK][sel]).strip()
+building_long_name = str(allegato2.cell(sel, idxJ)).strip() + " - " + str(allegato2.cell(sel, idxK)).strip()
 
 # Mappa BuiltInParameter valore (solo i 4 built-in richiesti)
 param_map = {
@@ -187,35 +172,55 @@ param_map = {
 proj_info = FilteredElementCollector(doc) \
     .OfClass(ProjectInfo) \
     .FirstElement()
+timer.lap("valori e collector")
+
+# Pianificazione: nel write set solo i valori diversi da quelli attuali,
+# rilanciare il pulsante non sporca il modello
+# (SHIFT+click = dry run, esporta il write set senza toccare il modello)
+DRY_RUN = writeset.is_dry_run(globals())
+write_plan = writeset.WritePlan()
+def set_if_changed(p, value):
+    if p and not p.IsReadOnly:
+        writeset.plan_write(write_plan, proj_info, p, value, 'Parametri progetto')
 
 # Imposta tutti gli altri parametri via LookupParameter
 def set_lookup(name, value):
-    p = proj_info.LookupParameter(name)
-    if p and not p.IsReadOnly:
-        p.Set(value)
+    set_if_changed(proj_info.LookupParameter(name), value)
+
+# Imposta solo i built-in via get_Parameter
+for bip, val in param_map.items():
+    set_if_changed(proj_info.get_Parameter(bip), val)
+
+set_lookup('BuildingDescription',    building_desc)
+set_lookup('IfcDescription',         ifc_desc)
+set_lookup('SiteDescription',        site_desc)
+set_lookup('SiteLandTitleNumber',    site_land_title)
+set_lookup('SiteLongName',           site_long)
+set_lookup('SiteName',               site_name)
+set_lookup('BuildingLongName',       building_long_name)
+timer.lap("pianificazione")
 
 # Transazione per impostare i parametri (con rollback in caso di errore)
-trans = Transaction(doc, 'Set Parametri Progetto')
-trans.Start()
-try:
-    # Imposta solo i built-in via get_Parameter
-    for bip, val in param_map.items():
-        prm = proj_info.get_Parameter(bip)
-        if prm and not prm.IsReadOnly:
-            prm.Set(val)
-
-    set_lookup('BuildingDescription',    building_desc)
-    set_lookup('IfcDescription',         ifc_desc)
-    set_lookup('SiteDescription',        site_desc)
-    set_lookup('SiteLandTitleNumber',    site_land_title)
-    set_lookup('SiteLongName',           site_long)
-    set_lookup('SiteName',               site_name)
-    set_lookup('BuildingLongName',       building_long_name)
-
-    trans.Commit()
-except:
-    if trans.GetStatus() == TransactionStatus.Started:
-        trans.RollBack()
-    raise
-
-TaskDialog.Show('Completato', 'Parametri di progetto aggiornati.')
+written = failed = 0
+if not DRY_RUN:
+    trans = Transaction(doc, 'Set Parametri Progetto')
+    trans.Start()
+    try:
+        written, failed = writeset.apply_plan(write_plan)
+        timer.lap("scritture")
+        trans.Commit()
+        timer.lap("commit")
+    except:
+        if trans.GetStatus() == TransactionStatus.Started:
+            trans.RollBack()
+        raise
+
+timer.elements = 1
+timer.finish()
+if DRY_RUN:
+    csv_path, _ = writeset.export_dry_run(write_plan, 'ProjectInformation')
+    pipeline.notify('Completato', 'Dry run: {} scritture pianificate, nessuna modifica al modello.\n{}'.format(
+        len(write_plan), csv_path))
+else:
+    pipeline.notify('Completato', 'Parametri di progetto aggiornati.\nScritture: {} - invariati (saltati): {} - fallite: {}'.format(
+        written, write_plan.unchanged, failed))
@@ -14,81 +14,61 @@ from Autodesk.Revit.UI import TaskDialog
 # WinForms dialog
 clr.AddReference('System.Windows.Forms')
 from System.Windows.Forms import OpenFileDialog, DialogResult
-from System.Collections.Generic import List as NetList
 # Excel
-import xlrd
+from snam import allegato2, pipeline, scope, timing, writeset
+from snam.params import type_key
+from snam.table import col_letter_to_index, norm as _norm, read_table
 
 # ---------------- Funzione per selezionare un file Excel ----------------
 def scegli_file_excel(titolo):
+    # in "Run all mapping" lo stesso file si chiede una volta sola
+    path = pipeline.remembered_file(titolo)
+    if path:
+        return path
     dialog = OpenFileDialog()
     dialog.Title = titolo
     dialog.Filter = "Excel Files (*.xls;*.xlsx)|*.xls;*.xlsx"
     dialog.Multiselect = False
     if dialog.ShowDialog() == DialogResult.OK:
-        return dialog.FileName
+        return pipeline.remember_file(titolo, dialog.FileName)
     else:
         TaskDialog.Show("Errore", "Operazione annullata: file non selezionato.")
         raise SystemExit
 
 
+uiapp = __revit__
+doc = uiapp.ActiveUIDocument.Document
+# ambito: intero modello; CTRL+click = scelta da elenco (selezione, vista, livelli, workset)
+# con l'interruttore "Scegli di nuovo Allegato 2"
+run_scope = scope.choose(doc, uiapp.ActiveUIDocument, scope.wants_choice(globals()),
+                         switches=[scope.REPICK_ALLEGATO2])
+
 # ------------------- CONFIGURAZIONE DINAMICA -------------------
 # invece di hard-coding i path, apri due dialoghi:
 MAPPE_PATH    = scegli_file_excel("Seleziona il file Regole mappatura per Revit")
-ALLEGATO_PATH = scegli_file_excel("Seleziona il file Allegato 2 - Lista Asset Affidamento")
+# Allegato 2: l'ultimo file scelto si riusa (interruttore del CTRL+click = scegli di nuovo)
+ALLEGATO_PATH = allegato2.choose_path(lambda: scegli_file_excel(allegato2.TITLE),
+                                      scope.REPICK_ALLEGATO2 in run_scope.options)
 SHEET_MAPPE   = "PARAMETRI COMUNI"
-SHEET_ALLEGATO= "Lista Asset Affidamento"
 
 # -------------------------------------------------------
 
-def col_letter_to_index(letter):
-    # A->0, B->1, ..., Z->25, AA->26, etc.
-    idx = 0
-    for c in letter:
-        if c.isalpha(): idx = idx*26 + (ord(c.upper()) - ord('A') + 1)
-    return idx - 1
-
-
-def _norm(val):
-    try:
-        if val is None: return ""
-        # xlrd numbers are float
-        if isinstance(val, float):
-            return str(int(val)) if val.is_integer() else str(val)
-        s = str(val).strip()
-        return s if not re.match(r'^-?\d+\.0$', s) else s[:-2]
-    except:
-        return ""
-
-
-def leggi_colonne(path, sheet_name):
-    wb = xlrd.open_workbook(path)
-    ws = wb.sheet_by_name(sheet_name)
-    cols = []
-    for c in range(ws.ncols):
-        col = [ws.cell(r, c).value for r in range(ws.nrows)]
-        cols.append(col)
-    return cols
-
-def build_param_values(map_cols, all_cols, codice_edificio, file_name):
-    names = map_cols[1]   # colonna B
-    rules = map_cols[2]   # colonna C
-    # trova righe Allegato per codice edificio
-    colF = all_cols[5]
-    # _norm: xlrd legge i numeri come float (13037 -> 13037.0), senza
-    # normalizzazione il confronto con il codice dal nome file non matcha mai
-    rows = [i for i in range(1, len(colF)) if _norm(colF[i]) == codice_edificio]
+def build_param_values(map_tab, all_index, codice_edificio, file_name):
+    names = map_tab.col(1)   # colonna B
+    rules = map_tab.col(2)   # colonna C
+    # trova righe Allegato per codice edificio: indice su colonna F,
+    # chiavi normalizzate (xlrd legge 13037 come 13037.0)
+    rows = all_index.rows(codice_edificio)
     if not rows:
         raise Exception("Codice edificio '{}' non trovato in Allegato".format(codice_edificio))
     sel = rows[0]
     # prefer match su Impianto Tipo (colonna J=9)
-    if len(all_cols) > 9:
-        colJ = all_cols[9]
-        for i in rows:
-            # str/_norm: se la cella J e' numerica, "float in str" solleva TypeError
-            cj = _norm(colJ[i]) if i < len(colJ) else ""
-            if cj and cj in file_name:
-                sel = i
-                break
+    for row in rows:
+        # str/_norm: se la cella J e' numerica, "float in str" solleva TypeError
+        cj = _norm(allegato2.cell(row, allegato2.COL_IMPIANTO))
+        if cj and cj in file_name:
+            sel = row
+            break
 
     values = {}
     for r in range(1, len(names)):
@@ -101,17 +81,54 @@ def build_param_values(map_cols, all_cols, codice_edificio, file_name):
             # estrai lettere colonna excel
             col_letters = m.group(1)
             idx = col_letter_to_index(col_letters)
-            if idx < len(all_cols) and sel < len(all_cols[idx]):
-                raw = all_cols[idx][sel]
+            raw = allegato2.cell(sel, idx, None)
         else:
             # valore fisso
             raw = rule
         values[pname] = _norm(raw)
     return values
 
+def applicable_params(doc, names, cat_ids):
+    """
+    Parametri NP applicabili per categoria, letti una volta da
+    doc.ParameterBindings: {id categoria: (nomi di istanza, nomi di tipo,
+    altri nomi)}. Gli altri nomi non hanno binding sulla categoria ma
+    possono esserci come parametri di famiglia (condivisi o no): si cercano
+    una volta per tipo sulle istanze (vedi family_names). Restituisce anche
+    i nomi con binding su almeno una delle categorie.
+    """
+    per_cat = dict((c, ([], [], [])) for c in cat_ids)
+    bound = set()
+    it = doc.ParameterBindings.ForwardIterator()
+    it.Reset()
+    while it.MoveNext():
+        name = it.Key.Name
+        if name not in names:
+            continue
+        on_type = isinstance(it.Current, TypeBinding)
+        for cat in it.Current.Categories:
+            lists = per_cat.get(cat.Id.IntegerValue)
+            if lists is not None and name not in lists[on_type]:
+                lists[on_type].append(name)
+                bound.add(name)
+    for lists in per_cat.values():
+        lists[2].extend(sorted(n for n in names if n not in lists[0] and n not in lists[1]))
+    return per_cat, bound
+
+def family_names(el, names):
+    """
+    Nomi di names presenti sull'istanza el senza binding (parametri di
+    famiglia), risolti una volta per tipo: le altre istanze dello stesso
+    tipo riusano la lista.
+    """
+    key = type_key(el)
+    found = family_found.get(key)
+    if found is None:
+        found = family_found[key] = [n for n in names if params.get(el, n) is not None]
+        found_names.update(found)
+    return found
+
 # Inizio esecuzione
-uiapp = __revit__
-doc = uiapp.ActiveUIDocument.Document
 # estrai codice edificio dal nome file
 fname = os.path.basename(doc.PathName)
 base = os.path.splitext(fname)[0]
@@ -121,60 +138,94 @@ if len(parts) < 4:
     raise SystemExit
 codice = parts[3].strip()
 
+# tempi per fase (attivi con SNAM_TIMING=1), dopo la scelta dei file
+timer = timing.Timer("ParametriComuni")
+
 # legge Excel
 try:
-    map_cols = leggi_colonne(MAPPE_PATH, SHEET_MAPPE)
-    all_cols = leggi_colonne(ALLEGATO_PATH, SHEET_ALLEGATO)
+    map_tab = read_table(MAPPE_PATH, SHEET_MAPPE, (1, 2))
+    all_index = allegato2.load_index(ALLEGATO_PATH)
 except Exception as e:
     TaskDialog.Show('Errore', 'Impossibile leggere Excel: {}'.format(e))
     raise SystemExit
 
 # costruisce valori
 try:
-    param_values = build_param_values(map_cols, all_cols, codice, fname)
+    param_values = build_param_values(map_tab, all_index, codice, fname)
 except Exception as e:
     TaskDialog.Show('Errore', str(e))
     raise SystemExit
+timer.lap("excel")
 
 # filtra elementi target
 cats = [BuiltInCategory.OST_PipeCurves, BuiltInCategory.OST_PipeFitting, BuiltInCategory.OST_PipeAccessory, BuiltInCategory.OST_GenericModel]
-cat_ids = NetList[ElementId]([ElementId(int(c)) for c in cats])
-elems = FilteredElementCollector(doc)\
-    .WherePasses(ElementMulticategoryFilter(cat_ids))\
-    .WhereElementIsNotElementType()\
-    .ToElements()
+elems = run_scope.elements(doc, cats)
+timer.lap("collector")
+
+# Pianificazione: nel write set solo i valori diversi da quelli attuali
+# (SHIFT+click = dry run, esporta il write set senza toccare il modello)
+DRY_RUN = writeset.is_dry_run(globals())
+write_plan = writeset.WritePlan()
+params = pipeline.resolver()  # handle risolti una volta per tipo
+# ogni elemento tocca solo i parametri associati alla sua categoria; quelli
+# di tipo si scrivono una volta per tipo
+per_cat, bound = applicable_params(doc, param_values, [int(c) for c in cats])
+family_found = {}   # type key -> parametri di famiglia trovati sul tipo
+found_names = set()
+done_types = set()
+
+def _plan(target, names):
+    for pname in names:
+        prm = params.get(target, pname)
+        if prm and not prm.IsReadOnly:
+            writeset.plan_write(write_plan, target, prm, param_values[pname], SHEET_MAPPE)
+
+for el in elems:
+    if el.Category is None:
+        continue
+    inst_names, type_names, other_names = per_cat.get(el.Category.Id.IntegerValue, ((), (), ()))
+    _plan(el, inst_names)
+    if other_names:
+        _plan(el, family_names(el, other_names))
+    if type_names:
+        tid = el.GetTypeId()
+        if tid.IntegerValue not in done_types:
+            done_types.add(tid.IntegerValue)
+            sym = doc.GetElement(tid)
+            if sym is not None:
+                _plan(sym, type_names)
+timer.elements = len(elems)
+timer.lap("pianificazione")
+# assenti: nessun binding sulle categorie elaborate e nessun tipo che li abbia
+never_written = set(param_values) - bound - found_names
 
 # Scrittura parametri
-skipped_params = set()
-written_params = set()
-updated = 0
-trans = Transaction(doc, 'Set Parametri Comuni')
-trans.Start()
-try:
-    for el in elems:
-        for pname, pval in param_values.items():
-            prm = el.LookupParameter(pname)
-            if prm and not prm.IsReadOnly:
-                try:
-                    prm.Set(pval)
-                    updated += 1
-                    written_params.add(pname)
-                except:
-                    skipped_params.add(pname)
-            else:
-                skipped_params.add(pname)
-    trans.Commit()
-except:
-    if trans.GetStatus() == TransactionStatus.Started:
-        trans.RollBack()
-    raise
-
-# Output: segnala solo i parametri MAI scritti su nessun elemento
-# (prima finivano in lista anche nomi validi solo perche' assenti su
-# alcune categorie, pur essendo stati scritti sulle altre)
-never_written = skipped_params - written_params
+updated = failed = 0
+if not DRY_RUN:
+    trans = Transaction(doc, 'Set Parametri Comuni')
+    trans.Start()
+    try:
+        updated, failed = writeset.apply_plan(write_plan)
+        timer.lap("scritture")
+        trans.Commit()
+        timer.lap("commit")
+    except:
+        if trans.GetStatus() == TransactionStatus.Started:
+            trans.RollBack()
+        raise
+
+# Output: parametri che nessuna delle categorie elaborate puo' ricevere
+# (ne' dal binding map ne' dalle famiglie: nome errato su Excel o parametro non presente)
 if never_written:
     msg = 'Parametri mai scritti (nome errato su Excel o assenti nel modello):' + '\n' + '\n'.join(sorted(never_written))
 else:
     msg = 'Tutti i parametri sono stati aggiornati.'
-TaskDialog.Show('Completato', msg)
+msg += '\n\nScritture: {} - invariati (saltati): {} - fallite: {}'.format(updated, write_plan.unchanged, failed)
+if not run_scope.whole:
+    msg += '\nAmbito: {}'.format(run_scope.label)
+if DRY_RUN:
+    csv_path, _ = writeset.export_dry_run(write_plan, 'ParametriComuni')
+    msg = 'Dry run: {} scritture pianificate, nessuna modifica al modello.\n{}\n\n{}'.format(
+        len(write_plan), csv_path, msg)
+timer.finish()
+pipeline.notify('Completato', msg)
@@ -6,6 +6,8 @@ __title__ = 'Clean Parameter\nCA-NC-LC-VAR'
 __author__ = 'Valerio Mascia'
 
 from pyrevit import revit, DB, script, forms
+from System.Collections.Generic import List
+from snam import timing
 
 # Documento Revit attivo
 doc = revit.doc
@@ -23,50 +25,139 @@ def has_content(param):
         return False  # se il parametro non è stringa o altro errore
 
 
-def clear_prefixed_params(el, log_list):
+def is_target_name(name):
+    """Nome con uno dei prefissi ufficiali e non escluso dalla pulizia."""
+    name = (name or "").strip()
+    return any(name.startswith(pref) for pref in official_prefixes) and name not in SKIP_PARAMS
+
+
+def find_prefixed_definitions(doc):
     """
-    Per ogni parametro dell'elemento, se il nome inizia con uno dei prefissi,
-    è modificabile e contiene testo, lo svuota.
+    Definizioni CA/NP/LC/VAR presenti nel documento, risolte una volta sola:
+    parametri di progetto/condivisi associati alle categorie (ParameterBindings)
+    e parametri condivisi caricati tramite famiglie (SharedParameterElement).
+    Restituisce {id ParameterElement: Definition}.
     """
+    found = {}
+    it = doc.ParameterBindings.ForwardIterator()
+    it.Reset()
+    while it.MoveNext():
+        definition = it.Key
+        if is_target_name(definition.Name):
+            found[definition.Id.IntegerValue] = definition
+    for spe in DB.FilteredElementCollector(doc).OfClass(DB.SharedParameterElement):
+        if spe.Id.IntegerValue not in found and is_target_name(spe.Name):
+            found[spe.Id.IntegerValue] = spe.GetDefinition()
+    return found
+
+
+def non_empty_text_rule(param_id):
+    """Regola 'testo diverso da vuoto' (> ""), con le firme delle varie versioni API."""
+    try:
+        return DB.ParameterFilterRuleFactory.CreateGreaterRule(param_id, "", False)
+    except:
+        return DB.ParameterFilterRuleFactory.CreateGreaterRule(param_id, "")
+
+
+def elements_with_value(doc, definitions):
+    """
+    Istanze e tipi con almeno una delle definizioni valorizzata: un solo
+    filtro (OR delle regole) e una sola passata lato Revit.
+    """
+    filters = [DB.ElementParameterFilter(non_empty_text_rule(d.Id)) for d in definitions]
+    if not filters:
+        return []
+    pfilter = filters[0] if len(filters) == 1 else DB.LogicalOrFilter(List[DB.ElementFilter](filters))
+    return DB.FilteredElementCollector(doc).WherePasses(pfilter).ToElements()
+
+
+def clear_param(el, p, name, log_list):
+    """Svuota p se è modificabile e contiene testo."""
+    try:
+        # Salta se di sola lettura, non di testo o vuoto
+        if (p is None
+                or p.IsReadOnly
+                or p.StorageType != DB.StorageType.String
+                or not has_content(p)):
+            return
+        # Reset del valore stringa
+        p.Set("")
+        log_list.append((el.Id.IntegerValue, name))
+    except:
+        # Ignora errori su parametri non compatibili
+        pass
+
+
+def clear_definitions(doc, definitions, log_list):
+    """Svuota le definizioni sugli elementi restituiti dal filtro."""
+    definitions = list(definitions)
+    for el in elements_with_value(doc, definitions):
+        for definition in definitions:
+            clear_param(el, el.get_Parameter(definition), definition.Name, log_list)
+
+
+def family_only_names(el, definitions):
+    """
+    Nomi CA/NP/LC/VAR di el non risolti in definitions: parametri di famiglia
+    non condivisi, che non hanno un ParameterElement e non si filtrano per id.
+    """
+    names = set()
     for p in el.Parameters:
         try:
-            name = (p.Definition.Name or "").strip()
-            # Salta se non inizia con prefisso, è escluso, è di sola lettura o vuoto
-            if (not any(name.startswith(pref) for pref in official_prefixes)
-                    or name in SKIP_PARAMS
-                    or p.IsReadOnly
-                    or not has_content(p)):
+            if p.IsShared or p.Id.IntegerValue in definitions:
                 continue
-            # Reset del valore stringa
-            p.Set("")
-            log_list.append((el.Id.IntegerValue, name))
+            if p.StorageType == DB.StorageType.String and is_target_name(p.Definition.Name):
+                names.add(p.Definition.Name)
         except:
-            # Ignora errori su parametri non compatibili
             continue
+    return names
+
+
+def clear_family_params(doc, definitions, log_list):
+    """
+    Svuota i parametri di famiglia non condivisi con i prefissi. Tutti i tipi
+    e le istanze di un FamilySymbol hanno gli stessi parametri: si cercano sul
+    tipo e su un'istanza campione, e si leggono solo sugli elementi dei tipi
+    che li hanno.
+    """
+    instance_names = {}  # id tipo -> nomi sulle istanze (None: campione non ancora visto)
+    for sym in DB.FilteredElementCollector(doc).OfClass(DB.FamilySymbol):
+        for name in family_only_names(sym, definitions):
+            clear_param(sym, sym.LookupParameter(name), name, log_list)
+        instance_names[sym.Id.IntegerValue] = None
+    for el in DB.FilteredElementCollector(doc).OfClass(DB.FamilyInstance):
+        tid = el.GetTypeId().IntegerValue
+        names = instance_names.get(tid)
+        if names is None:
+            names = instance_names[tid] = family_only_names(el, definitions)
+        for name in names:
+            clear_param(el, el.LookupParameter(name), name, log_list)
+
 
+# tempi per fase (attivi con SNAM_TIMING=1): i prefissi si svuotano in una sola passata
+timer = timing.Timer("CleanParameter")
 
-# --- RACCOLTA ELEMENTI E TIPO ----------------------------------------------
-all_instances = DB.FilteredElementCollector(doc) \
-    .WhereElementIsNotElementType() \
-    .ToElements()
-all_types = DB.FilteredElementCollector(doc) \
-    .WhereElementIsElementType() \
-    .ToElements()
+# --- RISOLUZIONE DEFINIZIONI -----------------------------------------------
+definitions = find_prefixed_definitions(doc)
+timer.lap("definizioni")
 
 # Lista per tracciare i parametri svuotati
 cleared_log = []  # tuple: (elementId, paramName)
 
 # Esecuzione della transazione pyRevit
 with revit.Transaction("Clear Prefixed Parameters"):
-    # Svuota sui singoli elementi
-    for inst in all_instances:
-        clear_prefixed_params(inst, cleared_log)
-    # Svuota sui tipi di elemento
-    for tp in all_types:
-        clear_prefixed_params(tp, cleared_log)
+    # Svuota su istanze e tipi: una passata filtrata per tutte le definizioni
+    clear_definitions(doc, definitions.values(), cleared_log)
+    timer.lap("filtro e scritture")
+    # parametri di famiglia non condivisi (come faceva la scansione completa)
+    clear_family_params(doc, definitions, cleared_log)
+    timer.lap("parametri di famiglia")
+timer.lap("commit")
+timer.elements = len(set(el_id for el_id, _ in cleared_log))
 
 # Mostra risultato all'utente
 message = u"Parametri svuotati: {}".format(len(cleared_log))
+timer.finish()
 forms.alert(message, title="Clear Prefixed Params", ok=True)
 
 # Log nel pannello di output di pyRevit (facoltativo)
@@ -9,20 +9,18 @@ __author__ = 'Valerio Mascia'
 import clr
 import os
 import re
-import xlrd
 import math
+import bisect
 import csv
+from collections import OrderedDict
 from Autodesk.Revit.DB import *
-from Autodesk.Revit.UI import TaskDialog
-from System.Collections.Generic import List as NetList
-
-def col_letter_to_index(letter):
-    idx = 0
-    for c in letter:
-        if c.isalpha():
-            idx = idx * 26 + (ord(c.upper()) - ord('A') + 1)
-    return idx - 1
-"""Converte lettere di colonna Excel (es. 'A', 'AA') nell'indice zero-based (A=0, B=1, ...)."""
+from snam import allegato3, fingerprint, pipeline, runlog, scope, snapshot, timing, writeset
+from snam.table import col_letter_to_index, read_table
+# UnitTypeId non esiste nelle API vecchie: con None _ft_to_mm ripiega su DisplayUnitType
+try:
+    from Autodesk.Revit.DB import UnitTypeId
+except:
+    UnitTypeId = None
 
 _num = re.compile("[-+]?\d*\.?\d+")
 # Regex per catturare il *primo numero* in una stringa (segno opzionale, parte intera e decimale con punto).
@@ -41,20 +39,58 @@ def _first_number(txt):
     return None
 """Estrae il primo numero presente nel testo (supporta virgola decimale), restituendo int se intero, altrimenti float."""
 
+def _ft_to_mm(x_ft):
+    try:
+        # API nuove
+        return UnitUtils.ConvertFromInternalUnits(x_ft, UnitTypeId.Millimeters)
+    except:
+        # API vecchie
+        from Autodesk.Revit.DB import DisplayUnitType
+        return UnitUtils.ConvertFromInternalUnits(x_ft, DisplayUnitType.DUT_MILLIMETERS)
+"""Converte dall'unità interna Revit (feet) ai millimetri, ignorando unità/arrotondamenti della UI."""
+
 DN_PARAMS = [
     BuiltInParameter.RBS_PIPE_DIAMETER_PARAM,
     BuiltInParameter.RBS_PIPE_OUTER_DIAMETER
 ]
 
-def _get_dn(el):
+def _get_dn(snap):
     for bip in DN_PARAMS:
-        prm = el.get_Parameter(bip)
-        if prm:
-            num = _first_number(prm.AsValueString() or "")
-            if num is not None:
-                return int(round(num))
+        prm = snap.bip(bip)
+        if prm and prm.HasValue and prm.StorageType == StorageType.Double:
+            try:
+                return int(round(_ft_to_mm(prm.AsDouble())))
+            except:
+                pass
     return None
-"""Ricava il DN del tubo leggendo i parametri diametro (visualizzati), restituisce un intero (arrotondato) o None."""
+"""Ricava il DN del tubo in mm direttamente da AsDouble() (non dalla stringa formattata della UI), intero arrotondato o None."""
+
+DN_TOL_MM = 0.5
+# tolleranza (mm) per il match approssimato del DN quando manca il valore esatto
+
+def _build_dn_index(colDN):
+    exact = {}
+    for irow in range(1, len(colDN)):
+        n = _first_number(colDN[irow])
+        if n is not None and n not in exact:
+            exact[n] = irow
+    return exact, sorted(exact)
+"""Indicizza la colonna DN di un foglio GASD: (dict DN -> prima riga, lista DN ordinata per la ricerca con bisect)."""
+
+def _dn_row(dn_index, dn, tol=DN_TOL_MM):
+    exact, keys = dn_index
+    row = exact.get(dn)
+    if row is not None:
+        return row
+    i = bisect.bisect_left(keys, dn)
+    best = None
+    for j in (i - 1, i):
+        if 0 <= j < len(keys):
+            d = abs(keys[j] - dn)
+            if d <= tol and (best is None or d < abs(best - dn)):
+                best = keys[j]
+    return exact[best] if best is not None else None
+"""Riga del DN: hit esatto sul dict, altrimenti DN più vicino entro la tolleranza (bisect); None se assente."""
 
 
 def _param_to_str(prm):
@@ -80,29 +116,16 @@ def _val_to_str(val):
 """Converte un valore generico in stringa; se numero, mantiene i decimali quando presenti (es. 5.0 -> '5')."""    
 
 
-def _read_cols(path, sheet):
-    wb = xlrd.open_workbook(path)
-    ws = wb.sheet_by_name(sheet)
-    cols = []
-    for c in range(ws.ncols):
-        col = []
-        for r in range(ws.nrows):
-            col.append(ws.cell(r, c).value)
-        cols.append(col)
-    return cols
-"""Legge un foglio Excel e restituisce la matrice per colonne: cols[c][r] = cella (riga r, colonna c)."""
-
-
-def _get_type_name_pipe(el, doc):
+def _get_type_name_pipe(snap, doc, types):
     try:
-        typ = doc.GetElement(el.GetTypeId())
+        typ = types.type_of(doc, snap.element)
         if typ:
-            p = typ.get_Parameter(BuiltInParameter.SYMBOL_NAME_PARAM)
+            p = typ.bip(BuiltInParameter.SYMBOL_NAME_PARAM)
             return (p.AsString() or "") if p else ""
     except:
         pass
     return ""
-"""Restituisce il Type Name dell’elemento pipe (stringa vuota se non disponibile)."""
+"""Restituisce il Type Name dell’elemento pipe dall'istantanea del tipo (stringa vuota se non disponibile)."""
 
 
 def _format_number_keep_decimals(n):
@@ -114,19 +137,6 @@ def _format_number_keep_decimals(n):
         return str(n)
 """Formatta un numero in stringa senza zeri inutili: 88.0 -> '88'; 88.12 -> '88.12' (massimo 6 decimali)."""
 
-def _set_safe(prm, v):
-    """Set con fallback SetValueString: un valore non compatibile non deve
-    far saltare l'intera transazione."""
-    try:
-        prm.Set(v)
-        return True
-    except:
-        try:
-            prm.SetValueString(v)
-            return True
-        except:
-            return False
-
 def _read_csv_rows(path):
     with open(path, 'rb') as fb:
         raw = fb.read().decode('utf-8-sig', 'ignore')
@@ -160,7 +170,363 @@ def to_date_ddmmyyyy(s):
     return ("%02d%s%04d" % (d, mm, y4))
 
 
-def process_document(doc):
+# ---------- Piano regole precompilato ----------
+# Le descrizioni del foglio "BARRE (CATEGORIA TUBAZIONI)" vengono analizzate
+# una sola volta per esecuzione: ogni regola diventa una funzione
+# ev(el, prm, st) -> valore stringa da scrivere (None = nessuna scrittura).
+# st e' un dict per-elemento condiviso tra le regole (es. DN gia' calcolato).
+
+_RE_COLONNA = re.compile(r"colonna\s+([A-Za-z]+)", re.I)
+_RE_FOGLIO  = re.compile(r'foglio\s+"([^"]+)"')
+_RE_QUOTED  = re.compile(r'"([^"]+)"')
+_RE_PAREN   = re.compile(r"\(([^)]+)\)")
+_RE_PAIR    = re.compile(r"\(([^()]*)\)")
+_RE_M_SRC   = re.compile(r'\s*"([^"]+)"')
+
+
+
+def _add_input(ctx, key, reader):
+    ctx["inputs"].setdefault(key, reader)
+"""Registra un input per l'impronta dell'elemento: reader(snap) -> valore confrontabile (una volta per chiave)."""
+
+
+def _bip_input(ctx, bip):
+    _add_input(ctx, bip, lambda snap: fingerprint.param_token(snap.bip(bip)))
+
+
+def _name_input(ctx, name):
+    _add_input(ctx, name, lambda snap: fingerprint.param_token(snap.get(name)))
+
+
+def _const_rule(value):
+    return lambda el, prm, st: value
+"""Regola a valore costante per tutta l'esecuzione (C, G, P)."""
+
+
+def _warn_rule(ctx, tgt, msg):
+    def ev(el, prm, st):
+        ctx["log"].warning(None, tgt, el.Id.IntegerValue, msg)
+        return None
+    return ev
+"""Regola malformata in Excel: non scrive e segnala il warning su ogni elemento (come prima)."""
+
+
+def _load_sheet(ctx, sht):
+    cache = ctx["cache"]
+    if sht not in cache:
+        try:
+            cache[sht] = read_table(ctx["excel_path"], sht, ctx["x_cols"][sht])
+        except:
+            cache[sht] = None
+        # nel tuo file le DN stanno nella 2ª colonna (indice 1)
+        data = cache[sht]
+        ctx["dn_index"][sht] = _build_dn_index(data.col(1) if data is not None else [])
+    return cache[sht]
+"""Carica (lazy, una volta sola) un foglio del file regole usato dalla regola X, solo colonna DN e colonne delle regole X, e ne costruisce l'indice DN."""
+
+
+ALLEGATO3_KEY = "BARRE"  # su Allegato 3 la chiave è sempre BARRE (match esatto e case-sensitive)
+
+def _load_allegato3(ctx):
+    if "allegato3" not in ctx:
+        try:
+            table = allegato3.load_table(ctx["allegato3_path"], ctx["allegato3_sheet"],
+                                         ctx["allegato3_cols"])
+            # chiave costante: la riga si risolve una volta per esecuzione
+            ctx["allegato3"] = (table, allegato3.find_row(table, ALLEGATO3_KEY, allegato3.exact_key))
+        except:
+            ctx["allegato3"] = None
+    return ctx["allegato3"]
+"""Carica (lazy, una volta sola) Allegato 3 per la regola J: (Table, riga BARRE o None); None se non leggibile."""
+
+
+def _compile_x(tgt, desc, ctx):
+    mcol = _RE_COLONNA.search(desc)
+    msht = _RE_FOGLIO.search(desc)
+    if not (mcol and msht):
+        return None
+    sht = ctx["dn_lookup"].get(msht.group(1), msht.group(1))
+    idx = col_letter_to_index(mcol.group(1))
+    ctx["x_cols"].setdefault(sht, set([1])).add(idx)
+    for bip in DN_PARAMS:
+        _bip_input(ctx, bip)
+    log = ctx["log"]
+
+    def ev(el, prm, st):
+        data = _load_sheet(ctx, sht)
+        if data is None or not data.ncols:
+            log.warning(None, tgt, el.Id.IntegerValue, "X: foglio '{}' non leggibile", sht)
+            return None
+        if "dn" not in st:
+            st["dn"] = _get_dn(st["snap"])
+        dn = st["dn"]
+        if dn is None:
+            log.warning(None, tgt, el.Id.IntegerValue, "DN non trovato")
+            return None
+        row = _dn_row(ctx["dn_index"][sht], dn)
+        if row is None:
+            log.warning(None, tgt, el.Id.IntegerValue, "DN {} non in {}", dn, sht)
+            return None
+        v = data.value(row, idx, None)
+        return _val_to_str(v) if v is not None else None
+    return ev
+"""X: lookup su foglio GASD dichiarato in descrizione (match per DN del tubo)."""
+
+
+def _compile_z(tgt, desc, ctx):
+    log = ctx["log"]
+    # In Excel il BuiltInParameter è senza virgolette
+    try:
+        bip = getattr(BuiltInParameter, (desc or "").strip())
+    except:
+        bip = None
+    if bip is not None:
+        _bip_input(ctx, bip)
+
+    def ev(el, prm, st):
+        src = None
+        if bip is not None:
+            try:
+                src = st["snap"].bip(bip)
+            except:
+                src = None
+        if not src:
+            log.warning(None, tgt, el.Id.IntegerValue, 'Z: BuiltInParameter "{}" non trovato', desc)
+            return None
+
+        # I target, sono di testo
+        if prm.StorageType != StorageType.String:
+            log.warning(None, tgt, el.Id.IntegerValue, "Z: il parametro destinazione non è di tipo Testo")
+            return None
+
+        s_out = None
+        if src.StorageType == StorageType.Double:
+            # Converti SEMPRE dall'unità interna (feet) ai millimetri
+            try:
+                s_out = _format_number_keep_decimals(round(_ft_to_mm(src.AsDouble()), 6))  # 88.0 -> "88", 88.9 -> "88.9"
+            except:
+                s_out = None
+
+        # se ancora None, prova AsString() (non AsValueString, per evitare arrotondamenti UI)
+        if s_out is None:
+            s = (src.AsString() or "").strip()
+            if s:
+                n = _first_number(s)
+                if n is not None:
+                    s_out = _format_number_keep_decimals(n)
+
+        if not s_out:
+            log.warning(None, tgt, el.Id.IntegerValue, "Z: nessun valore interpretabile dal parametro sorgente")
+            return None
+        return s_out
+    return ev
+"""Z: copia in mm (testo) di un BuiltInParameter risolto una sola volta dal nome in descrizione."""
+
+
+def _compile_g(tgt, desc, ctx):
+    keys = _RE_QUOTED.findall(desc)
+    vals = _RE_PAREN.findall(desc)
+    tv = vals[0].strip() if vals else ""
+    fv = vals[1].strip() if len(vals) > 1 else ""
+    chosen = tv if ctx["segG"] in keys else fv
+    return _const_rule(_val_to_str(chosen))
+"""G: segmento titolo progetto; il titolo non cambia durante l'esecuzione, quindi il valore è costante."""
+
+
+def _compile_k(tgt, desc, ctx):
+    parts_k = desc.split(";", 1)
+    left = parts_k[0].strip() if len(parts_k) >= 1 else ""
+    right = parts_k[1].strip() if len(parts_k) == 2 else ""
+    neg = left or right
+    pos = right or left
+    neg = _val_to_str(neg) if neg != "" else None
+    pos = _val_to_str(pos) if pos != "" else None
+    _bip_input(ctx, BuiltInParameter.RBS_OFFSET_PARAM)
+
+    def ev(el, prm, st):
+        elev = None
+        try:
+            off = st["snap"].bip(BuiltInParameter.RBS_OFFSET_PARAM)
+            if off and off.StorageType == StorageType.Double:
+                elev = off.AsDouble()  # feet; confronto solo segno
+        except:
+            elev = None
+        return neg if (elev is not None and elev < 0.0) else pos
+    return ev
+"""K: due opzioni separate da ';' scelte in base al segno dell'offset."""
+
+
+def _compile_j(tgt, desc, ctx):
+    mcol = _RE_COLONNA.search(desc or "")
+    if not mcol:
+        return _warn_rule(ctx, tgt, "J: 'colonna X' non specificata")
+    col_l = mcol.group(1).upper()
+    idx_out = col_letter_to_index(col_l)
+    ctx["allegato3_cols"].add(idx_out)
+    doc = ctx["doc"]
+    log = ctx["log"]
+    types = ctx["types"]
+    _add_input(ctx, "type_name", lambda snap: _get_type_name_pipe(snap, doc, types))
+
+    def ev(el, prm, st):
+        loaded = _load_allegato3(ctx)
+        if loaded is None:
+            log.warning(None, tgt, el.Id.IntegerValue, "J: impossibile aprire Allegato 3")
+            return None
+        table, row = loaded
+        if idx_out < 0 or idx_out >= table.ncols:
+            log.warning(None, tgt, el.Id.IntegerValue, "J: colonna '{}' fuori range", col_l)
+            return None
+
+        # >>> Trigger solo se Type Name inizia con "BARRE" o "Tubaz" (case-sensitive)
+        type_name_raw = _get_type_name_pipe(st["snap"], doc, types) or ""
+        if not (type_name_raw.startswith("BARRE") or type_name_raw.startswith("Tubaz")):
+            log.warning(None, tgt, el.Id.IntegerValue, "J: Type Name non inizia con 'BARRE' o 'Tubaz'")
+            return None
+
+        if row is None:
+            log.warning(None, tgt, el.Id.IntegerValue, "J: chiave '{}' non trovata in col. A", ALLEGATO3_KEY)
+            return None
+        return _val_to_str(table.value(row, idx_out))
+    return ev
+"""J: Allegato 3, 'colonna X', solo per Type Name che inizia con "BARRE" o "Tubaz"."""
+
+
+def _compile_m(tgt, desc, ctx):
+    msrc = _RE_M_SRC.match(desc or "")
+    if not msrc:
+        return _warn_rule(ctx, tgt, "M: parametro sorgente non specificato")
+    src_name = msrc.group(1).strip()
+    # (SRC_VAL, OUT_VAL): vince la prima coppia con SRC_VAL uguale (come prima)
+    pairs = {}
+    for pair in _RE_PAIR.findall(desc or ""):
+        bits = pair.split(",", 1)
+        if len(bits) >= 2 and bits[0].strip() not in pairs:
+            out = bits[1].strip()
+            pairs[bits[0].strip()] = _val_to_str(out) if out != "" else None
+    _name_input(ctx, src_name)
+    log = ctx["log"]
+
+    def ev(el, prm, st):
+        srcp = st["snap"].get(src_name)
+        if srcp is None:
+            log.warning(None, tgt, el.Id.IntegerValue, "M: parametro sorgente '{}' non trovato", src_name)
+            return None
+        return pairs.get(_param_to_str(srcp).strip())
+    return ev
+"""M: mapping da parametro sorgente istanza "SRC" -> (SRC_VAL, OUT_VAL)."""
+
+
+def _compile_p(tgt, desc, ctx):
+    # In descrizione di Excel è scritto "colonna X"
+    m_col = _RE_COLONNA.search(desc)
+    if not m_col:
+        return _warn_rule(ctx, tgt, "P: 'colonna X' non specificata")
+    idx_out = col_letter_to_index(m_col.group(1).upper())
+    row = ctx["csv_by_key"].get(ctx["segP"])
+
+    # default N/C se chiave o colonna non disponibili
+    v = "N/C"
+    if row and 0 <= idx_out < len(row):
+        cand = row[idx_out]
+        if cand is not None and str(cand).strip() != '':
+            s = str(cand).strip()
+            # normalizzazioni come negli Accessori
+            if s.lower() == 'esercizio':
+                s = 'Operativo'
+            v = to_date_ddmmyyyy(s)
+    return _const_rule(_val_to_str(v))
+"""P: CSV di linea come negli Accessori; la chiave deriva dal titolo, quindi il valore è costante."""
+
+
+def _compile_l(tgt, desc, ctx):
+    rule_desc = desc
+    # tolgo quadre esterne
+    if rule_desc.startswith("[") and rule_desc.endswith("]"):
+        rule_desc = rule_desc[1:-1].strip()
+
+    # estraggo il nome del parametro sorgente (tra le prime virgolette)
+    src_match = re.match(r'"([^"]+)"', rule_desc)
+    if not src_match:
+        ctx["log"].warning(None, tgt, None, "L: parametro sorgente non trovato in regola L")
+        return None
+    source_name = src_match.group(1)
+
+    # divido per '-' ogni condizione
+    cond_map = {}
+    for part in rule_desc.split("-"):
+        part = part.strip()
+        start = part.find("[")
+        end   = part.find("]")
+        if start >= 0 and end > start:
+            cond_map[part[:start].strip().lower()] = part[start+1:end].strip()
+    default_val = cond_map.get("default", "")
+    _name_input(ctx, source_name)
+
+    def ev(el, prm, st):
+        srcp = st["snap"].get(source_name)
+        val_key = ""
+        if srcp:
+            # sorgente scritta da una regola precedente nello stesso passaggio:
+            # vale il valore pianificato (quello che avra' dopo la scrittura),
+            # anche se nel modello il parametro e' ancora vuoto
+            cur = st["planned"].get(source_name)
+            if cur is None:
+                cur = srcp.AsString()
+            if cur is not None:
+                val_key = cur.strip().lower()
+        chosen = cond_map.get(val_key, default_val)
+        return chosen if chosen != "" else None
+    return ev
+"""L: valore scelto dal valore (testo) del parametro sorgente, "SRC" - val[OUT] - ... - default[OUT]."""
+
+
+_RULE_COMPILERS = {
+    "C": lambda tgt, desc, ctx: _const_rule(_val_to_str(desc)),
+    "X": _compile_x,
+    "Z": _compile_z,
+    "G": _compile_g,
+    "K": _compile_k,
+    "J": _compile_j,
+    "M": _compile_m,
+    "P": _compile_p,
+    "L": _compile_l,
+}
+
+# messaggi di warning se la scrittura fallisce (le altre regole falliscono in silenzio)
+_SET_FAIL_MSG = {
+    "Z": "Z: errore in Set('{}')",
+    "P": "P: errore in Set/SetValueString",
+}
+
+
+def compile_rules(rules, ctx):
+    plan = []
+    seen_l = False
+    for tgt, code, desc in rules:
+        compiler = _RULE_COMPILERS.get(code)
+        if compiler is None:
+            # N/C e codici sconosciuti -> ignorati
+            continue
+        if code == "L":
+            # come lo step 2 originale: vale solo la prima riga L del foglio
+            if seen_l:
+                continue
+            seen_l = True
+        ev = compiler(tgt, desc, ctx)
+        if ev is not None:
+            plan.append((tgt, code, ev))
+    # L legge i target delle altre regole: va valutata dopo (sort stabile)
+    plan.sort(key=lambda r: r[1] == "L")
+    # un target scritto da questo pulsante non e' un input: il suo valore
+    # dipende dagli altri input (altrimenti il rilancio non salterebbe mai)
+    for tgt, _, _ in rules:
+        ctx["inputs"].pop(tgt, None)
+    return plan
+"""Trasforma le regole (target, codice, descrizione) nel piano [(target, codice, ev)]."""
+
+
+def process_document(doc, dry_run=False, run_scope=None):
     excel_path = "C:\\Users\\2Dto6D\\OneDrive\\Desktop\\Techfem_Parametri\\Regole mappatura per Revit_2Dto6D.xlsx"
     sheet = "BARRE (CATEGORIA TUBAZIONI)"
     dn_lookup = {"BARRE_GASD": "BARRE_GASD"}
@@ -172,24 +538,22 @@ def process_document(doc):
     # Allegato 3 per la regola J
     allegato3_path = "C:\\Users\\2Dto6D\\OneDrive\\Desktop\\Techfem_Parametri\\Allegato 3 - Classi e mappatura IFC.xlsx"
     allegato3_sheet = "Elenco NO"
-    allegato_data = None  # caricato lazy al primo uso di J
 
-    cols = _read_cols(excel_path, sheet)
-    names = [str(c).strip() for c in cols[1]]
-    codes = [str(c).strip().upper() for c in cols[2]]
-    descs = [str(c).strip() for c in cols[3]]
+    # tempi per fase e per regola (attivi con SNAM_TIMING=1)
+    timer = timing.Timer("PipeMapping")
+    rules_table = read_table(excel_path, sheet, (1, 2, 3))
+    names = [str(c).strip() for c in rules_table.col(1)]
+    codes = [str(c).strip().upper() for c in rules_table.col(2)]
+    descs = [str(c).strip() for c in rules_table.col(3)]
     rules = []
     for i in range(1, len(names)):
         if names[i]:
             rules.append((names[i], codes[i], descs[i]))
+    timer.lap("excel regole")
 
-    pipes = FilteredElementCollector(doc) \
-        .WherePasses(ElementMulticategoryFilter(NetList[ElementId]([
-            ElementId(int(BuiltInCategory.OST_PipeCurves))
-        ]))) \
-        .WhereElementIsNotElementType() \
-        .ToElements()
-
+    run_scope = run_scope or scope.Scope(scope.MODEL)
+    pipes = run_scope.elements(doc, [BuiltInCategory.OST_PipeCurves])
+    timer.lap("collector")
 
     # --- derivazione chiave P dal titolo (stessa trasformazione degli Accessori)
     def _transform_ap_key(s):
@@ -222,353 +586,120 @@ def process_document(doc):
                         csv_by_key[k] = row
     except:
         csv_by_key = {}
+    timer.lap("csv")
 
-    cache = {}
     parts = (doc.Title or "").split("-")
     segG = parts[4] if len(parts) > 4 else ""
     res_params = {}
-    warnings = []
-
-    # STEP 1 (tutte le regole eccetto L)
-    t1 = Transaction(doc, "Mappa Barre Step1")
-    t1.Start()
-    try:
-        for el in pipes:
-            dn_cache = None
-            for tgt, code, desc in rules:
-                if code == "L":
-                    continue
-                prm = el.LookupParameter(tgt)
-                if prm is None or prm.IsReadOnly:
-                    continue
-
-                # --- (RIMOSSA) N/C: ora ignorata ---
-                if code == "N/C":
-                    # Ignora: non scrive, non conta, nessun warning
-                    continue
-
-                # C (costante)
-                if code == "C":
-                    v = _val_to_str(desc)
-                    _set_safe(prm, v)
-                    res_params[tgt] = v
-                    continue
-
-                # X (lookup su foglio GASD dichiarato in descrizione: DN match)
-                if code == "X":
-                    mcol = re.search(r"colonna\s+([A-Za-z]+)", desc, re.I)
-                    msht = re.search(r'foglio\s+"([^"]+)"', desc)
-                    if mcol and msht:
-                        sht = dn_lookup.get(msht.group(1), msht.group(1))
-                        if sht not in cache:
-                            try:
-                                cache[sht] = _read_cols(excel_path, sht)
-                            except:
-                                cache[sht] = []
-                        data = cache[sht]
-                        if not data:
-                            warnings.append((tgt, "X: foglio '{}' non leggibile".format(sht)))
-                            continue
-                        if dn_cache is None:
-                            dn_cache = _get_dn(el)
-                        if dn_cache is None:
-                            warnings.append((tgt, "DN non trovato"))
-                            continue
-                        # nel tuo file le DN stanno in data[1] (2ª colonna)
-                        colDN = data[1]
-                        row = None
-                        for irow in range(1, len(colDN)):
-                            if _first_number(colDN[irow]) == dn_cache:
-                                row = irow
-                                break
-                        if row is None:
-                            warnings.append((tgt, "DN " + str(dn_cache) + " non in " + sht))
-                            continue
-                        idx = col_letter_to_index(mcol.group(1))
-                        if idx < len(data) and row < len(data[idx]):
-                            val = data[idx][row]
-                            vstr = _val_to_str(val)
-                            _set_safe(prm, vstr)
-                            res_params[tgt] = vstr
-                    continue
-
-                # ---- PROCESSO Z (sostituisci SOLO questo blocco) ----
-                if code == "Z":
-                    # In Excel il BuiltInParameter è senza virgolette
-                    src = None
-                    try:
-                        bip = getattr(BuiltInParameter, (desc or "").strip())
-                        src = el.get_Parameter(bip)
-                    except:
-                        src = None
-
-                    if not src:
-                        warnings.append((tgt, 'Z: BuiltInParameter "{}" non trovato'.format(desc)))
-                        continue
-
-                    # I target, sono di testo
-                    if prm.StorageType != StorageType.String:
-                        warnings.append((tgt, "Z: il parametro destinazione non è di tipo Testo"))
-                        continue
-
-                    # ---- dentro if code == "Z":, sostituisci SOLO la gestione dei Double ----
-
-                    s_out = None
-
-                    if src.StorageType == StorageType.Double:
-                        # Converti SEMPRE dall'unità interna (feet) ai millimetri,
-                        # ignorando le unità/arrotondamenti della UI
-                        try:
-                            # API nuove
-                            try:
-                                from Autodesk.Revit.DB import UnitTypeId
-                                mm = UnitUtils.ConvertFromInternalUnits(src.AsDouble(), UnitTypeId.Millimeters)
-                            except:
-                                # API vecchie
-                                from Autodesk.Revit.DB import DisplayUnitType
-                                mm = UnitUtils.ConvertFromInternalUnits(src.AsDouble(), DisplayUnitType.DUT_MILLIMETERS)
-
-                            s_out = _format_number_keep_decimals(round(mm, 6))  # 88.0 -> "88", 88.9 -> "88.9"
-                        except:
-                            s_out = None
-
-                    # se ancora None, prova AsString() (non AsValueString, per evitare arrotondamenti UI)
-                    if s_out is None:
-                        s = (src.AsString() or "").strip()
-                        if s:
-                            n = _first_number(s)
-                            if n is not None:
-                                s_out = _format_number_keep_decimals(n)
-
-
-                    if not s_out:
-                        warnings.append((tgt, "Z: nessun valore interpretabile dal parametro sorgente"))
-                        continue
-
-                    try:
-                        prm.Set(s_out)
-                        res_params[tgt] = s_out
-                    except:
-                        warnings.append((tgt, "Z: errore in Set('{}')".format(s_out)))
-                    continue
-
-                # G (segmento titolo progetto)
-                if code == "G":
-                    keys = re.findall(r'"([^"]+)"', desc)
-                    vals = re.findall(r"\(([^)]+)\)", desc)
-                    tv = vals[0].strip() if vals else ""
-                    fv = vals[1].strip() if len(vals) > 1 else ""
-                    chosen = tv if segG in keys else fv
-                    vstr = _val_to_str(chosen)
-                    _set_safe(prm, vstr)
-                    res_params[tgt] = vstr
-                    continue
-
-                # K (NUOVA) -> due opzioni separate da ';' in base a offset < 0
-                if code == "K":
-                    left, right = "", ""
-                    parts_k = desc.split(";", 1)
-                    if len(parts_k) >= 1:
-                        left = parts_k[0].strip()
-                    if len(parts_k) == 2:
-                        right = parts_k[1].strip()
-                    elev = None
-                    try:
-                        off = el.get_Parameter(BuiltInParameter.RBS_OFFSET_PARAM)
-                        if off and off.StorageType == StorageType.Double:
-                            elev = off.AsDouble()  # feet; confronto solo segno
-                    except:
-                        elev = None
-                    choice = (left or right) if (elev is not None and elev < 0.0) else (right or left)
-                    if choice != "":
-                        vstr = _val_to_str(choice)
-                        _set_safe(prm, vstr)
-                        res_params[tgt] = vstr
-                    continue
-
-                # J (MODIFICATA) -> Allegato 3, 'colonna X'
-                # Condizione: compila SOLO se TYPE NAME inizia con "BARRE" o "Tubaz" (case-sensitive)
-                # Lookup: la chiave in colonna A è SEMPRE "BARRE"
-                if code == "J":
-                    # carica Allegato 3 la prima volta
-                    if allegato_data is None:
-                        try:
-                            allegato_data = _read_cols(allegato3_path, allegato3_sheet)
-                        except:
-                            allegato_data = None
-                    if allegato_data is None:
-                        warnings.append((tgt, "J: impossibile aprire Allegato 3"))
-                        continue
-
-                    mcol = re.search(r"colonna\s+([A-Za-z]+)", desc or "", re.I)
-                    if not mcol:
-                        warnings.append((tgt, "J: 'colonna X' non specificata"))
-                        continue
-                    idx_out = col_letter_to_index(mcol.group(1).upper())
-                    if idx_out < 0 or idx_out >= len(allegato_data):
-                        warnings.append((tgt, "J: colonna '{}' fuori range".format(mcol.group(1).upper())))
-                        continue
-
-                    # >>> Trigger solo se Type Name inizia con "BARRE" o "Tubaz" (case-sensitive)
-                    type_name_raw = _get_type_name_pipe(el, doc) or ""
-                    if type_name_raw.startswith("BARRE") or type_name_raw.startswith("Tubaz"):
-                        key = "BARRE"  # su Allegato 3 la chiave è sempre BARRE
-                    else:
-                        warnings.append((tgt, "J: Type Name non inizia con 'BARRE' o 'Tubaz'"))
-                        continue
-
-                    colA = allegato_data[0] if len(allegato_data) > 0 else []
-                    row = None
-                    for irow in range(1, len(colA)):
-                        if str(colA[irow]).strip() == key:  # match esatto e case-sensitive
-                            row = irow
-                            break
-                    if row is None:
-                        warnings.append((tgt, "J: chiave '{}' non trovata in col. A".format(key)))
-                        continue
-                    if row >= len(allegato_data[idx_out]):
-                        warnings.append((tgt, "J: riga {} oltre dati col. {}".format(row, mcol.group(1).upper())))
-                        continue
-
-                    val = allegato_data[idx_out][row]
-                    vstr = _val_to_str(val)
-                    _set_safe(prm, vstr)
-                    res_params[tgt] = vstr
-                    continue
-
-
-
-                # M (NUOVA) -> mapping da parametro sorgente istanza "SRC" -> (SRC_VAL, OUT_VAL)
-                if code == "M":
-                    msrc = re.match(r'\s*"([^"]+)"', desc or "")
-                    if not msrc:
-                        warnings.append((tgt, "M: parametro sorgente non specificato"))
-                        continue
-                    src_name = msrc.group(1).strip()
-                    srcp = el.LookupParameter(src_name)
-                    if srcp is None:
-                        warnings.append((tgt, "M: parametro sorgente '{}' non trovato".format(src_name)))
-                        continue
-                    src_val = _param_to_str(srcp).strip()
-                    chosen = None
-                    for pair in re.findall(r"\(([^()]*)\)", desc or ""):
-                        bits = pair.split(",", 1)
-                        if len(bits) >= 2 and src_val == bits[0].strip():
-                            chosen = bits[1].strip()
-                            break
-                    if chosen is not None and chosen != "":
-                        vstr = _val_to_str(chosen)
-                        _set_safe(prm, vstr)
-                        res_params[tgt] = vstr
-                    continue
-            
-
-                # P (CSV di linea come negli Accessori)
-                if code == "P":
-                    # In descrizione di Excel è scritto "colonna X"
-                    m_col = re.search(r"colonna\s+([A-Za-z]+)", desc, re.I)
-                    if not m_col:
-                        warnings.append((tgt, "P: 'colonna X' non specificata"))
-                        continue
-
-                    idx_out = col_letter_to_index(m_col.group(1).upper())
-                    row = csv_by_key.get(segP)
-
-                    # default N/C se chiave o colonna non disponibili
-                    v = "N/C"
-                    if row and 0 <= idx_out < len(row):
-                        cand = row[idx_out]
-                        if cand is not None and str(cand).strip() != '':
-                            s = str(cand).strip()
-                            # normalizzazioni come negli Accessori
-                            if s.lower() == 'esercizio':
-                                s = 'Operativo'
-                            s = to_date_ddmmyyyy(s)
-                            v = s
-
-                    try:
-                        prm.Set(_val_to_str(v))
-                        res_params[tgt] = _val_to_str(v)
-                    except:
-                        try:
-                            prm.SetValueString(_val_to_str(v))
-                            res_params[tgt] = _val_to_str(v)
-                        except:
-                            warnings.append((tgt, "P: errore in Set/SetValueString"))
-                    continue
-
-        # end for rules
-        t1.Commit()
-    except:
-        if t1.GetStatus() == TransactionStatus.Started:
-            t1.RollBack()
-        raise
-
-    # STEP 2: regola L (immutata)
-    l_rule = None
-    for r in rules:
-        if r[1] == "L":
-            l_rule = r
-            break
-
-    if l_rule is not None:
-        target_param, _, rule_desc = l_rule
-
-        # tolgo quadre esterne
-        if rule_desc.startswith("[") and rule_desc.endswith("]"):
-            rule_desc = rule_desc[1:-1].strip()
-
-        # estraggo il nome del parametro sorgente (tra le prime virgolette)
-        src_match = re.match(r'"([^"]+)"', rule_desc)
-        if not src_match:
-            TaskDialog.Show("Errore", "Parametro sorgente non trovato in regola L.")
+    # warning per (regola, messaggio) con conteggio e id di esempio, formattati solo a fine run
+    log = runlog.RunLog()
+    # parametri letti da un'istantanea per elemento (una sola iterazione di
+    # el.Parameters) e per tipo (condivisa tra le istanze dello stesso tipo)
+    types = pipeline.snapshots()
+
+    # Compila le regole una sola volta: nel ciclo sugli elementi restano
+    # solo lettura degli input e scrittura dei valori
+    ctx = {
+        "doc": doc,
+        "excel_path": excel_path,
+        "dn_lookup": dn_lookup,
+        "cache": {},
+        "x_cols": {},
+        "dn_index": {},
+        "allegato3_path": allegato3_path,
+        "allegato3_sheet": allegato3_sheet,
+        "allegato3_cols": set(),
+        "segG": segG,
+        "segP": segP,
+        "csv_by_key": csv_by_key,
+        "log": log,
+        "types": types,
+        "inputs": OrderedDict(),
+    }
+    plan = [(tgt, code, timer.wrap(code, ev)) for tgt, code, ev in compile_rules(rules, ctx)]
+    # impronte degli input del run precedente: gli elementi invariati si saltano
+    # (regole, workbook, CSV e titolo entrano nel contesto: se cambiano si rifa' tutto)
+    fps = fingerprint.FingerprintStore(doc, "PipeMapping", (
+        "pipe/1", rules, title,
+        [fingerprint.file_signature(p) for p in (excel_path, allegato3_path, P_CSV_PATH)]),
+        partial=not run_scope.whole)
+    readers = list(ctx["inputs"].values())
+    # i valori attuali dei target entrano nell'impronta: un target cambiato a
+    # mano o una mappatura annullata fanno rielaborare l'elemento
+    targets = sorted(set(tgt for tgt, _, _ in plan))
+    timer.lap("compilazione regole")
+
+    # Un solo passaggio su tutte le regole (L per ultima): pianificazione,
+    # nessuna scrittura. st["planned"] raccoglie i valori decisi per
+    # l'elemento, cosi' L vede i target delle regole precedenti senza
+    # rileggerli dal modello dopo una prima transazione.
+    write_plan = writeset.WritePlan()
+    for el in pipes:
+        snap = snapshot.ParamSnapshot(el)
+        fp = fingerprint.digest(el.GetTypeId().IntegerValue, [read(snap) for read in readers])
+        if fps.unchanged(el.Id.IntegerValue, fp,
+                         dict((t, fingerprint.param_token(snap.get(t))) for t in targets)):
+            continue
+        planned = {}
+        st = {"planned": planned, "snap": snap}
+        for tgt, code, ev in plan:
+            prm = snap.get(tgt)
+            if prm is None or prm.IsReadOnly:
+                continue
+            v = ev(el, prm, st)
+            if v is None:
+                continue
+            if prm.StorageType == StorageType.String:
+                planned[tgt] = v
+            writeset.plan_write(write_plan, el, prm, v, code)
+    timer.elements = len(pipes)
+    timer.lap("valutazione regole")
+
+    def on_result(entry, how):
+        tgt, v, code = entry[writeset.PNAME], entry[writeset.NEW], entry[writeset.CODE]
+        if how:
+            res_params[tgt] = v
+            fps.written(entry[writeset.EL_ID], tgt, entry[writeset.PRM])
             return
-        source_name = src_match.group(1)
-
-        # divido per '-' ogni condizione
-        partsL = rule_desc.split("-")
-        cond_map = {}
-        for part in partsL:
-            part = part.strip()
-            start = part.find("[")
-            end   = part.find("]")
-            if start >= 0 and end > start:
-                key = part[:start].strip().lower()
-                val = part[start+1:end].strip()
-                cond_map[key] = val
-
-        default_val = cond_map.get("default", "")
-
-        t2 = Transaction(doc, "Mappa Barre Step2")
-        t2.Start()
+        # da ritentare al prossimo run anche se gli input non cambiano
+        fps.forget(entry[writeset.EL_ID])
+        if code in _SET_FAIL_MSG:
+            log.warning(None, tgt, entry[writeset.EL_ID], _SET_FAIL_MSG[code], v)
+
+    written = 0
+    if not dry_run:
+        t1 = Transaction(doc, "Mappa Barre")
+        t1.Start()
         try:
-            for el in pipes:
-                prm_l = el.LookupParameter(target_param)
-                if prm_l is None or prm_l.IsReadOnly:
-                    continue
-                srcp = el.LookupParameter(source_name)
-                val_key = ""
-                if srcp and srcp.AsString() is not None:
-                    val_key = srcp.AsString().strip().lower()
-                chosen = cond_map.get(val_key, default_val)
-                if chosen != "":
-                    _set_safe(prm_l, chosen)
-                    res_params[target_param] = chosen
-            t2.Commit()
+            written += writeset.apply_plan(write_plan, on_result)[0]
+            timer.lap("scritture")
+            t1.Commit()
+            timer.lap("commit")
+            fps.save()
         except:
-            if t2.GetStatus() == TransactionStatus.Started:
-                t2.RollBack()
+            if t1.GetStatus() == TransactionStatus.Started:
+                t1.RollBack()
             raise
 
-    msg = "Parametri aggiornati: {}".format(len(res_params))
-    if warnings:
-        msg += "\nWarning:"
-        for p, w in warnings:
-            msg += "\n- {}: {}".format(p, w)
-
-    TaskDialog.Show("Risultato", msg)
+    if dry_run:
+        csv_path, _ = writeset.export_dry_run(write_plan, "PipeMapping")
+        msg = "Dry run: {} scritture pianificate, nessuna modifica al modello.\n{}".format(
+            len(write_plan), csv_path)
+    else:
+        msg = "Parametri aggiornati: {}\nScritture: {} - invariati (saltati): {}".format(
+            len(res_params), written, write_plan.unchanged)
+    msg += "\nElementi con input invariati (saltati): {} di {}".format(fps.skipped, len(pipes))
+    if not run_scope.whole:
+        msg += "\nAmbito: {}".format(run_scope.label)
+    if log.buckets:
+        msg += "\nWarning ({}):\n{}".format(log.count(runlog.WARNING), log.format_text())
+
+    timer.finish()
+    pipeline.notify("Risultato", msg)
     
 
-# punto di ingresso pyRevit
-doc = __revit__.ActiveUIDocument.Document
-process_document(doc)
+# punto di ingresso pyRevit (SHIFT+click = dry run, CTRL+click = scelta dell'ambito)
+uidoc = __revit__.ActiveUIDocument
+doc = uidoc.Document
+process_document(doc, writeset.is_dry_run(globals()),
+                 scope.choose(doc, uidoc, scope.wants_choice(globals())))
@@ -7,11 +7,12 @@ Pipe Accessories + Pipe Fittings (famiglie AP)
 __title__ = 'AP_Accessories\nmapping'
 __author__ = 'Valerio Mascia'
 
-import clr, os, re, xlrd, csv
+import clr, os, re, csv
 from Autodesk.Revit.DB import *
 from Autodesk.Revit.DB import TransactionStatus
-from System.Collections.Generic import List
 from Autodesk.Revit.DB import StorageType
+from snam import allegato3, fingerprint, pipeline, report, runlog, scope, snapshot, timing, wbcache, writeset
+from snam.table import Table, col_letter_to_index, load_cols, norm
 # Sotto IronPython UnitTypeId a volte non si importa: se fallisce qui a
 # livello modulo lo script muore subito. Con None i punti d'uso (gia' in
 # try/except) ripiegano su 304.8 / DisplayUnitType.
@@ -21,34 +22,18 @@ except:
     UnitTypeId = None
 
 # ---------- Helper Excel/CSV ----------
-def col_letter_to_index(letter):
-    idx = 0
-    for c in letter:
-        if c.isalpha():
-            idx = idx * 26 + (ord(c.upper()) - ord('A') + 1)
-    return idx - 1
-
-def format_cell_value(cell):
-    v = cell.value
-    if cell.ctype == 2:
-        if int(v) == v:
-            return str(int(v))
-        return str(v)
-    s = str(v).strip()
-    if re.match(r'^-?\d+\.0$', s):
-        return s[:-2]
-    return s
-
-def _detect_ci_report_is_new(ws):
+def _detect_ci_report_is_new(path):
     """
     Rileva il formato del foglio Report del CI (vecchio vs nuovo, come in
     Full Mapping Batch): cerca 'Codice SAP' in colonna B nelle prime 10 righe;
-    nuovo formato se nell'header la colonna AJ(35) e' 'Lista'.
+    nuovo formato se nell'header la colonna AJ(35) e' 'Lista'. Legge solo
+    quelle righe e colonne.
     """
+    ws = Table(load_cols(path, "Report", (1, 35), max_rows=10))
     header_row = -1
     for r in range(0, min(10, ws.nrows)):
         try:
-            v = format_cell_value(ws.cell(r, 1))
+            v = norm(ws.value(r, 1))
         except:
             v = ""
         if v and "codice sap" in str(v).strip().lower():
@@ -57,7 +42,7 @@ def _detect_ci_report_is_new(ws):
     if header_row < 0:
         return False
     try:
-        h_aj = format_cell_value(ws.cell(header_row, 35))
+        h_aj = norm(ws.value(header_row, 35))
         return bool(h_aj) and str(h_aj).strip().lower() == "lista"
     except:
         return False
@@ -121,14 +106,15 @@ def _fmt_mm(v_mm):
     s = "{:.3f}".format(v_mm)
     return s.rstrip("0").rstrip(".")
 
-def _elem_world_z_ft(doc, el):
+def _elem_world_z_ft(doc, snap):
     # livello assegnato
+    el = snap.element
     lvl = None
     try:
         if hasattr(el, "LevelId") and el.LevelId and el.LevelId.IntegerValue > 0:
             lvl = doc.GetElement(el.LevelId)
         if lvl is None:
-            plev = el.get_Parameter(BuiltInParameter.FAMILY_LEVEL_PARAM)
+            plev = snap.bip(BuiltInParameter.FAMILY_LEVEL_PARAM)
             if plev and plev.StorageType == StorageType.ElementId:
                 lvl = doc.GetElement(plev.AsElementId())
     except:
@@ -141,7 +127,7 @@ def _elem_world_z_ft(doc, el):
                 BuiltInParameter.RBS_OFFSET_PARAM,
                 BuiltInParameter.INSTANCE_ELEVATION_PARAM):
         try:
-            p = el.get_Parameter(bip)
+            p = snap.bip(bip)
             if p and p.StorageType == StorageType.Double:
                 off = p.AsDouble()
                 break
@@ -222,17 +208,20 @@ TF_EXCLUDE_FROM_WARN = {"Long Name", "IfcObjectType", "IFC Name"}
 
 
 # ---------- Setup documento ----------
-doc = __revit__.ActiveUIDocument.Document
+uidoc = __revit__.ActiveUIDocument
+doc = uidoc.Document
+# ambito: intero modello; CTRL+click = scelta da elenco (selezione, vista, livelli, workset)
+run_scope = scope.choose(doc, uidoc, scope.wants_choice(globals()))
+
+# tempi per fase e per regola (attivi con SNAM_TIMING=1)
+timer = timing.Timer("APMapping")
+timed = timer.enabled
+clock = timing.clock
 
 # Collector PA + PF
-filter_cat = List[ElementId]([
-    ElementId(int(BuiltInCategory.OST_PipeAccessory)),
-    ElementId(int(BuiltInCategory.OST_PipeFitting))
-])
-elements   = FilteredElementCollector(doc)\
-    .WherePasses(ElementMulticategoryFilter(filter_cat))\
-    .WhereElementIsNotElementType()\
-    .ToElements()
+elements   = run_scope.elements(doc, [BuiltInCategory.OST_PipeAccessory,
+                                   BuiltInCategory.OST_PipeFitting])
+timer.lap("collector")
 
 # Estrai codice modello dal titolo (per CI)
 title = doc.Title or ""
@@ -265,149 +254,189 @@ if not os.path.exists(ci_path):
     print("Errore: file {0} non trovato.".format(ci_path))
     raise SystemExit
 
-wb_ci  = xlrd.open_workbook(ci_path)
-wb_map = xlrd.open_workbook(MAP_RULES_EXCEL)
-
-# Regole mappatura
-ws_map = wb_map.sheet_by_name(SCHEDA_MAP)
-
-# Parametri comuni
-ws_common = wb_map.sheet_by_name(SCHEDA_COMMON)
-common_params = set()
-for i in range(1, ws_common.nrows):
-    pname = str(ws_common.cell(i, 1).value).strip()
-    if pname:
-        common_params.add(pname)
-
-# Costruisci regole
-param_rules = []
-rule_names  = set()
-for i in range(1, ws_map.nrows):
-    pname = str(ws_map.cell(i, 1).value).strip()
-    if not pname:
-        continue
-    rule_names.add(pname)
-    mode = str(ws_map.cell(i, 2).value or "").strip().upper()
-    desc = str(ws_map.cell(i, 3).value or "").strip()
-
-    if mode == "W":
-        m_col   = re.search(r"colonna\s+([A-Z]+)", desc, re.I)
-        m_sheet = re.search(r'foglio\s+"([^"]+)"', desc, re.I)
-        if m_col and m_sheet:
-            col    = m_col.group(1)
-            sheet  = m_sheet.group(1)
-            idx    = col_letter_to_index(col)
-            prefix = pname.split("_")[0].upper()
-            param_rules.append(("W", pname, prefix, sheet, idx))
-
-    elif mode == "C":
-        param_rules.append(("C", pname, format_cell_value(ws_map.cell(i, 3))))
-
-    elif mode == "D":
-        names = re.findall(r'"([^"]+)"', desc)
-        mval  = re.search(r"\(([^\)]+)\)", desc)
-        param_rules.append(("D", pname, names, mval.group(1).strip() if mval else ""))
-
-    elif mode == "B":
-        names = re.findall(r'"([^"]+)"', desc)
-        mval  = re.search(r"\(([^\)]+)\)", desc)
-        param_rules.append(("B", pname, names, mval.group(1).strip() if mval else ""))
-
-    elif mode == "E":
-        param_rules.append(("E", pname, re.findall(r'"([^"]+)"', desc)))
-
-    elif mode == "F":
-        names = re.findall(r'"([^"]+)"', desc)
-        vals  = re.findall(r"\(([^\)]+)\)", desc)
-        param_rules.append(("F", pname, names,
-                            vals[0].strip() if len(vals)>0 else "",
-                            vals[1].strip() if len(vals)>1 else ""))
-
-    elif mode == "G":
-        names = re.findall(r'"([^"]+)"', desc)
-        vals  = re.findall(r"\(([^\)]+)\)", desc)
-        param_rules.append(("G", pname, names,
-                            vals[0].strip() if len(vals)>0 else "",
-                            vals[1].strip() if len(vals)>1 else ""))
-
-    # --- NUOVE ---
-    elif mode == "J":
-        m_col = re.search(r"colonna\s+([A-Z]+)", desc, re.I)
-        if m_col:
-            idx = col_letter_to_index(m_col.group(1))
-            param_rules.append(("J", pname, idx))
-
-    elif mode == "K":
-        # due opzioni separate da ';' (left;right) in base a elevazione/offset < 0
-        param_rules.append(("K", pname, desc or ""))
-
-    elif mode == "T":
-        # nessun extra; calcolo geometrico
-        param_rules.append(("T", pname))
-
-    elif mode == "P":
-        # colonna da prendere dal CSV "colonna X"
-        m_col = re.search(r"colonna\s+([A-Z]+)", desc, re.I)
-        if m_col:
-            idx = col_letter_to_index(m_col.group(1))
-            param_rules.append(("P", pname, idx))
-
-    elif mode == "N":
-        # "famiglie" tra virgolette; coppie [TYPE6](VAL)
-        fam_keys = re.findall(r'"([^"]+)"', desc or "")
-        pairs    = re.findall(r"\[([^\]]+)\]\s*\(([^)]*)\)", desc or "")
-        # pairs = [("TYPE6", "VAL"), ...]
-        param_rules.append(("N", pname, fam_keys, pairs))
-
-    elif mode == "R":
-        # Leggi direttamente dal parametro tf_<pname>
-        param_rules.append(("R", pname))
-
-    elif mode == "Y":
-        # In descrizione c'è il NOME del parametro (senza virgolette)
-        pname_src = str(ws_map.cell(i, 3).value or "").strip()
-        if pname_src:
-            param_rules.append(("Y", pname, pname_src))
-
-
+def load_ap_rules(path):
+    """
+    Legge dal file Regole mappatura le regole AP gia' precompilate e i nomi
+    dei parametri comuni: (param_rules, rule_names, common_params).
+    """
+    # Regole mappatura (colonne B, C, D)
+    t_map = Table(load_cols(path, SCHEDA_MAP, (1, 2, 3)))
+
+    # Parametri comuni
+    t_common = Table(load_cols(path, SCHEDA_COMMON, (1,)))
+    common_params = set()
+    for v in t_common.col(1)[1:]:
+        pname = str(v).strip()
+        if pname:
+            common_params.add(pname)
+
+    # Costruisci regole
+    param_rules = []
+    rule_names  = set()
+    for i in range(1, t_map.nrows):
+        pname = str(t_map.value(i, 1)).strip()
+        if not pname:
+            continue
+        rule_names.add(pname)
+        mode = str(t_map.value(i, 2) or "").strip().upper()
+        desc = str(t_map.value(i, 3) or "").strip()
+
+        if mode == "W":
+            m_col   = re.search(r"colonna\s+([A-Z]+)", desc, re.I)
+            m_sheet = re.search(r'foglio\s+"([^"]+)"', desc, re.I)
+            if m_col and m_sheet:
+                col    = m_col.group(1)
+                sheet  = m_sheet.group(1)
+                idx    = col_letter_to_index(col)
+                prefix = pname.split("_")[0].upper()
+                param_rules.append(("W", pname, prefix, sheet, idx))
+
+        elif mode == "C":
+            param_rules.append(("C", pname, norm(t_map.value(i, 3))))
+
+        elif mode == "D":
+            names = re.findall(r'"([^"]+)"', desc)
+            mval  = re.search(r"\(([^\)]+)\)", desc)
+            param_rules.append(("D", pname, names, mval.group(1).strip() if mval else ""))
+
+        elif mode == "B":
+            names = re.findall(r'"([^"]+)"', desc)
+            mval  = re.search(r"\(([^\)]+)\)", desc)
+            param_rules.append(("B", pname, names, mval.group(1).strip() if mval else ""))
+
+        elif mode == "E":
+            param_rules.append(("E", pname, re.findall(r'"([^"]+)"', desc)))
+
+        elif mode == "F":
+            names = re.findall(r'"([^"]+)"', desc)
+            vals  = re.findall(r"\(([^\)]+)\)", desc)
+            param_rules.append(("F", pname, names,
+                                vals[0].strip() if len(vals)>0 else "",
+                                vals[1].strip() if len(vals)>1 else ""))
+
+        elif mode == "G":
+            names = re.findall(r'"([^"]+)"', desc)
+            vals  = re.findall(r"\(([^\)]+)\)", desc)
+            param_rules.append(("G", pname, names,
+                                vals[0].strip() if len(vals)>0 else "",
+                                vals[1].strip() if len(vals)>1 else ""))
+
+        # --- NUOVE ---
+        elif mode == "J":
+            m_col = re.search(r"colonna\s+([A-Z]+)", desc, re.I)
+            if m_col:
+                idx = col_letter_to_index(m_col.group(1))
+                param_rules.append(("J", pname, idx))
+
+        elif mode == "K":
+            # due opzioni separate da ';' (left;right) in base a elevazione/offset < 0
+            param_rules.append(("K", pname, desc or ""))
+
+        elif mode == "T":
+            # nessun extra; calcolo geometrico
+            param_rules.append(("T", pname))
+
+        elif mode == "P":
+            # colonna da prendere dal CSV "colonna X"
+            m_col = re.search(r"colonna\s+([A-Z]+)", desc, re.I)
+            if m_col:
+                idx = col_letter_to_index(m_col.group(1))
+                param_rules.append(("P", pname, idx))
+
+        elif mode == "N":
+            # "famiglie" tra virgolette; coppie [TYPE6](VAL)
+            fam_keys = re.findall(r'"([^"]+)"', desc or "")
+            pairs    = re.findall(r"\[([^\]]+)\]\s*\(([^)]*)\)", desc or "")
+            # pairs = [("TYPE6", "VAL"), ...]
+            param_rules.append(("N", pname, fam_keys, pairs))
+
+        elif mode == "R":
+            # Leggi direttamente dal parametro tf_<pname>
+            param_rules.append(("R", pname))
+
+        elif mode == "Y":
+            # In descrizione c'è il NOME del parametro (senza virgolette)
+            pname_src = str(t_map.value(i, 3) or "").strip()
+            if pname_src:
+                param_rules.append(("Y", pname, pname_src))
+
+    return param_rules, rule_names, common_params
+
+# in cache c'e' il risultato gia' compilato: cambiare la versione nel tag
+# quando cambia il formato di param_rules
+param_rules, rule_names, common_params = wbcache.cached(
+    MAP_RULES_EXCEL, "ap_rules/1:" + SCHEDA_MAP, lambda: load_ap_rules(MAP_RULES_EXCEL))
+timer.lap("excel regole")
 
 # Prepara dati per W
-data_by_sheet = {}
 index_by_sheet = {}       # sheet -> {SAP: prima riga} (lookup O(1) caso generale)
 report_rows_by_sap = {}   # solo Report: SAP -> [tutte le sue righe] (caso CA/EE)
 sap_col_map   = {"Report":1, "Consistenza Impiantistica":col_letter_to_index('N')}
 
-# Rileva formato CI Report (vecchio/nuovo) per traslare gli indici colonna
-ci_report_is_new = False
-try:
-    ci_report_is_new = _detect_ci_report_is_new(wb_ci.sheet_by_name("Report"))
-except:
-    ci_report_is_new = False
+# Colonne del caso speciale Report/EE (convenzione CI VECCHIO)
+COL_DZ, COL_EA, COL_EE, COL_EG = [col_letter_to_index(c) for c in ("DZ", "EA", "EE", "EG")]
 
-for rule in param_rules:
-    if rule[0] == "W":
-        sheet = rule[3]
-        if sheet not in data_by_sheet:
-            ws     = wb_ci.sheet_by_name(sheet)
-            sap_col= sap_col_map.get(sheet, 1)
-            rows   = []
-            for r in range(1, ws.nrows):
-                code = format_cell_value(ws.cell(r, sap_col))
-                if not code:
-                    continue
-                rows.append((code, [format_cell_value(ws.cell(r, c)) for c in range(ws.ncols)]))
-            data_by_sheet[sheet] = rows
-            first_by_code = {}
-            for code, rv in rows:
-                if code not in first_by_code:
-                    first_by_code[code] = rv
-            index_by_sheet[sheet] = first_by_code
-            if sheet == "Report":
-                for code, rv in rows:
-                    report_rows_by_sap.setdefault(code, []).append(rv)
-
-# Carica Allegato3 per J (lazy in uso)
-allegato_data = None
+def w_rule_columns(param_rules):
+    """
+    Colonne (convenzione CI VECCHIO) che le regole W leggono da ogni foglio:
+    {foglio: set(indici)}. Report/EE legge anche DZ, EA ed EG.
+    """
+    cols = {}
+    for rule in param_rules:
+        if rule[0] == "W":
+            _, _, prefix, sheet, idx = rule
+            need = cols.setdefault(sheet, set())
+            if sheet == "Report" and idx == COL_EE:
+                need.update((COL_DZ, COL_EA, COL_EE, COL_EG))
+            else:
+                need.add(idx)
+    return cols
+
+def load_ci_sheets(path, w_cols):
+    """
+    Legge dal CI solo fogli e colonne usati dalle regole W (w_cols, vedi
+    w_rule_columns) piu' la colonna SAP: (ci_report_is_new, data_by_sheet)
+    con data_by_sheet = {foglio: colonne per snam.table.Table}, valori gia'
+    normalizzati. Le colonne del Report sono gia' traslate nel formato del file.
+    """
+    # Rileva formato CI Report (vecchio/nuovo) per traslare gli indici colonna
+    ci_report_is_new = False
+    try:
+        ci_report_is_new = _detect_ci_report_is_new(path)
+    except:
+        ci_report_is_new = False
+
+    # ogni foglio si legge da solo, solo le colonne richieste (snam.xlsx)
+    data_by_sheet = {}
+    for sheet, need in w_cols.items():
+        sap_col= sap_col_map.get(sheet, 1)
+        if sheet == "Report":
+            need = [_xlate_old_col_idx(c, ci_report_is_new) for c in need]
+        data_by_sheet[sheet] = load_cols(path, sheet, list(need) + [sap_col], normalized=True)
+    return ci_report_is_new, data_by_sheet
+
+w_cols = w_rule_columns(param_rules)
+ci_tag = "ci/3:" + ";".join("{0}={1}".format(sh, sorted(c)) for sh, c in sorted(w_cols.items()))
+ci_report_is_new, data_by_sheet = wbcache.cached(
+    ci_path, ci_tag, lambda: load_ci_sheets(ci_path, w_cols))
+
+# indici del caso speciale Report/EE nel formato effettivo del CI
+rep_dz, rep_ea, rep_ee, rep_eg = [_xlate_old_col_idx(c, ci_report_is_new)
+                                  for c in (COL_DZ, COL_EA, COL_EE, COL_EG)]
+
+# valori gia' normalizzati: indici hash sulla colonna SAP senza ulteriore chiave
+ci_tables = dict((sheet, Table(cols)) for sheet, cols in data_by_sheet.items())
+for sheet, t in ci_tables.items():
+    sap_col = sap_col_map.get(sheet, 1)
+    index_by_sheet[sheet] = t.index(sap_col, key=None)
+    if sheet == "Report":
+        report_rows_by_sap = t.index(sap_col, key=None, multi=True)
+timer.lap("excel CI")
+
+# Allegato3 per J: indice per prefisso 5 (lazy al primo uso), solo colonne delle regole J
+allegato_table  = None
+allegato_loaded = False
+allegato_cols   = [rule[2] for rule in param_rules if rule[0] == "J"]
 
 # Carica CSV per P
 csv_rows = []
@@ -426,6 +455,7 @@ if csv_rows:
             k = row[csv_g_index].strip()
             if k:
                 csv_by_key[k] = row
+timer.lap("csv")
 
 # --- Precalcolo per T: livello matchato al PBP ---
 matched_level = None
@@ -457,31 +487,206 @@ if pbp_elev is not None:
             break
     if matched_level is None:
         matched_level = closest
+timer.lap("precalcolo T")
+
+# Regole che dipendono solo dal FamilySymbol (famiglia/tipo) o dal titolo:
+# valutate una volta per tipo e riusate da tutte le istanze.
+# W, K, T, R, Y dipendono dall'istanza e restano per elemento.
+TYPE_RULES = ("C", "D", "B", "E", "F", "G", "J", "P", "N")
+
+def eval_type_rule(rule, fam, type_name):
+    global allegato_table, allegato_loaded
+    typ = rule[0]
+    val = None
+
+    if typ == "C":
+        val = rule[2]
+
+    elif typ == "D":
+        names, dval = rule[2], rule[3]
+        if any(fam.startswith(n) for n in names):
+            val = dval
+
+    elif typ == "B":
+        names, dval = rule[2], rule[3]
+        # match se il Family Name inizia con uno dei prefissi tra virgolette
+        matched = any((fam or "").startswith(n.strip()) for n in names)
+
+        if matched:
+            # per le AP elencate: usa SEMPRE il valore tra parentesi
+            val = dval
+        else:
+            # per TUTTE le altre AP: N/C (il gate tf_ è già attivo sopra)
+            val = "N/C"
+
+    elif typ == "E":
+        val = "SI" if fam in rule[2] else "NO"
+
+    elif typ == "F":
+        names, v1, v2 = rule[2], rule[3], rule[4]
+        val = v1 if any(fam.startswith(n) for n in names) else v2
+
+    elif typ == "G":
+        names, tv, fv = rule[2], rule[3], rule[4]
+        val = tv if segG in names else fv
+
+    # ----- NUOVE REGOLE -----
+    elif typ == "J":
+        # Allegato 3: prefisso 5 del Family Name
+        if not allegato_loaded:
+            allegato_loaded = True
+            try:
+                allegato_table = allegato3.load_table(
+                    ALLEGATO3_PATH, ALLEGATO3_SHEET, allegato_cols)
+            except:
+                allegato_table = None
+        if allegato_table is not None:
+            idx_out = rule[2]
+            if 0 <= idx_out < allegato_table.ncols:
+                row = allegato3.find_row(allegato_table, (fam[:5] if fam else "").upper())
+                if row is not None:
+                    val = allegato_table.value(row, idx_out, None)
+
+    elif typ == "P":
+        # match key (trasformata) con colonna G del CSV
+        idx_out = rule[2]
+        row = csv_by_key.get(segP)
+        if row and 0 <= idx_out < len(row):
+            cand = row[idx_out]
+            # vuoto -> "N/C"
+            if cand is None or str(cand).strip() == '':
+                val = "N/C"
+            else:
+                s = str(cand).strip()
+                # 'Esercizio' -> 'Operativo'
+                if s.lower() == 'esercizio':
+                    s = 'Operativo'
+                # converti "27-feb-17" -> "27022017"
+                s = to_date_ddmmyyyy(s)
+                val = s
+        else:
+            val = "N/C"
+
+    elif typ == "N":
+        # rule = ("N", pname, fam_keys, pairs)
+        fam_keys, pairs = rule[2], rule[3]
+        fam_prefix5  = (fam[:5] if fam else "").upper()
+        type_prefix6 = (type_name[:6] if type_name else "").upper()
+        # default N/C
+        val = "N/C"
+        # match family prefix5 con una delle virgolette
+        if fam_keys and any(fam_prefix5 == k.strip().upper() for k in fam_keys):
+            # match type prefix6 con una delle quadre
+            # supporta più alternative nelle quadre separate da | , ; / o spazi
+            for k, outv in pairs:
+                alts = [a.strip().upper() for a in re.split(r'[|,;/]+', k) if a.strip()]
+                if (alts and type_prefix6 in alts) or (not alts and type_prefix6 == k.strip().upper()):
+                    val = outv.strip()
+                    break
+        # else: resta "N/C"
+
+    return val
+
+# ------------------- PIANIFICAZIONE -------------------
+# Le regole producono solo il write set (nessuna scrittura in Revit):
+# la transazione resta aperta solo per l'applicazione delle differenze.
+DRY_RUN = writeset.is_dry_run(globals())
+
+write_plan  = writeset.WritePlan()
+# WARNING = mostrati a fine run, INFO = raccolti per bucket, DEBUG = solo contati
+log         = runlog.RunLog(min_level=runlog.INFO)
+el_labels   = {}   # element id -> family name (famiglia dei messaggi di log)
+
+# parametri letti da un'istantanea per elemento (una sola iterazione di
+# el.Parameters) e per tipo (condivisa tra le istanze dello stesso tipo)
+types    = pipeline.snapshots()
+tf_names = dict((rule[1], "tf_{0}".format(rule[1])) for rule in param_rules)
+
+# Cache per tipo (FamilySymbol): nomi, controllo tf_, presenza tf_ per regola
+# e valori delle TYPE_RULES. Le istanze dello stesso tipo riusano tutto.
+type_cache  = {}   # type id -> dict
+type_hits   = 0
+type_misses = 0
+
+# Mappatura incrementale: impronta degli input per elemento (tipo, SAP,
+# sorgenti R/Y, offset/quota per K/T, righe CI del SAP) e dei valori attuali
+# dei target (vedi snam.fingerprint). Regole, workbook,
+# CSV, titolo e livello PBP entrano nel contesto: se cambiano si rifa' tutto.
+fps = fingerprint.FingerprintStore(doc, "APMapping", (
+    "ap/1", param_rules, sorted(common_params), sorted(TF_EXCLUDE_FROM_WARN), title,
+    ci_report_is_new, matched_level.Id.IntegerValue if matched_level is not None else None,
+    [fingerprint.file_signature(p) for p in (MAP_RULES_EXCEL, ALLEGATO3_PATH, P_CSV_PATH)]),
+    partial=not run_scope.whole)
+fp_sources = ([tf_names[rule[1]] for rule in param_rules if rule[0] == "R"] +
+              [rule[2] for rule in param_rules if rule[0] == "Y"])
+fp_targets = sorted(set(rule[1] for rule in param_rules))
+fp_has_t   = any(rule[0] == "T" for rule in param_rules)
+FP_BIPS    = (BuiltInParameter.INSTANCE_ELEVATION_PARAM, BuiltInParameter.RBS_OFFSET_PARAM)
+ci_loaded_cols = dict((sheet, [c for c, col in enumerate(t.cols) if col is not None])
+                      for sheet, t in ci_tables.items())
+
+def ci_rows_key(sap_val):
+    """Righe CI del SAP (solo colonne caricate), per l'impronta dell'elemento."""
+    key = []
+    for sheet in sorted(ci_tables):
+        t = ci_tables[sheet]
+        if sheet == "Report":
+            rows = report_rows_by_sap.get(sap_val, [])
+        else:
+            rv = index_by_sheet[sheet].get(sap_val)
+            rows = [rv] if rv is not None else []
+        key.append([t.row_slice(rv, ci_loaded_cols[sheet]) for rv in rows])
+    return key
+
+def element_fingerprint(snap, te, sap_val, z):
+    sym_snap = te["snap"]
+    return fingerprint.digest(
+        snap.element.GetTypeId().IntegerValue, te["fam"], te["type_name"], sap_val,
+        [fingerprint.param_token(snap.get(n) or sym_snap.get(n)) for n in fp_sources],
+        [fingerprint.param_token(snap.bip(b)) for b in FP_BIPS],
+        round(z, 9) if z is not None else None,
+        ci_rows_key(sap_val))
+
+def target_tokens(snap):
+    """Valori attuali dei parametri target dell'elemento, per l'impronta."""
+    return dict((n, fingerprint.param_token(snap.get(n))) for n in fp_targets)
+
+for el in elements:
+    tid = el.GetTypeId().IntegerValue
+    te  = type_cache.get(tid)
+    if te is None:
+        type_misses += 1
+        sym_snap  = types.type_of(doc, el)
+        tprm      = sym_snap.bip(BuiltInParameter.SYMBOL_NAME_PARAM)
+        fam_prm   = sym_snap.bip(BuiltInParameter.SYMBOL_FAMILY_NAME_PARAM)
+        te = {
+            "snap":      sym_snap,
+            "type_name": tprm.AsString().strip() if tprm and tprm.AsString() else "",
+            "fam":       fam_prm.AsString().strip() if fam_prm and fam_prm.AsString() else "",
+            "bad_tf":    None,  # tf_ non coperti dalle regole (dalla prima istanza)
+            "has_tf":    {},    # pname -> tf_<pname> presente su istanza o tipo
+            "vals":      {},    # pname -> valore delle TYPE_RULES
+        }
+        type_cache[tid] = te
+    else:
+        type_hits += 1
+    sym_snap, type_name, fam = te["snap"], te["type_name"], te["fam"]
+    el_id = el.Id.IntegerValue
 
-# ------------------- TRANSAZIONE -------------------
-trans = Transaction(doc, "AP mapping (PA + PF)")
-trans.Start()
-try:
-    debug_log   = []
-    param_count = 0
-
-    for el in elements:
-        sym        = doc.GetElement(el.GetTypeId())
-        tprm       = sym.get_Parameter(BuiltInParameter.SYMBOL_NAME_PARAM)
-        type_name  = tprm.AsString().strip() if tprm and tprm.AsString() else ""
-        type_label = "[{0}][ID:{1}]".format(type_name, el.Id.IntegerValue)
-        fam_prm    = sym.get_Parameter(BuiltInParameter.SYMBOL_FAMILY_NAME_PARAM)
-        fam        = fam_prm.AsString().strip() if fam_prm and fam_prm.AsString() else ""
-        prefix_str = "{0} {1}".format(fam, type_label)
-
-        if not fam.startswith("AP"):
-            # opzionale: puoi non loggare nulla così non “inquina” l’output
-            # debug_log.append("{0} Skip: family name '{1}' non AP".format(prefix_str, fam))
-            continue
-
-        # Controllo tf_ vs regole (come prima)
-        for p in el.Parameters:
-            pname_tf = p.Definition.Name
+    if not fam.startswith("AP"):
+        # opzionale: puoi non loggare nulla così non “inquina” l’output
+        # log.debug(fam, None, el_id, "Skip: family name '{}' non AP", fam)
+        continue
+    el_labels[el_id] = fam
+    # unica iterazione di el.Parameters dell'elemento: regole, impronta e
+    # controllo tf_ leggono da qui
+    snap = snapshot.ParamSnapshot(el)
+
+    # Controllo tf_ vs regole (come prima): i parametri dipendono dal tipo,
+    # quindi i nomi si controllano solo per la prima istanza
+    if te["bad_tf"] is None:
+        bad_tf = []
+        for pname_tf in snap.names():
             if pname_tf.startswith("tf_"):
                 base = pname_tf[3:]
                 # ESCLUSIONE: questi tf_ non vanno riportati nell'output finale
@@ -490,313 +695,243 @@ try:
                 if base in common_params:
                     continue
                 if base not in rule_names:
-                    debug_log.append("{0} WARNING: '{1}' Parametro non presente in Regole Mappatura Parametri".format(prefix_str, pname_tf))
+                    bad_tf.append(pname_tf)
+        te["bad_tf"] = bad_tf
+    for pname_tf in te["bad_tf"]:
+        log.warning(fam, None, el_id, "'{}' Parametro non presente in Regole Mappatura Parametri", pname_tf)
+
+    # Verifica codice SAP
+    sap_val = get_param_as_string(snap.get("NP259_codice_sap"))
+    if not sap_val:
+        log.warning(fam, None, el_id, "NP259_codice_sap mancante")
+        continue
 
-        # Verifica codice SAP
-        sap_val = get_param_as_string(el.LookupParameter("NP259_codice_sap"))
-        if not sap_val:
-            debug_log.append("{0} WARNING: NP259_codice_sap mancante".format(prefix_str))
-            continue
+    # input invariati dall'ultimo run: niente da rivalutare
+    # quota assoluta (T e impronta): calcolata una volta per elemento
+    z_el = _elem_world_z_ft(doc, snap) if fp_has_t else None
+    if fps.unchanged(el_id, element_fingerprint(snap, te, sap_val, z_el), target_tokens(snap)):
+        continue
 
-        # Applicazione regole
-        for rule in param_rules:
-            typ, pname = rule[0], rule[1]
-            prm = el.LookupParameter(pname)
-            if prm is None or prm.IsReadOnly:
-                debug_log.append("{0} WARNING {1}: Parametro non presente in Revit".format(prefix_str, pname))
-                continue
-            has_tf = el.LookupParameter("tf_{0}".format(pname)) or sym.LookupParameter("tf_{0}".format(pname))
-            if not has_tf:
-                debug_log.append("{0} Skip {1}: tf_ parameter not defined".format(prefix_str, pname))
-                continue
+    # Applicazione regole
+    te_has_tf, te_vals = te["has_tf"], te["vals"]
+    for rule in param_rules:
+        typ, pname = rule[0], rule[1]
+        prm = snap.get(pname)
+        if prm is None or prm.IsReadOnly:
+            log.info(fam, pname, el_id, "Parametro non presente in Revit")
+            continue
+        has_tf = te_has_tf.get(pname)
+        if has_tf is None:
+            has_tf = te_has_tf[pname] = bool(snap.get(tf_names[pname]) or sym_snap.get(tf_names[pname]))
+        if not has_tf:
+            log.debug(fam, pname, el_id, "Skip: tf_ parameter not defined")
+            continue
+        if timed:
+            t_rule = clock()
 
-            val = None
+        val = None
 
 
-            
-            if typ == "W":
-                _, _, prefix, sheet, idx = rule
-                val = None
+        
+        if typ == "W":
+            _, _, prefix, sheet, idx = rule
+            val = None
 
-                # --- Caso speciale: foglio "Report" + colonna EE ---
-                # Qui lo stesso SAP ha più righe, una per ogni parametro CAxxx.
-                # Serve trovare la riga con SAP uguale E DZ che identifica il parametro (prefix = "CA002", "CA008", ...).
-                # Se DZ è tutta vuota -> match su EA e valore da EG.
-                # NB: le regole sono in convenzione CI VECCHIO; se il CI e' nuovo
-                # gli indici >= 35 vanno traslati di +1 (_xlate_old_col_idx).
-                if sheet == "Report" and idx == col_letter_to_index('EE'):
-                    dz = _xlate_old_col_idx(col_letter_to_index('DZ'), ci_report_is_new)
-                    ea = _xlate_old_col_idx(col_letter_to_index('EA'), ci_report_is_new)
-                    eg = _xlate_old_col_idx(col_letter_to_index('EG'), ci_report_is_new)
-                    ee = _xlate_old_col_idx(idx, ci_report_is_new)
-                    sap_rows = report_rows_by_sap.get(sap_val, [])
-
-                    # verifica se in DZ esiste almeno un valore non vuoto (per le righe del SAP corrente)
-                    dz_has_any = False
+            # --- Caso speciale: foglio "Report" + colonna EE ---
+            # Qui lo stesso SAP ha più righe, una per ogni parametro CAxxx.
+            # Serve trovare la riga con SAP uguale E DZ che identifica il parametro (prefix = "CA002", "CA008", ...).
+            # Se DZ è tutta vuota -> match su EA e valore da EG.
+            # NB: le regole sono in convenzione CI VECCHIO; se il CI e' nuovo
+            # gli indici >= 35 vanno traslati di +1 (_xlate_old_col_idx).
+            # Sono caricate solo le colonne proiettate (le altre valgono "").
+            if sheet == "Report" and idx == COL_EE:
+                rep = ci_tables["Report"]
+                sap_rows = report_rows_by_sap.get(sap_val, [])
+
+                # verifica se in DZ esiste almeno un valore non vuoto (per le righe del SAP corrente)
+                dz_has_any = False
+                for rv in sap_rows:
+                    if str(rep.value(rv, rep_dz)).strip() != '':
+                        dz_has_any = True
+                        break
+
+                if dz_has_any:
+                    # Comportamento attuale: match su DZ e valore da EE
                     for rv in sap_rows:
-                        if str(rv[dz] if dz < len(rv) else '').strip() != '':
-                            dz_has_any = True
+                        dz_val = str(rep.value(rv, rep_dz)).upper().strip()
+                        if dz_val.startswith(prefix):
+                            candidate = rep.value(rv, rep_ee)
+                            if candidate is not None and str(candidate).strip() != "":
+                                val = candidate
                             break
-
-                    if dz_has_any:
-                        # Comportamento attuale: match su DZ e valore da EE
-                        for rv in sap_rows:
-                            dz_val = str(rv[dz] if dz < len(rv) else '').upper().strip()
-                            if dz_val.startswith(prefix):
-                                if ee < len(rv):
-                                    candidate = rv[ee]
-                                    if candidate is not None and str(candidate).strip() != "":
-                                        val = candidate
-                                break
-                    else:
-                        # Eccezione: DZ tutta vuota -> match su EA e valore da EG
-                        for rv in sap_rows:
-                            ea_val = str(rv[ea] if ea < len(rv) else '').upper().strip()
-                            if ea_val.startswith(prefix):
-                                if eg < len(rv):
-                                    candidate = rv[eg]
-                                    if candidate is not None and str(candidate).strip() != "":
-                                        val = candidate
-                                break
-
-                # --- Caso generale: match per SAP (1 riga per SAP, lookup indicizzato) ---
-                else:
-                    eff_idx = _xlate_old_col_idx(idx, ci_report_is_new) if sheet == "Report" else idx
-                    rv = index_by_sheet.get(sheet, {}).get(sap_val)
-                    if rv is not None and eff_idx < len(rv):
-                        candidate = rv[eff_idx]
-                        if candidate is not None and str(candidate).strip() != "":
-                            val = candidate
-
-
-            elif typ == "C":
-                val = rule[2]
-
-            elif typ == "D":
-                names, dval = rule[2], rule[3]
-                if any(fam.startswith(n) for n in names):
-                    val = dval
-
-            elif typ == "B":
-                names, dval = rule[2], rule[3]
-                # match se il Family Name inizia con uno dei prefissi tra virgolette
-                matched = any((fam or "").startswith(n.strip()) for n in names)
-
-                if matched:
-                    # per le AP elencate: usa SEMPRE il valore tra parentesi
-                    val = dval
                 else:
-                    # per TUTTE le altre AP: N/C (il gate tf_ è già attivo sopra)
-                    val = "N/C"
-
-            elif typ == "E":
-                val = "SI" if fam in rule[2] else "NO"
-
-            elif typ == "F":
-                names, v1, v2 = rule[2], rule[3], rule[4]
-                val = v1 if any(fam.startswith(n) for n in names) else v2
-
-            elif typ == "G":
-                names, tv, fv = rule[2], rule[3], rule[4]
-                val = tv if segG in names else fv
-
-            # ----- NUOVE REGOLE -----
-            elif typ == "J":
-                # Allegato 3: prefisso 5 del Family Name
-                if allegato_data is None:
-                    try:
-                        wb_all = xlrd.open_workbook(ALLEGATO3_PATH)
-                        ws_all = wb_all.sheet_by_name(ALLEGATO3_SHEET)
-                        allegato_data = []
-                        for c in range(ws_all.ncols):
-                            col = []
-                            for r in range(ws_all.nrows):
-                                col.append(ws_all.cell(r, c).value)
-                            allegato_data.append(col)
-                    except:
-                        allegato_data = None
-                if allegato_data is not None:
-                    idx_out = rule[2]
-                    if 0 <= idx_out < len(allegato_data):
-                        prefix5 = (fam[:5] if fam else "").upper()
-                        colA = allegato_data[0] if len(allegato_data) > 0 else []
-                        row = None
-                        for irow in range(1, len(colA)):
-                            if str(colA[irow]).strip().upper() == prefix5:
-                                row = irow
-                                break
-                        if row is not None and row < len(allegato_data[idx_out]):
-                            val = allegato_data[idx_out][row]
-
-            elif typ == "K":
-                # due opzioni separate da ';' in base a elevazione/offset < 0
-                desc_k = rule[2] or ""
-                parts_k = desc_k.split(";", 1)
-                left  = parts_k[0].strip() if len(parts_k) >= 1 else ""
-                right = parts_k[1].strip() if len(parts_k) == 2 else ""
-                elev = None
-                # prova INSTANCE_ELEVATION_PARAM, poi RBS_OFFSET_PARAM
-                for bip in (BuiltInParameter.INSTANCE_ELEVATION_PARAM,
-                            BuiltInParameter.RBS_OFFSET_PARAM):
-                    try:
-                        p = el.get_Parameter(bip)
-                        if p and p.StorageType == StorageType.Double:
-                            elev = p.AsDouble()
+                    # Eccezione: DZ tutta vuota -> match su EA e valore da EG
+                    for rv in sap_rows:
+                        ea_val = str(rep.value(rv, rep_ea)).upper().strip()
+                        if ea_val.startswith(prefix):
+                            candidate = rep.value(rv, rep_eg)
+                            if candidate is not None and str(candidate).strip() != "":
+                                val = candidate
                             break
-                    except:
-                        pass
-                choice = (left or right) if (elev is not None and elev < 0.0) else (right or left)
-                val = choice if choice != "" else None
-
-            elif typ == "T":
-                # distanza firmata rispetto al livello matchato PBP
-                if matched_level is not None:
-                    z_lvl = _level_elev_ft(matched_level)
-                    z_el  = _elem_world_z_ft(doc, el)
-                    if z_el is not None and z_lvl is not None:
-                        dz_ft = z_el - z_lvl
-                        # se parametro Double, set in feet, altrimenti stringa mm
-                        if prm.StorageType == StorageType.Double:
+
+            # --- Caso generale: match per SAP (1 riga per SAP, lookup indicizzato) ---
+            else:
+                eff_idx = _xlate_old_col_idx(idx, ci_report_is_new) if sheet == "Report" else idx
+                rv = index_by_sheet.get(sheet, {}).get(sap_val)
+                if rv is not None:
+                    candidate = ci_tables[sheet].value(rv, eff_idx)
+                    if candidate is not None and str(candidate).strip() != "":
+                        val = candidate
+
+
+        elif typ in TYPE_RULES:
+            # dipende solo dal tipo: calcolata una volta per FamilySymbol
+            if pname not in te_vals:
+                te_vals[pname] = eval_type_rule(rule, fam, type_name)
+            val = te_vals[pname]
+
+        elif typ == "K":
+            # due opzioni separate da ';' in base a elevazione/offset < 0
+            desc_k = rule[2] or ""
+            parts_k = desc_k.split(";", 1)
+            left  = parts_k[0].strip() if len(parts_k) >= 1 else ""
+            right = parts_k[1].strip() if len(parts_k) == 2 else ""
+            elev = None
+            # prova INSTANCE_ELEVATION_PARAM, poi RBS_OFFSET_PARAM
+            for bip in (BuiltInParameter.INSTANCE_ELEVATION_PARAM,
+                        BuiltInParameter.RBS_OFFSET_PARAM):
+                try:
+                    p = snap.bip(bip)
+                    if p and p.StorageType == StorageType.Double:
+                        elev = p.AsDouble()
+                        break
+                except:
+                    pass
+            choice = (left or right) if (elev is not None and elev < 0.0) else (right or left)
+            val = choice if choice != "" else None
+
+        elif typ == "T":
+            # distanza firmata rispetto al livello matchato PBP
+            if matched_level is not None:
+                z_lvl = _level_elev_ft(matched_level)
+                if z_el is not None and z_lvl is not None:
+                    dz_ft = z_el - z_lvl
+                    # se parametro Double, set in feet (ripiego: stringa mm), altrimenti stringa mm
+                    dz_mm = _ft_to_mm(dz_ft)
+                    val = _fmt_mm(dz_mm)
+                    if prm.StorageType == StorageType.Double:
+                        writeset.plan_write(write_plan, el, prm, dz_ft, typ, val)
+                        if timed:
+                            timer.add_rule(typ, clock() - t_rule)
+                        continue
+
+        elif typ == "R":
+            # Copia il valore da tf_<pname> (istanza -> tipo come fallback)
+            src_name = tf_names[pname]
+            src_prm = snap.get(src_name) or sym_snap.get(src_name)
+            if src_prm:
+                val = get_param_as_string(src_prm)
+            else:
+                val = None
+        
+        
+        elif typ == "Y":
+            # ("Y", target_param_name, source_param_name)
+            src_name = rule[2]
+            src = snap.get(src_name) or sym_snap.get(src_name)
+
+            if prm.StorageType != StorageType.String:
+                log.info(fam, pname, el_id, "Y: il parametro destinazione '{}' non è di tipo Testo", pname)
+                val = "N/C"   # fallback su N/C anche se non-text (verrà probabilmente rifiutato da Revit, ma manteniamo coerenza)
+            else:
+                s_out = None
+                if src:
+                    if src.StorageType == StorageType.Double:
+                        try:
                             try:
-                                prm.Set(dz_ft)
-                                param_count += 1
-                                debug_log.append("{0} T Set {1}: val={2}".format(prefix_str, pname, dz_ft))
-                                continue
+                                mm = UnitUtils.ConvertFromInternalUnits(src.AsDouble(), UnitTypeId.Millimeters)
                             except:
-                                pass
-                        dz_mm = _ft_to_mm(dz_ft)
-                        val = _fmt_mm(dz_mm)
-
-            elif typ == "P":
-                # match key (trasformata) con colonna G del CSV
-                idx_out = rule[2]
-                row = csv_by_key.get(segP)
-                if row and 0 <= idx_out < len(row):
-                    cand = row[idx_out]
-                    # vuoto -> "N/C"
-                    if cand is None or str(cand).strip() == '':
-                        val = "N/C"
+                                from Autodesk.Revit.DB import DisplayUnitType
+                                mm = UnitUtils.ConvertFromInternalUnits(src.AsDouble(), DisplayUnitType.DUT_MILLIMETERS)
+                            s_out = _format_number_keep_decimals(round(mm, 6))
+                        except:
+                            s_out = None
                     else:
-                        s = str(cand).strip()
-                        # 'Esercizio' -> 'Operativo'
-                        if s.lower() == 'esercizio':
-                            s = 'Operativo'
-                        # converti "27-feb-17" -> "27022017"
-                        s = to_date_ddmmyyyy(s)
-                        val = s
+                        s = (src.AsString() or "").strip()
+                        if s:
+                            n = _first_number(s)
+                            if n is not None:
+                                s_out = _format_number_keep_decimals(n)
+
+                if not s_out:
+                    log.info(fam, pname, el_id, "Y: valore non interpretabile da '{}'", src_name)
+                    val = "N/C"     # <— fallback richiesto
                 else:
-                    val = "N/C"
-
-            elif typ == "N":
-                # rule = ("N", pname, fam_keys, pairs)
-                fam_keys, pairs = rule[2], rule[3]
-                fam_prefix5  = (fam[:5] if fam else "").upper()
-                type_prefix6 = (type_name[:6] if type_name else "").upper()
-                # default N/C
-                val = "N/C"
-                # match family prefix5 con una delle virgolette
-                if fam_keys and any(fam_prefix5 == k.strip().upper() for k in fam_keys):
-                    # match type prefix6 con una delle quadre
-                    # supporta più alternative nelle quadre separate da | , ; / o spazi
-                    for k, outv in pairs:
-                        alts = [a.strip().upper() for a in re.split(r'[|,;/]+', k) if a.strip()]
-                        if (alts and type_prefix6 in alts) or (not alts and type_prefix6 == k.strip().upper()):
-                            val = outv.strip()
-                            break
-                # else: resta "N/C"
+                    val = s_out
 
+        if timed:
+            timer.add_rule(typ, clock() - t_rule)
 
-            elif typ == "R":
-                # Copia il valore da tf_<pname> (istanza -> tipo come fallback)
-                src_name = "tf_{0}".format(pname)
-                src_prm = el.LookupParameter(src_name) or sym.LookupParameter(src_name)
-                if src_prm:
-                    val = get_param_as_string(src_prm)
-                else:
-                    val = None
-            
-            
-            elif typ == "Y":
-                # ("Y", target_param_name, source_param_name)
-                src_name = rule[2]
-                src = el.LookupParameter(src_name) or sym.LookupParameter(src_name)
-
-                if prm.StorageType != StorageType.String:
-                    debug_log.append("{0} Y WARNING: il parametro destinazione '{1}' non è di tipo Testo".format(prefix_str, pname))
-                    val = "N/C"   # fallback su N/C anche se non-text (verrà probabilmente rifiutato da Revit, ma manteniamo coerenza)
-                else:
-                    s_out = None
-                    if src:
-                        if src.StorageType == StorageType.Double:
-                            try:
-                                try:
-                                    mm = UnitUtils.ConvertFromInternalUnits(src.AsDouble(), UnitTypeId.Millimeters)
-                                except:
-                                    from Autodesk.Revit.DB import DisplayUnitType
-                                    mm = UnitUtils.ConvertFromInternalUnits(src.AsDouble(), DisplayUnitType.DUT_MILLIMETERS)
-                                s_out = _format_number_keep_decimals(round(mm, 6))
-                            except:
-                                s_out = None
-                        else:
-                            s = (src.AsString() or "").strip()
-                            if s:
-                                n = _first_number(s)
-                                if n is not None:
-                                    s_out = _format_number_keep_decimals(n)
-
-                    if not s_out:
-                        debug_log.append("{0} Y WARNING: valore non interpretabile da '{1}'".format(prefix_str, src_name))
-                        val = "N/C"     # <— fallback richiesto
-                    else:
-                        val = s_out
+        # ----- scrittura -----
+        if val is None:
+            log.debug(fam, pname, el_id, "{} Skipped: no rule value", typ)
+            continue
 
-            # ----- scrittura -----
-            if val is None:
-                debug_log.append("{0} {1} Skipped {2}: no rule value".format(prefix_str, typ, pname))
-                continue
+        writeset.plan_write(write_plan, el, prm, val, typ)
 
-            try:
-                prm.Set(val)
-                param_count += 1
-                debug_log.append("{0} {1} Set {2}: val={3}".format(prefix_str, typ, pname, val))
-            except:
-                # tentativo come ValueString (alcuni string param)
-                try:
-                    prm.SetValueString(str(val))
-                    param_count += 1
-                    debug_log.append("{0} {1} SetValueString {2}: val={3}".format(prefix_str, typ, pname, val))
-                except:
-                    debug_log.append("{0} {1} WARNING: set fallita per {2} (val={3})".format(prefix_str, typ, pname, val))
-
-    trans.Commit()
+def _log_result(entry, how):
+    el_id = entry[writeset.EL_ID]
+    typ, pname = entry[writeset.CODE], entry[writeset.PNAME]
+    if how:
+        log.debug(el_labels[el_id], pname, el_id, "{} {}", typ, how)
+        fps.written(el_id, pname, entry[writeset.PRM])
+    else:
+        # da ritentare al prossimo run anche se gli input non cambiano
+        fps.forget(el_id)
+        log.info(el_labels[el_id], pname, el_id, "{}: set fallita (val={})", typ, entry[writeset.NEW])
 
-except Exception:
-    if trans.GetStatus() == TransactionStatus.Started:
-        trans.RollBack()
-    raise
+timer.elements = len(elements)
+timer.lap("valutazione regole")
 
-# -------- Output HTML (come il tuo, invariato nella struttura) --------
+# ------------------- TRANSAZIONE -------------------
+param_count = 0
+if not DRY_RUN:
+    trans = Transaction(doc, "AP mapping (PA + PF)")
+    trans.Start()
+    try:
+        param_count, _ = writeset.apply_plan(write_plan, _log_result)
+        timer.lap("scritture")
+        trans.Commit()
+        timer.lap("commit")
+        fps.save()
+
+    except Exception:
+        if trans.GetStatus() == TransactionStatus.Started:
+            trans.RollBack()
+        raise
+
+# -------- Output HTML: un solo documento, una sola print_html --------
 from pyrevit import script
 output = script.get_output()
-output.print_html("<b>Completato: {0} parametri compilati</b><br>".format(param_count))
-
-# Raggruppa e stampa solo i warning “WARNING:” per family name 
-logs_by_family = {}
-for line in debug_log:
-    family = line.split(" ", 1)[0]
-    first_close  = line.find(']')
-    second_close = line.find(']', first_close + 1)
-    if second_close != -1:
-        text = line[second_close + 1 :].strip()
-    else:
-        text = line[len(family) :].strip()
-    if not text.startswith("WARNING:"):
-        continue
-    logs_by_family.setdefault(family, []).append(text)
-
-for family, warnings in logs_by_family.items():
-    output.print_html("<h3 style='font-size:1.5em;'>{0}</h3>".format(family))
-    for w in warnings:
-        output.print_html(
-            "<span style='color:purple;font-weight:bold;font-size:1.5em;'>{0}</span><br>".format(w)
-        )
\ No newline at end of file
+header = []
+if DRY_RUN:
+    csv_path, json_path = writeset.export_dry_run(write_plan, "APMapping")
+    header.append("<b>Dry run: {0} scritture pianificate, nessuna modifica al modello</b><br>{1}<br>{2}".format(
+        len(write_plan), report.esc(csv_path), report.esc(json_path)))
+else:
+    header.append("<b>Completato: {0} parametri compilati</b>".format(param_count))
+header.append("Scritture: {0} - invariati (saltati): {1}".format(param_count, write_plan.unchanged))
+if not run_scope.whole:
+    header.append("Ambito: {0}".format(report.esc(run_scope.label)))
+header.append("Elementi con input invariati (saltati): {0} di {1}".format(fps.skipped, len(elements)))
+header.append("Cache tipi: {0} tipi valutati (miss), {1} istanze riusate (hit)".format(
+    type_misses, type_hits))
+header.append("Warning: {0} - segnalazioni: {1} (riepilogo ordinabile, dettagli per famiglia chiusi)".format(
+    log.count(runlog.WARNING), log.count(runlog.INFO)))
+
+# riepilogo per famiglia/regola + dettagli (WARNING e INFO) paginati
+timer.lap("report")
+timing_text = timer.finish(show=lambda s: None)
+if timing_text:
+    header.append("<pre>{0}</pre>".format(report.esc(timing_text)))
+output.print_html(report.render_html(log, header))
\ No newline at end of file
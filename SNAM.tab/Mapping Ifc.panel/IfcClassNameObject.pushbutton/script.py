@@ -9,25 +9,37 @@ clr.AddReference('System.Windows.Forms')
 
 from Autodesk.Revit.DB import *
 from Autodesk.Revit.UI import TaskDialog
-import xlrd
+from snam import multimatch, pipeline, scope, timing, writeset
+from snam.table import read_table
 from System.Collections.Generic import List
 from System.Windows.Forms import OpenFileDialog
 import System
 
 # Funzione per selezionare un file Excel
 def scegli_file_excel(titolo):
+    # in "Run all mapping" lo stesso file si chiede una volta sola
+    path = pipeline.remembered_file(titolo)
+    if path:
+        return path
     dialog = OpenFileDialog()
     dialog.Title = titolo
     dialog.Filter = "Excel Files (*.xls;*.xlsx)|*.xls;*.xlsx"
     dialog.Multiselect = False
     if dialog.ShowDialog() == System.Windows.Forms.DialogResult.OK:
-        return dialog.FileName
+        return pipeline.remember_file(titolo, dialog.FileName)
     else:
         TaskDialog.Show("Errore", "Operazione annullata: file non selezionato.")
         raise SystemExit
 
 # Documento corrente
 doc = __revit__.ActiveUIDocument.Document
+# ambito: intero modello; CTRL+click = scelta da elenco (selezione, vista, livelli, workset)
+# con l'interruttore "Valori IFC sul tipo" (vedi WRITE_ON_TYPE)
+run_scope = scope.choose(doc, __revit__.ActiveUIDocument, scope.wants_choice(globals()),
+                         switches=[scope.ON_TYPE])
+scope_note = "" if run_scope.whole else "\nAmbito: {0}".format(run_scope.label)
+if scope.ON_TYPE in run_scope.options:
+    scope_note += "\nValori IFC scritti sul tipo"
 
 # === Selezione file Excel ===
 IFCNAME_EXCEL = scegli_file_excel("Seleziona il file IfcName (Allegato 1)")
@@ -43,6 +55,15 @@ PARAM_IFCNAME = "IfcName"
 PARAM_OBJTYPE = "IfcObjectType"
 PARAM_EXPORT = BuiltInParameter.IFC_EXPORT_ELEMENT_AS
 PARAM_PREDEF = BuiltInParameter.IFC_EXPORT_PREDEFINEDTYPE
+PARAM_EXPORT_TYPE = BuiltInParameter.IFC_EXPORT_ELEMENT_TYPE_AS
+PARAM_PREDEF_TYPE = BuiltInParameter.IFC_EXPORT_PREDEFINEDTYPE_TYPE
+
+# interruttore "Valori IFC sul tipo" (CTRL+click): i valori si scrivono una
+# volta sul tipo quando il parametro esiste sul tipo (IfcName/IfcObjectType
+# associati al tipo, IFC_EXPORT_ELEMENT_TYPE_AS come entita' tipo,
+# IFC_EXPORT_PREDEFINEDTYPE_TYPE) e lo stesso target si svuota sulle istanze,
+# perche' nell'export IFC un valore di istanza prevale su quello del tipo.
+WRITE_ON_TYPE = scope.ON_TYPE in run_scope.options
 
 cat_builtin = List[BuiltInCategory]([
     BuiltInCategory.OST_DuctTerminal, BuiltInCategory.OST_DuctCurves,
@@ -58,166 +79,252 @@ cat_builtin = List[BuiltInCategory]([
     BuiltInCategory.OST_Doors,BuiltInCategory.OST_Floors
 ])
 
-# Funzioni helper (xlrd)
+# Funzioni helper (snam.table: solo le colonne usate, cache su disco se i file non sono cambiati)
 def load_ifcname_rules(path, sheet):
-    workbook = xlrd.open_workbook(path)
-    worksheet = workbook.sheet_by_name(sheet)
+    t = read_table(path, sheet, (0, 1))
     rules = []
-    for row_idx in range(1, worksheet.nrows):
-        val_a = str(worksheet.cell(row_idx, 0).value).strip()
-        val_b = str(worksheet.cell(row_idx, 1).value).strip().upper()
+    for row_idx in range(1, t.nrows):
+        val_a = str(t.value(row_idx, 0)).strip()
+        val_b = str(t.value(row_idx, 1)).strip().upper()
         if val_a:
             rules.append((val_a, val_b))
     return rules
 
 def load_placeholder(path, sheets):
-    workbook = xlrd.open_workbook(path)
     lookup = {}
     for sh in sheets:
-        worksheet = workbook.sheet_by_name(sh)
-        for row_idx in range(1, worksheet.nrows):
-            val = worksheet.cell(row_idx, 0).value
+        for val in read_table(path, sh, (0,)).col(0)[1:]:
             if val:
                 lookup[str(val).strip()[:5].upper()] = str(val).strip()
     return lookup
 
 def load_im_rules(path, sheet):
     # IM sheet: col0=codice, col1=IfcName, col3=IfcObjectType
-    workbook = xlrd.open_workbook(path)
-    worksheet = workbook.sheet_by_name(sheet)
+    t = read_table(path, sheet, (0, 1))
     lookup = {}
-    for row_idx in range(1, worksheet.nrows):
-        code = str(worksheet.cell(row_idx, 0).value or "").strip()
-        ifcname = str(worksheet.cell(row_idx, 1).value or "").strip()
+    for row_idx in range(1, t.nrows):
+        code = str(t.value(row_idx, 0) or "").strip()
+        ifcname = str(t.value(row_idx, 1) or "").strip()
         if code and ifcname:
             lookup[code.upper()] = ifcname
     return lookup
 
 def load_mapper_rules(path, sheets):
-    workbook = xlrd.open_workbook(path)
     rules = {}
     for sh in sheets:
-        worksheet = workbook.sheet_by_name(sh)
-        for row_idx in range(1, worksheet.nrows):
-            pref = str(worksheet.cell(row_idx, 0).value or "").strip()[:5].upper()
-            obj = str(worksheet.cell(row_idx, 4).value or "").strip()
-            exp = str(worksheet.cell(row_idx, 5).value or "").strip() or obj
+        t = read_table(path, sh, (0, 4, 5))
+        for row_idx in range(1, t.nrows):
+            pref = str(t.value(row_idx, 0) or "").strip()[:5].upper()
+            obj = str(t.value(row_idx, 4) or "").strip()
+            exp = str(t.value(row_idx, 5) or "").strip() or obj
             rules[pref] = (obj, exp)
     return rules
 
+# tempi per fase e per regola (attivi con SNAM_TIMING=1)
+timer = timing.Timer("IfcClassNameObject")
+timed = timer.enabled
+clock = timing.clock
+
 # Collector elementi Revit
-filter = ElementMulticategoryFilter(cat_builtin)
-collector = FilteredElementCollector(doc)\
-    .WherePasses(filter)\
-    .WhereElementIsNotElementType()\
-    .ToElements()
+collector = run_scope.elements(doc, cat_builtin)
+timer.lap("collector")
 
-# Carica regole Excel (xls con xlrd)
+# Carica regole Excel
 rules_ifcname = load_ifcname_rules(IFCNAME_EXCEL, IFCNAME_SHEET)
+# codice -> IfcName della prima riga con quel codice (come la scansione in ordine)
+ifcname_by_code = {}
+for a, b in rules_ifcname:
+    ifcname_by_code.setdefault(b, a)
+# AP330/AP450: IfcName piu' lunga contenuta nel nome famiglia, un solo automa per tutte
+ifcname_matcher = multimatch.Automaton([a for a, _ in rules_ifcname])
 im_lookup = load_im_rules(IFCNAME_EXCEL, "IM")
 ph_lookup = load_placeholder(PLACE_EXCEL, PLACE_SHEETS)
 map_rules = load_mapper_rules(MAPPER_EXCEL, MAPPER_SHEETS)
+timer.lap("excel")
 
-# Transazione
-t = Transaction(doc, "Compila parametri IFC")
-t.Start()
-try:
+# Pianificazione: le regole producono il write set, nessuna scrittura
+# (SHIFT+click = dry run, esporta il write set senza toccare il modello)
+DRY_RUN = writeset.is_dry_run(globals())
+write_plan = writeset.WritePlan()
+params = pipeline.resolver()  # handle di IfcName/IfcObjectType risolti una volta per tipo
 
-    for e in collector:
-        sym = doc.GetElement(e.GetTypeId())
-        if not sym:
-            continue
-
-        fam_param = sym.get_Parameter(BuiltInParameter.SYMBOL_FAMILY_NAME_PARAM)
-        fam_name = fam_param.AsString() if fam_param else ""
-        type_param = sym.get_Parameter(BuiltInParameter.SYMBOL_NAME_PARAM)
-        type_name = type_param.AsString() if type_param else ""
-
-        fam_name = fam_name or ""
-        type_name = type_name or ""
-
-        head5_fam = fam_name[:5].upper()
-        head5_type = type_name[:5].upper()
-
-        target_ifcname = None
-        is_placeholder = False
-
-        # Regola SNAM_
-        if type_name[:5].startswith("SNAM_") or type_name[:5].startswith("Tubaz") or type_name[:5].startswith("BARRE") :
-            for a, b in rules_ifcname:
-                if b == "BARRE":
-                    target_ifcname = a
-                    break
-            if target_ifcname:
-                # guardie None/IsReadOnly: se il parametro condiviso manca
-                # sull'elemento, .Set su None fa saltare tutta la transazione
-                p_ifc = e.LookupParameter(PARAM_IFCNAME)
-                if p_ifc and not p_ifc.IsReadOnly:
-                    p_ifc.Set(target_ifcname)
-                p_obj = e.LookupParameter(PARAM_OBJTYPE)
-                if p_obj and not p_obj.IsReadOnly:
-                    p_obj.Set("IfcFlowSegment")
-                p_exp = e.get_Parameter(PARAM_EXPORT)
-                if p_exp and not p_exp.IsReadOnly:
-                    p_exp.Set("IfcPipeSegmentType")
-            continue
-
-        # Regola NO025
-        if head5_fam == "NO025":
-            p_pre = e.get_Parameter(PARAM_PREDEF)
-            if p_pre and not p_pre.IsReadOnly:
-                p_pre.Set("BEND")
-            target_ifcname = next((a for a, b in rules_ifcname if b == "NO025"), None)
-
-        # Regole AP330/AP450 (aggiornato per intercettare nuove diciture)
-        elif fam_name.startswith(("AP330", "AP450")) and (
-            "con_comando_manuale_con_riduttore" in fam_name or
-            "con_comando_manuale_a_leva" in fam_name or
-            "con_comando_manuale_riduttore" in fam_name or
-            "con_comando_manuale_con_chiave_a_T" in fam_name
-        ):
-            # Trova tutte le IFCName presenti nel nome famiglia e seleziona la piu lunga
-            matches = [a for a, _ in rules_ifcname if a.strip() in fam_name]
-            if matches:
-                target_ifcname = max(matches, key=len)
-
-        # Regole FU/SE (Generic Model Placeholder - da PLACEHOLDER.xlsx)
-        elif head5_type in ph_lookup:
-            is_placeholder = True
-            target_ifcname = ph_lookup[head5_type]
-
-        # Regole IM (Generic Model Placeholder - da IfcName Allegato 1, sheet IM)
-        elif head5_type in im_lookup:
-            is_placeholder = True
-            target_ifcname = im_lookup[head5_type]
-
-        # Regola standard Allegato1: prova prima type_name, poi family_name
-        else:
-            target_ifcname = next((a for a, b in rules_ifcname if b == head5_type), None)
-            if not target_ifcname:
-                target_ifcname = next((a for a, b in rules_ifcname if b == head5_fam), None)
+def plan_set(e, prm, value, code):
+    # guardie None/IsReadOnly: se il parametro condiviso manca
+    # sull'elemento, .Set su None fa saltare tutta la transazione
+    if prm and not prm.IsReadOnly:
+        writeset.plan_write(write_plan, e, prm, value, code)
+
+def resolve_type(sym):
+    """
+    Scritture IFC del tipo sym: [(target, valore, codice regola)] con target
+    in "ifcname", "objtype", "export", "predef". Dipendono solo da nome
+    famiglia e nome tipo, quindi si calcolano una volta per FamilySymbol.
+    """
+    fam_param = sym.get_Parameter(BuiltInParameter.SYMBOL_FAMILY_NAME_PARAM)
+    fam_name = fam_param.AsString() if fam_param else ""
+    type_param = sym.get_Parameter(BuiltInParameter.SYMBOL_NAME_PARAM)
+    type_name = type_param.AsString() if type_param else ""
 
+    fam_name = fam_name or ""
+    type_name = type_name or ""
+
+    head5_fam = fam_name[:5].upper()
+    head5_type = type_name[:5].upper()
+
+    writes = []
+    target_ifcname = None
+    is_placeholder = False
+    if timed:
+        t_rule = clock()
+
+    # Regola SNAM_
+    if type_name[:5].startswith("SNAM_") or type_name[:5].startswith("Tubaz") or type_name[:5].startswith("BARRE") :
+        target_ifcname = ifcname_by_code.get("BARRE")
         if target_ifcname:
-            p_ifc = e.LookupParameter(PARAM_IFCNAME)
-            if p_ifc and not p_ifc.IsReadOnly:
-                p_ifc.Set(target_ifcname)
-
-        # Mapping Allegato3: per IM/SE/FU usa type_name, altrimenti family_name
-        mapper_key = head5_type if is_placeholder else head5_fam
-        obj_exp = map_rules.get(mapper_key)
-        if obj_exp:
-            obj, exp = obj_exp
-            p_obj = e.LookupParameter(PARAM_OBJTYPE)
-            p_exp = e.get_Parameter(PARAM_EXPORT)
-            if p_obj and not p_obj.IsReadOnly:
-                p_obj.Set(obj)
-            if p_exp and not p_exp.IsReadOnly:
-                p_exp.Set(exp)
+            writes.append(("ifcname", target_ifcname, "BARRE"))
+            writes.append(("objtype", "IfcFlowSegment", "BARRE"))
+            writes.append(("export", "IfcPipeSegmentType", "BARRE"))
+        if timed:
+            timer.add_rule("BARRE", clock() - t_rule)
+        return writes
+
+    # Regola NO025
+    if head5_fam == "NO025":
+        rule_code = "NO025"
+        writes.append(("predef", "BEND", rule_code))
+        target_ifcname = ifcname_by_code.get("NO025")
+
+    # Regole AP330/AP450 (aggiornato per intercettare nuove diciture)
+    elif fam_name.startswith(("AP330", "AP450")) and (
+        "con_comando_manuale_con_riduttore" in fam_name or
+        "con_comando_manuale_a_leva" in fam_name or
+        "con_comando_manuale_riduttore" in fam_name or
+        "con_comando_manuale_con_chiave_a_T" in fam_name
+    ):
+        rule_code = "AP330/AP450"
+        # IfcName piu lunga presente nel nome famiglia (automa Aho-Corasick)
+        target_ifcname = ifcname_matcher.longest(fam_name)
+
+    # Regole FU/SE (Generic Model Placeholder - da PLACEHOLDER.xlsx)
+    elif head5_type in ph_lookup:
+        rule_code = "PLACEHOLDER"
+        is_placeholder = True
+        target_ifcname = ph_lookup[head5_type]
+
+    # Regole IM (Generic Model Placeholder - da IfcName Allegato 1, sheet IM)
+    elif head5_type in im_lookup:
+        rule_code = "IM"
+        is_placeholder = True
+        target_ifcname = im_lookup[head5_type]
 
+    # Regola standard Allegato1: prova prima type_name, poi family_name
+    else:
+        rule_code = "Allegato1"
+        target_ifcname = ifcname_by_code.get(head5_type)
+        if not target_ifcname:
+            target_ifcname = ifcname_by_code.get(head5_fam)
+
+    if target_ifcname:
+        writes.append(("ifcname", target_ifcname, rule_code))
+    if timed:
+        t_map = clock()
+        timer.add_rule(rule_code, t_map - t_rule)
+
+    # Mapping Allegato3: per IM/SE/FU usa type_name, altrimenti family_name
+    mapper_key = head5_type if is_placeholder else head5_fam
+    obj_exp = map_rules.get(mapper_key)
+    if obj_exp:
+        obj, exp = obj_exp
+        writes.append(("objtype", obj, "Allegato3"))
+        writes.append(("export", exp, "Allegato3"))
+    if timed:
+        timer.add_rule("Allegato3", clock() - t_map)
+    return writes
+
+# parametro dell'istanza / equivalente sul tipo per ogni target
+INSTANCE_TARGETS = {
+    "ifcname": lambda el: params.get(el, PARAM_IFCNAME),
+    "objtype": lambda el: params.get(el, PARAM_OBJTYPE),
+    "export":  lambda el: el.get_Parameter(PARAM_EXPORT),
+    "predef":  lambda el: el.get_Parameter(PARAM_PREDEF),
+}
+TYPE_TARGETS = {
+    "ifcname": lambda sym: params.get(sym, PARAM_IFCNAME),
+    "objtype": lambda sym: params.get(sym, PARAM_OBJTYPE),
+    "export":  lambda sym: sym.get_Parameter(PARAM_EXPORT_TYPE),
+    "predef":  lambda sym: sym.get_Parameter(PARAM_PREDEF_TYPE),
+}
+
+def type_entity(value):
+    """
+    Valore per IFC_EXPORT_ELEMENT_TYPE_AS: l'entita' tipo della classe
+    ("IfcValve" -> "IfcValveType", "IfcValve.GASCOCK" -> "IfcValveType.GASCOCK");
+    un valore che e' gia' un'entita' tipo resta com'e'.
+    """
+    entity, dot, predef = value.partition(".")
+    if not entity.endswith("Type"):
+        entity += "Type"
+    return entity + dot + predef
+
+def plan_type(sym, writes):
+    """
+    WRITE_ON_TYPE: scrive sul tipo i target che hanno un parametro sul tipo;
+    restituisce le scritture per le istanze: i target rimasti e lo
+    svuotamento ("") di quelli scritti sul tipo.
+    """
+    left = []
+    for target, value, code in writes:
+        prm = TYPE_TARGETS[target](sym)
+        if prm and not prm.IsReadOnly:
+            if target == "export":
+                value = type_entity(value)
+            writeset.plan_write(write_plan, sym, prm, value, code)
+            left.append((target, "", code))
+        else:
+            left.append((target, value, code))
+    return left
+
+# scritture per tipo (type id -> lista, None se il tipo manca): una
+# risoluzione per FamilySymbol, riusata da tutte le sue istanze
+type_writes = {}
+for e in collector:
+    tid = e.GetTypeId().IntegerValue
+    writes = type_writes.get(tid, False)
+    if writes is False:
+        sym = doc.GetElement(e.GetTypeId())
+        writes = resolve_type(sym) if sym else None
+        if writes and WRITE_ON_TYPE:
+            writes = plan_type(sym, writes)
+        type_writes[tid] = writes
+    if not writes:
+        continue
+    for target, value, code in writes:
+        plan_set(e, INSTANCE_TARGETS[target](e), value, code)
+
+timer.elements = len(collector)
+timer.lap("valutazione regole")
+
+if DRY_RUN:
+    csv_path, _ = writeset.export_dry_run(write_plan, "IfcClassNameObject")
+    pipeline.notify("IFC Mapping", "Dry run: {0} scritture pianificate ({1} tipi valutati), nessuna modifica "
+                    "al modello.\n{2}{3}".format(len(write_plan), len(type_writes), csv_path, scope_note))
+    timer.finish()
+    raise SystemExit
+
+# Transazione: applica solo le differenze, elemento per elemento
+t = Transaction(doc, "Compila parametri IFC")
+t.Start()
+try:
+    written, failed = writeset.apply_plan(write_plan)
+    timer.lap("scritture")
     t.Commit()
+    timer.lap("commit")
 except:
     if t.GetStatus() == TransactionStatus.Started:
         t.RollBack()
     raise
 
-TaskDialog.Show("IFC Mapping", "Tutti i parametri IFC compilati correttamente.")
+timer.finish()
+pipeline.notify("IFC Mapping", "Tutti i parametri IFC compilati correttamente.\n"
+                "Scritture: {0} - invariati (saltati): {1} - fallite: {2} - tipi valutati: {3}{4}".format(
+                    written, write_plan.unchanged, failed, len(type_writes), scope_note))
\ No newline at end of file
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Sostituto minimo dell'ambiente Revit/pyRevit per eseguire gli script dei
+pulsanti su CPython (Linux), senza Revit.
+
+install() registra in sys.modules:
+- clr (AddReference non fa nulla);
+- Autodesk.Revit.DB (revitstub.db) e Autodesk.Revit.UI (TaskDialog che
+  registra i messaggi in task_dialogs);
+- System, System.Collections.Generic.List, System.Windows.Forms
+  (OpenFileDialog restituisce in ordine i percorsi di dialog_files);
+- pyrevit (revit.doc, revit.Transaction, script.get_output/get_logger,
+  forms.alert, forms.CommandSwitchWindow che restituisce in ordine le
+  scelte di switch_choices, con attivi gli interruttori in switch_flags);
+- xlrd (revitstub.xlrd_mem, workbook in memoria).
+
+Serve solo ai benchmark in bench/: non e' una simulazione fedele di Revit.
+"""
+import logging
+import sys
+import types
+
+from revitstub import db, xlrd_mem
+
+# stato condiviso con il runner
+task_dialogs = []   # (titolo, messaggio) di TaskDialog.Show / forms.alert
+html_output = []    # documenti passati a output.print_html
+dialog_files = []   # percorsi restituiti in ordine da OpenFileDialog
+switch_choices = []  # scelte restituite in ordine da forms.CommandSwitchWindow
+switch_flags = set()  # interruttori attivi nella CommandSwitchWindow
+
+
+def _module(name, **attrs):
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    sys.modules[name] = mod
+    return mod
+
+
+# ---------------------------------------------------------------- Revit UI
+
+class TaskDialog(object):
+    @staticmethod
+    def Show(title, message, *args):
+        task_dialogs.append((title, message))
+        return 1
+
+
+# ------------------------------------------------------------------ System
+
+class _GenericList(object):
+    """System.Collections.Generic.List: List[T](iterabile) -> list."""
+
+    def __getitem__(self, item_type):
+        return list
+
+
+class DialogResult(object):
+    OK = 1
+    Cancel = 2
+
+
+class OpenFileDialog(object):
+    def __init__(self):
+        self.Title = ""
+        self.Filter = ""
+        self.Multiselect = False
+        self.FileName = ""
+
+    def ShowDialog(self):
+        if not dialog_files:
+            return DialogResult.Cancel
+        self.FileName = dialog_files.pop(0)
+        return DialogResult.OK
+
+
+# ----------------------------------------------------------------- pyRevit
+
+class _Output(object):
+    def print_html(self, html):
+        html_output.append(html)
+
+    def print_md(self, text):
+        html_output.append(text)
+
+
+class _RevitTransaction(object):
+    def __init__(self, name="", doc=None):
+        self._t = db.Transaction(doc or _pyrevit_revit.doc, name)
+
+    def __enter__(self):
+        self._t.Start()
+        return self._t
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._t.Commit()
+        else:
+            self._t.RollBack()
+        return False
+
+
+def _alert(msg, title="", **kwargs):
+    task_dialogs.append((title, msg))
+
+
+class CommandSwitchWindow(object):
+    @staticmethod
+    def show(options, switches=None, message="", **kwargs):
+        choice = switch_choices.pop(0) if switch_choices else None
+        if switches is None:
+            return choice
+        return choice, dict((s, s in switch_flags) for s in switches)
+
+
+_pyrevit_revit = None
+
+
+def install():
+    """Registra i moduli sostitutivi (idempotente)."""
+    global _pyrevit_revit
+    if "Autodesk.Revit.DB" in sys.modules and sys.modules["Autodesk.Revit.DB"] is db:
+        return
+    _module("clr", AddReference=lambda *a: None, AddReferenceByName=lambda *a: None)
+
+    autodesk = _module("Autodesk")
+    revit_pkg = _module("Autodesk.Revit")
+    ui = _module("Autodesk.Revit.UI", TaskDialog=TaskDialog)
+    sys.modules["Autodesk.Revit.DB"] = db
+    autodesk.Revit = revit_pkg
+    revit_pkg.DB = db
+    revit_pkg.UI = ui
+
+    system = _module("System")
+    collections = _module("System.Collections")
+    generic = _module("System.Collections.Generic", List=_GenericList())
+    windows = _module("System.Windows")
+    forms = _module("System.Windows.Forms", OpenFileDialog=OpenFileDialog, DialogResult=DialogResult)
+    system.Collections, collections.Generic = collections, generic
+    system.Windows, windows.Forms = windows, forms
+
+    pyrevit = _module("pyrevit")
+    _pyrevit_revit = _module("pyrevit.revit", doc=None, Transaction=_RevitTransaction)
+    script = _module("pyrevit.script", get_output=_Output,
+                     get_logger=lambda: logging.getLogger("pyrevit"))
+    pforms = _module("pyrevit.forms", alert=_alert, CommandSwitchWindow=CommandSwitchWindow)
+    pyrevit.revit, pyrevit.DB, pyrevit.script, pyrevit.forms = _pyrevit_revit, db, script, pforms
+    pyrevit.UI = ui
+
+    sys.modules["xlrd"] = xlrd_mem
+
+
+def set_document(doc):
+    """Documento attivo per pyrevit.revit.doc; azzera i messaggi raccolti."""
+    _pyrevit_revit.doc = doc
+    del task_dialogs[:]
+    del html_output[:]
@@ -0,0 +1,660 @@
+# -*- coding: utf-8 -*-
+"""
+Sostituto in puro Python della parte di Autodesk.Revit.DB usata dagli
+script: elementi, parametri, collector, transazioni, unita'.
+
+Non riproduce Revit: serve a eseguire gli script su CPython (Linux) con un
+modello sintetico e a misurarne i tempi. I costi "interessanti" sono
+modellati sul comportamento reale: LookupParameter scorre tutti i parametri
+dell'elemento, get_Parameter con un handle e' un accesso diretto, il
+collector scorre tutti gli elementi del documento.
+"""
+import itertools
+import uuid
+
+# ---------------------------------------------------------------- enumerazioni
+
+
+class StorageType(object):
+    None_ = 0
+    Integer = 1
+    Double = 2
+    String = 3
+    ElementId = 4
+
+
+class TransactionStatus(object):
+    Uninitialized = 0
+    Started = 1
+    RolledBack = 2
+    Committed = 3
+
+
+_BIP_NAMES = (
+    "BASEPOINT_ELEVATION_PARAM", "FAMILY_LEVEL_PARAM", "IFC_EXPORT_ELEMENT_AS",
+    "IFC_EXPORT_ELEMENT_TYPE_AS", "IFC_EXPORT_PREDEFINEDTYPE", "IFC_EXPORT_PREDEFINEDTYPE_TYPE",
+    "INSTANCE_ELEVATION_PARAM",
+    "INSTANCE_FREE_HOST_OFFSET_PARAM", "LEVEL_ELEV", "PROJECT_BUILDING_NAME",
+    "PROJECT_NAME", "PROJECT_NUMBER", "PROJECT_STATUS", "RBS_OFFSET_PARAM",
+    "RBS_PIPE_DIAMETER_PARAM", "RBS_PIPE_OUTER_DIAMETER", "SYMBOL_FAMILY_NAME_PARAM",
+    "SYMBOL_NAME_PARAM", "ELEM_FAMILY_PARAM", "ALL_MODEL_INSTANCE_COMMENTS",
+)
+
+_BIC_NAMES = (
+    "OST_CableTray", "OST_CableTrayFitting", "OST_Conduit", "OST_ConduitFitting",
+    "OST_Doors", "OST_DuctAccessory", "OST_DuctCurves", "OST_DuctFitting",
+    "OST_DuctInsulations", "OST_DuctLinings", "OST_DuctTerminal",
+    "OST_ElectricalEquipment", "OST_FlexDuctCurves", "OST_FlexPipeCurves",
+    "OST_Floors", "OST_Furniture", "OST_GenericModel", "OST_MechanicalEquipment",
+    "OST_PipeAccessory", "OST_PipeCurves", "OST_PipeFitting", "OST_PipeInsulations",
+    "OST_ProjectBasePoint", "OST_Levels", "OST_ProjectInformation",
+)
+
+
+class BuiltInParameter(object):
+    """Valori interi negativi come in Revit; INVALID = -1."""
+    INVALID = -1
+
+
+for _i, _n in enumerate(_BIP_NAMES):
+    setattr(BuiltInParameter, _n, -1000000 - _i)
+
+
+class BuiltInCategory(object):
+    INVALID = -1
+
+
+for _i, _n in enumerate(_BIC_NAMES):
+    setattr(BuiltInCategory, _n, -2000000 - _i)
+
+BIP_BY_VALUE = dict((getattr(BuiltInParameter, n), n) for n in _BIP_NAMES)
+
+
+class UnitTypeId(object):
+    Millimeters = "autodesk.unit.unit:millimeters"
+
+
+class DisplayUnitType(object):
+    DUT_MILLIMETERS = "DUT_MILLIMETERS"
+
+
+_FT_TO_MM = 304.8
+
+
+class UnitUtils(object):
+    @staticmethod
+    def ConvertFromInternalUnits(value, unit):
+        if unit in (UnitTypeId.Millimeters, DisplayUnitType.DUT_MILLIMETERS):
+            return value * _FT_TO_MM
+        return value
+
+    @staticmethod
+    def ConvertToInternalUnits(value, unit):
+        if unit in (UnitTypeId.Millimeters, DisplayUnitType.DUT_MILLIMETERS):
+            return value / _FT_TO_MM
+        return value
+
+# ------------------------------------------------------------------ identita'
+
+
+class ElementId(object):
+    __slots__ = ("IntegerValue",)
+
+    def __init__(self, value):
+        self.IntegerValue = int(value)
+
+    def __eq__(self, other):
+        return isinstance(other, ElementId) and other.IntegerValue == self.IntegerValue
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.IntegerValue)
+
+    def __repr__(self):
+        return "ElementId({0})".format(self.IntegerValue)
+
+
+ElementId.InvalidElementId = ElementId(-1)
+
+
+class Guid(object):
+    __slots__ = ("value",)
+
+    def __init__(self, value=None):
+        self.value = str(value or uuid.uuid4())
+
+    def __eq__(self, other):
+        return isinstance(other, Guid) and other.value == self.value
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def ToString(self):
+        return self.value
+
+    def __str__(self):
+        return self.value
+
+# ----------------------------------------------------------------- parametri
+
+
+class Definition(object):
+    """Definizione di parametro: Name, BuiltInParameter, Id del ParameterElement."""
+
+    def __init__(self, name, bip=BuiltInParameter.INVALID, guid=None, element_id=None):
+        self.Name = name
+        self.BuiltInParameter = bip
+        self.GUID = guid
+        self.Id = element_id or ElementId(-1)
+
+    def __repr__(self):
+        return "Definition({0!r})".format(self.Name)
+
+
+class Parameter(object):
+    """Valore tipizzato per StorageType; Set con tipo sbagliato solleva come un Set fallito."""
+
+    __slots__ = ("Definition", "StorageType", "IsReadOnly", "_value")
+
+    def __init__(self, definition, storage_type, value=None, read_only=False):
+        self.Definition = definition
+        self.StorageType = storage_type
+        self.IsReadOnly = read_only
+        self._value = value
+
+    @property
+    def IsShared(self):
+        return self.Definition.GUID is not None
+
+    @property
+    def GUID(self):
+        return self.Definition.GUID
+
+    @property
+    def Id(self):
+        return self.Definition.Id
+
+    @property
+    def HasValue(self):
+        return self._value is not None
+
+    def AsString(self):
+        return self._value if self.StorageType == StorageType.String else None
+
+    def AsInteger(self):
+        return int(self._value or 0) if self.StorageType == StorageType.Integer else 0
+
+    def AsDouble(self):
+        return float(self._value or 0.0) if self.StorageType == StorageType.Double else 0.0
+
+    def AsElementId(self):
+        if self.StorageType == StorageType.ElementId and self._value is not None:
+            return self._value
+        return ElementId.InvalidElementId
+
+    def AsValueString(self):
+        st = self.StorageType
+        if self._value is None:
+            return None
+        if st == StorageType.Double:
+            return "{0:g} mm".format(round(self._value * _FT_TO_MM, 1))
+        if st == StorageType.ElementId:
+            return str(self._value.IntegerValue)
+        return str(self._value)
+
+    def Set(self, value):
+        if self.IsReadOnly:
+            raise InvalidOperationException("parametro di sola lettura")
+        st = self.StorageType
+        if st == StorageType.String and isinstance(value, str):
+            self._value = value
+        elif st == StorageType.Integer and isinstance(value, int) and not isinstance(value, bool):
+            self._value = value
+        elif st == StorageType.Double and isinstance(value, (int, float)):
+            self._value = float(value)
+        elif st == StorageType.ElementId and isinstance(value, ElementId):
+            self._value = value
+        else:
+            raise ArgumentException("tipo non compatibile con {0}".format(self.Definition.Name))
+        return True
+
+    def SetValueString(self, text):
+        if self.IsReadOnly:
+            raise InvalidOperationException("parametro di sola lettura")
+        st = self.StorageType
+        if st == StorageType.Double:
+            self._value = float(str(text).split()[0].replace(",", ".")) / _FT_TO_MM
+        elif st == StorageType.Integer:
+            self._value = int(float(str(text).replace(",", ".")))
+        else:
+            raise ArgumentException("SetValueString non supportato")
+        return True
+
+
+class ArgumentException(Exception):
+    pass
+
+
+class InvalidOperationException(Exception):
+    pass
+
+# ------------------------------------------------------------------ elementi
+
+_ids = itertools.count(100000)
+
+
+class Category(object):
+    def __init__(self, bic, name):
+        self.Id = ElementId(bic)
+        self.Name = name
+
+
+def param_keys(definition):
+    """Chiavi con cui get_Parameter trova un parametro: BIP, GUID, Definition."""
+    keys = [id(definition)]
+    if definition.BuiltInParameter != BuiltInParameter.INVALID:
+        keys.append(definition.BuiltInParameter)
+    if definition.GUID is not None:
+        keys.append(definition.GUID)
+    return keys
+
+
+def make_layout(definitions):
+    """
+    Indice {chiave: posizione} per una lista di definizioni, da condividere
+    tra elementi con gli stessi parametri nello stesso ordine (stesso tipo):
+    evita un dict per elemento su modelli da centinaia di migliaia di elementi.
+    """
+    layout = {}
+    for i, d in enumerate(definitions):
+        for k in param_keys(d):
+            layout.setdefault(k, i)
+    return layout
+
+
+class Element(object):
+    """Elemento con lista di parametri; get_Parameter passa da un indice (layout) condiviso."""
+
+    is_type = False
+
+    def __init__(self, doc=None, name="", category=None, type_id=None):
+        self.Id = ElementId(next(_ids))
+        self.Name = name
+        self.Category = category
+        self._type_id = type_id or ElementId.InvalidElementId
+        self._params = []
+        self._layout = {}
+        self._shared_layout = False
+        self.LevelId = ElementId.InvalidElementId
+        self.Location = None
+        self.Document = doc
+        if doc is not None:
+            doc.add(self)
+
+    def add_param(self, prm):
+        if self._shared_layout:
+            self._layout = dict(self._layout)
+            self._shared_layout = False
+        pos = len(self._params)
+        self._params.append(prm)
+        for k in param_keys(prm.Definition):
+            self._layout.setdefault(k, pos)
+        return prm
+
+    def set_params(self, layout, params):
+        """Parametri in blocco con un layout condiviso (vedi make_layout)."""
+        self._layout = layout
+        self._params = params
+        self._shared_layout = True
+
+    @property
+    def Parameters(self):
+        return list(self._params)
+
+    def GetTypeId(self):
+        return self._type_id
+
+    def LookupParameter(self, name):
+        # come in Revit: scansione lineare del set di parametri
+        for p in self._params:
+            if p.Definition.Name == name:
+                return p
+        return None
+
+    def get_Parameter(self, handle):
+        pos = self._layout.get(id(handle) if isinstance(handle, Definition) else handle)
+        return self._params[pos] if pos is not None else None
+
+    def __repr__(self):
+        return "<{0} {1} {2!r}>".format(type(self).__name__, self.Id.IntegerValue, self.Name)
+
+
+class ElementType(Element):
+    is_type = True
+
+
+class FamilySymbol(ElementType):
+    pass
+
+
+class FamilyInstance(Element):
+    pass
+
+
+class Level(Element):
+    def __init__(self, doc, name, elevation):
+        Element.__init__(self, doc, name, Category(BuiltInCategory.OST_Levels, "Levels"))
+        self.Elevation = elevation
+
+
+class ProjectInfo(Element):
+    pass
+
+
+class BasePoint(Element):
+    pass
+
+
+class ParameterElement(Element):
+    def __init__(self, doc, definition):
+        Element.__init__(self, doc, definition.Name)
+        definition.Id = self.Id
+        self._definition = definition
+
+    def GetDefinition(self):
+        return self._definition
+
+
+class SharedParameterElement(ParameterElement):
+    pass
+
+
+class XYZ(object):
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.X, self.Y, self.Z = x, y, z
+
+
+class LocationPoint(object):
+    def __init__(self, point):
+        self.Point = point
+
+# --------------------------------------------------------------- documento
+
+
+class _BindingIterator(object):
+    def __init__(self, items):
+        self._items = items
+        self._i = -1
+
+    def Reset(self):
+        self._i = -1
+
+    def MoveNext(self):
+        self._i += 1
+        return self._i < len(self._items)
+
+    @property
+    def Key(self):
+        return self._items[self._i][0]
+
+    @property
+    def Current(self):
+        return self._items[self._i][1]
+
+
+class BindingMap(object):
+    """Definition -> binding (InstanceBinding / TypeBinding con le Category associate)."""
+
+    def __init__(self):
+        self._items = []
+
+    def Insert(self, definition, binding):
+        self._items.append((definition, binding))
+        return True
+
+    def ForwardIterator(self):
+        return _BindingIterator(self._items)
+
+    @property
+    def Size(self):
+        return len(self._items)
+
+
+class InstanceBinding(object):
+    def __init__(self, categories=()):
+        self.Categories = list(categories)
+
+
+class TypeBinding(InstanceBinding):
+    pass
+
+
+class Document(object):
+    def __init__(self, title, path_name=None):
+        self.Title = title
+        self.PathName = path_name or (title + ".rvt")
+        self.ParameterBindings = BindingMap()
+        self.IsWorkshared = False
+        self._elements = {}
+        self._order = []
+        self.transactions = []
+
+    def add(self, el):
+        self._elements[el.Id.IntegerValue] = el
+        self._order.append(el)
+
+    def GetElement(self, element_id):
+        if element_id is None:
+            return None
+        return self._elements.get(element_id.IntegerValue)
+
+    def elements(self):
+        return self._order
+
+
+class UIDocument(object):
+    def __init__(self, doc):
+        self.Document = doc
+        self.selection_ids = []
+
+    @property
+    def Selection(self):
+        return _Selection(self)
+
+    @property
+    def ActiveView(self):
+        return getattr(self.Document, "active_view", None)
+
+
+class _Selection(object):
+    def __init__(self, uidoc):
+        self._uidoc = uidoc
+
+    def GetElementIds(self):
+        return list(self._uidoc.selection_ids)
+
+
+class UIApplication(object):
+    def __init__(self, doc):
+        self.ActiveUIDocument = UIDocument(doc)
+
+# ------------------------------------------------------------ filtri/collector
+
+
+class ElementFilter(object):
+    def passes(self, el):
+        return True
+
+
+class ElementMulticategoryFilter(ElementFilter):
+    def __init__(self, categories):
+        self.cats = set(c.IntegerValue if isinstance(c, ElementId) else int(c) for c in categories)
+
+    def passes(self, el):
+        return el.Category is not None and el.Category.Id.IntegerValue in self.cats
+
+
+class ElementCategoryFilter(ElementMulticategoryFilter):
+    def __init__(self, category):
+        ElementMulticategoryFilter.__init__(self, [category])
+
+
+class _GreaterStringRule(object):
+    def __init__(self, param_id, value):
+        self.param_id = param_id
+        self.value = value
+        self._definition = None
+
+    def passes(self, el):
+        if self._definition is None:
+            self._definition = el.Document.GetElement(self.param_id).GetDefinition()
+        p = el.get_Parameter(self._definition)
+        if p is None:
+            return False
+        s = p.AsString()
+        return s is not None and s > self.value
+
+
+class ParameterFilterRuleFactory(object):
+    @staticmethod
+    def CreateGreaterRule(param_id, value, case_sensitive=True):
+        return _GreaterStringRule(param_id, value)
+
+
+class ElementParameterFilter(ElementFilter):
+    def __init__(self, rule):
+        self.rule = rule
+
+    def passes(self, el):
+        return self.rule.passes(el)
+
+
+class ElementLevelFilter(ElementFilter):
+    def __init__(self, level_id):
+        self.level_id = level_id
+
+    def passes(self, el):
+        return el.LevelId == self.level_id
+
+
+class WorksetId(ElementId):
+    pass
+
+
+class WorksetKind(object):
+    UserWorkset = 1
+
+
+class ElementWorksetFilter(ElementFilter):
+    def __init__(self, workset_id):
+        self.workset_id = workset_id
+
+    def passes(self, el):
+        return getattr(el, "WorksetId", None) == self.workset_id
+
+
+class LogicalOrFilter(ElementFilter):
+    def __init__(self, filters):
+        self.filters = list(filters)
+
+    def passes(self, el):
+        return any(f.passes(el) for f in self.filters)
+
+
+class FilteredWorksetCollector(object):
+    def __init__(self, doc):
+        self._doc = doc
+
+    def OfKind(self, kind):
+        return list(getattr(self._doc, "worksets", ()))
+
+
+class FilteredElementCollector(object):
+    """Collector a catena: ogni filtro restringe la lista (valutazione pigra in ToElements)."""
+
+    def __init__(self, doc, arg=None):
+        """arg: id di una vista (elementi in doc.view_elements) o lista di ElementId."""
+        self._doc = doc
+        self._preds = []
+        self._source = None
+        if isinstance(arg, ElementId):
+            view_ids = getattr(doc, "view_elements", {}).get(arg.IntegerValue)
+            if view_ids is not None:
+                self._source = [doc.GetElement(ElementId(i)) for i in view_ids]
+        elif arg is not None:
+            self._source = [doc.GetElement(i) for i in arg]
+
+    def _add(self, pred):
+        self._preds.append(pred)
+        return self
+
+    def WherePasses(self, flt):
+        return self._add(flt.passes)
+
+    def OfClass(self, cls):
+        return self._add(lambda el: isinstance(el, cls))
+
+    def OfCategory(self, bic):
+        return self._add(lambda el: el.Category is not None and el.Category.Id.IntegerValue == int(bic))
+
+    def WhereElementIsNotElementType(self):
+        return self._add(lambda el: not el.is_type)
+
+    def WhereElementIsElementType(self):
+        return self._add(lambda el: el.is_type)
+
+    def ToElements(self):
+        preds = self._preds
+        source = self._doc.elements() if self._source is None else self._source
+        return [el for el in source if el is not None and all(p(el) for p in preds)]
+
+    def ToElementIds(self):
+        return [el.Id for el in self.ToElements()]
+
+    def FirstElement(self):
+        els = self.ToElements()
+        return els[0] if els else None
+
+    def GetElementCount(self):
+        return len(self.ToElements())
+
+    def __iter__(self):
+        return iter(self.ToElements())
+
+# --------------------------------------------------------------- transazioni
+
+
+class Transaction(object):
+    def __init__(self, doc, name=""):
+        self._doc = doc
+        self.name = name
+        self._status = TransactionStatus.Uninitialized
+
+    def Start(self):
+        self._status = TransactionStatus.Started
+        self._doc.transactions.append(self.name)
+        return self._status
+
+    def Commit(self):
+        self._status = TransactionStatus.Committed
+        return self._status
+
+    def RollBack(self):
+        self._status = TransactionStatus.RolledBack
+        return self._status
+
+    def GetStatus(self):
+        return self._status
+
+
+class TransactionGroup(Transaction):
+    def Assimilate(self):
+        return self.Commit()
+
+
+__all__ = [n for n in list(globals()) if not n.startswith("_") and n not in ("itertools", "uuid")]
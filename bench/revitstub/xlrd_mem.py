@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+xlrd in memoria: i workbook sintetici si registrano per nome file e
+open_workbook li restituisce qualunque sia la cartella del percorso
+(gli script usano percorsi Windows fissi).
+
+I fogli sono memorizzati per colonne ({indice: valori}), come li legge
+snam.table: un foglio CI da 100k righe x 137 colonne costa solo le colonne
+effettivamente valorizzate.
+"""
+import ntpath
+
+_REGISTRY = {}
+
+
+class XLRDError(Exception):
+    pass
+
+
+def register(name, workbook):
+    """Registra workbook (Workbook) sotto il nome file name."""
+    _REGISTRY[ntpath.basename(name).lower()] = workbook
+
+
+def clear():
+    _REGISTRY.clear()
+
+
+def exists(path):
+    return ntpath.basename(path).lower() in _REGISTRY
+
+
+class Sheet(object):
+    """Foglio per colonne; le celle mancanti valgono "" come in xlrd."""
+
+    def __init__(self, name, columns, nrows=None):
+        self.name = name
+        self._cols = dict(columns)
+        self.ncols = max(self._cols) + 1 if self._cols else 0
+        self.nrows = nrows if nrows is not None else max([len(v) for v in self._cols.values()] or [0])
+
+    def col_values(self, colx, start_rowx=0, end_rowx=None):
+        col = self._cols.get(colx)
+        end = self.nrows if end_rowx is None else end_rowx
+        if col is None:
+            return [""] * max(0, end - start_rowx)
+        values = col[start_rowx:end]
+        if len(values) < end - start_rowx:
+            values = values + [""] * (end - start_rowx - len(values))
+        return values
+
+    def cell_value(self, rowx, colx):
+        if not (0 <= rowx < self.nrows and 0 <= colx < self.ncols):
+            raise IndexError("cella ({0}, {1}) fuori dal foglio {2}".format(rowx, colx, self.name))
+        col = self._cols.get(colx)
+        return col[rowx] if col is not None and rowx < len(col) else ""
+
+    def row_values(self, rowx, start_colx=0, end_colx=None):
+        end = self.ncols if end_colx is None else end_colx
+        return [self.cell_value(rowx, c) for c in range(start_colx, end)]
+
+
+class Book(object):
+    def __init__(self, sheets):
+        self._sheets = [(s.name, s) for s in sheets]
+
+    def sheet_names(self):
+        return [n for n, _ in self._sheets]
+
+    def sheet_by_name(self, name):
+        for n, s in self._sheets:
+            if n == name:
+                return s
+        raise XLRDError("No sheet named <{0!r}>".format(name))
+
+    def sheet_by_index(self, i):
+        return self._sheets[i][1]
+
+    @property
+    def nsheets(self):
+        return len(self._sheets)
+
+    def release_resources(self):
+        pass
+
+
+def open_workbook(filename=None, on_demand=False, **kwargs):
+    wb = _REGISTRY.get(ntpath.basename(filename or "").lower())
+    if wb is None:
+        raise IOError("No such file or directory: {0!r}".format(filename))
+    return wb
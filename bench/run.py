@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark dei pulsanti di mappatura su CPython, senza Revit.
+
+Ogni pulsante gira sul suo script.py reale (runpy) contro un modello
+sintetico (bench/synth.py) e i moduli sostitutivi di bench/revitstub.
+Per ogni esecuzione riporta elementi, secondi, elementi al secondo e memoria
+di picco (RSS del processo; con --tracemalloc anche il picco Python del solo
+script). Di default ogni pulsante gira in un processo separato, cosi' il
+picco RSS non e' sporcato dai pulsanti precedenti.
+
+Uso (dalla radice del repository):
+
+    python bench/run.py                       # tutti, 100k tubi / 50k AP
+    python bench/run.py pipe accessories --scale 0.1
+    python bench/run.py ifc --repeat 2        # 2a esecuzione = modello gia' mappato
+    python bench/run.py --timing              # tempi per fase/regola (snam.timing)
+    python bench/run.py all                   # "Run all mapping" (tutti gli stadi in sequenza)
+    python bench/run.py ifc --switch "Valori IFC sul tipo"   # CTRL+click con l'interruttore
+    python bench/run.py --json risultati.json
+
+Non e' una suite di test: i numeri servono a confrontare versioni dello
+stesso codice sulla stessa macchina. Il lettore .xlsx in streaming (i
+workbook sintetici sono in memoria e non lo usano) si verifica a parte con
+bench/xlsx_check.py.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+TAB = os.path.join(ROOT, "SNAM.tab")
+
+for p in (HERE, os.path.join(ROOT, "lib")):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+import revitstub  # noqa: E402
+
+revitstub.install()
+
+import synth  # noqa: E402
+from revitstub import db, xlrd_mem  # noqa: E402
+
+# pulsante -> (script, contenuto del modello, file restituiti dai dialoghi)
+BUTTONS = OrderedDict([
+    ("pipe", ("Mapping Element.panel/1.BarreMapping.pushbutton",
+              dict(pipes=1.0), ())),
+    ("accessories", ("Mapping Element.panel/2.AccessoriesMapping.pushbutton",
+                     dict(accessories=1.0), ())),
+    ("common", ("Mapping Common.panel/2.Parametri Comuni_Mapping.pushbutton",
+                dict(pipes=1.0, accessories=1.0, generics=1.0),
+                (synth.REGOLE_XLSX, synth.ALLEGATO2_XLSX))),
+    ("project", ("Mapping Common.panel/1.Project Information Mapping.pushbutton",
+                 dict(), (synth.ALLEGATO2_XLSX,))),
+    ("ifc", ("Mapping Ifc.panel/IfcClassNameObject.pushbutton",
+             dict(pipes=1.0, accessories=1.0, generics=1.0),
+             (synth.IFCNAME_XLSX, synth.PLACEHOLDER_XLSX, synth.ALLEGATO3_XLSX))),
+    ("clean", ("Mapping Common.panel/3.Clean Parameter CA-NP-LC-VAR .pushbutton",
+               dict(pipes=1.0, accessories=1.0, filled=True), ())),
+    # Run all mapping: Allegato 2 si chiede una volta sola per i due stadi che lo usano
+    ("all", ("Mapping Common.panel/0.Run All Mapping.pushbutton",
+             dict(pipes=1.0, accessories=1.0, generics=1.0),
+             (synth.ALLEGATO2_XLSX, synth.REGOLE_XLSX, synth.IFCNAME_XLSX, synth.PLACEHOLDER_XLSX,
+              synth.ALLEGATO3_XLSX))),
+])
+
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def _rss_mb():
+    if resource is None:
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss e' in KB su Linux, in byte su macOS
+    return round(kb / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0), 1)
+
+
+def _patch_exists():
+    # gli script controllano l'esistenza del CI con os.path.exists
+    real_exists = os.path.exists
+
+    def exists(path):
+        return xlrd_mem.exists(path) or real_exists(path)
+    os.path.exists = exists
+
+
+def _outcome():
+    if revitstub.task_dialogs:
+        title, msg = revitstub.task_dialogs[-1]
+        return u"{0}: {1}".format(title, msg.splitlines()[0] if msg else "")
+    if revitstub.html_output:
+        return _TAG_RE.sub(" ", revitstub.html_output[-1]).split("  ")[0].strip()
+    return ""
+
+
+def build(name, args):
+    """Modello e workbook sintetici per il pulsante name; restituisce (doc, elementi)."""
+    _, content, _ = BUTTONS[name]
+    sizes = {"pipes": args.pipes, "accessories": args.accessories, "generics": args.generics}
+    kwargs = {"filler": args.filler}
+    n = 0
+    for key, factor in content.items():
+        if key in sizes:
+            kwargs[key] = int(sizes[key] * factor * args.scale)
+            n += kwargs[key]
+        else:
+            kwargs[key] = factor
+    synth.register_workbooks(max(1, int(args.accessories * args.scale)))
+    doc = synth.build_model(**kwargs)
+    return doc, n or 1
+
+
+def run_button(name, args):
+    """Esegue il pulsante name (args.repeat volte sullo stesso modello); lista di risultati."""
+    import runpy
+    import tempfile
+    from snam import allegato2, fingerprint, scope, timing, wbcache
+    wbcache.ENABLED = False
+    timing.ENABLED = args.timing
+    # impronte e ultimo Allegato 2 in una cartella nuova: il primo run
+    # elabora sempre tutto e chiede i file ai dialoghi
+    fingerprint.FP_DIR = tempfile.mkdtemp(prefix="snam_fp_")
+    allegato2.LAST_PATH_FILE = os.path.join(fingerprint.FP_DIR, "allegato2_path.txt")
+
+    folder, _, dialogs = BUTTONS[name]
+    script = os.path.join(TAB, folder, "script.py")
+    t0 = time.time()
+    doc, n = build(name, args)
+    build_s = time.time() - t0
+    rss_model = _rss_mb()
+
+    # selezione corrente: i primi --select elementi di modello (ambito snam.scope)
+    selection = []
+    if args.select:
+        selection = [el.Id for el in doc.elements()
+                     if not el.is_type and el.Category is not None and el.GetTypeId().IntegerValue > 0]
+        selection = selection[:args.select]
+        n = len(selection) or n
+
+    results = []
+    for run in range(1, args.repeat + 1):
+        uiapp = db.UIApplication(doc)
+        uiapp.ActiveUIDocument.selection_ids = selection
+        revitstub.set_document(doc)
+        # dal secondo run Allegato 2 e' quello ricordato (snam.allegato2): niente
+        # dialogo, salvo con l'interruttore che lo fa scegliere di nuovo
+        repick = scope.REPICK_ALLEGATO2 in args.switch
+        revitstub.dialog_files[:] = [f for f in dialogs
+                                     if run == 1 or repick or f != synth.ALLEGATO2_XLSX]
+        # un click normale elabora tutto il modello: la selezione e gli
+        # interruttori si scelgono con CTRL+click
+        ctrl = bool(selection or args.switch)
+        revitstub.switch_choices[:] = [scope.SELECTION if selection else scope.MODEL] if ctrl else []
+        revitstub.switch_flags.clear()
+        revitstub.switch_flags.update(args.switch)
+        if args.tracemalloc:
+            tracemalloc.start()
+        error = None
+        t0 = time.time()
+        try:
+            runpy.run_path(script, init_globals={
+                "__revit__": uiapp,
+                "__shiftclick__": args.dry_run,
+                "__forceddebugmode__": ctrl,
+            }, run_name="__main__")
+        except SystemExit:
+            error = "SystemExit"
+        elapsed = time.time() - t0
+        py_peak = None
+        if args.tracemalloc:
+            py_peak = round(tracemalloc.get_traced_memory()[1] / 1048576.0, 1)
+            tracemalloc.stop()
+        results.append(OrderedDict([
+            ("button", name),
+            ("run", run),
+            ("elements", n),
+            ("seconds", round(elapsed, 3)),
+            ("elements_per_s", round(n / elapsed, 1) if elapsed > 0 else None),
+            ("model_build_s", round(build_s, 2)),
+            ("rss_model_mb", rss_model),
+            ("rss_peak_mb", _rss_mb()),
+            ("py_peak_mb", py_peak),
+            ("exit", error),
+            ("outcome", _outcome()),
+        ]))
+    return results
+
+
+def _child(name, args):
+    """Esegue name in un processo separato e ne legge i risultati (JSON su stdout)."""
+    cmd = [sys.executable, os.path.abspath(__file__), name, "--child",
+           "--pipes", str(args.pipes), "--accessories", str(args.accessories),
+           "--generics", str(args.generics), "--filler", str(args.filler),
+           "--scale", str(args.scale), "--repeat", str(args.repeat), "--select", str(args.select)]
+    for switch in args.switch:
+        cmd.extend(["--switch", switch])
+    for flag in ("timing", "tracemalloc", "dry_run"):
+        if getattr(args, flag):
+            cmd.append("--" + flag.replace("_", "-"))
+    out = subprocess.check_output(cmd).decode("utf-8")
+    lines = out.splitlines()
+    for line in lines[:-1]:
+        print(line)  # output degli script (es. tempi con --timing)
+    return json.loads(lines[-1])
+
+
+def format_table(results):
+    lines = ["{0:<12} {1:>3} {2:>9} {3:>9} {4:>11} {5:>9} {6:>9}  {7}".format(
+        "pulsante", "run", "elementi", "secondi", "el/s", "RSS MB", "py MB", "esito")]
+    for r in results:
+        lines.append("{0:<12} {1:>3} {2:>9} {3:>9.3f} {4:>11} {5:>9} {6:>9}  {7}".format(
+            r["button"], r["run"], r["elements"], r["seconds"], r["elements_per_s"],
+            r["rss_peak_mb"], r["py_peak_mb"] if r["py_peak_mb"] is not None else "-",
+            (r["exit"] + " " if r["exit"] else "") + r["outcome"][:60]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark dei pulsanti di mappatura (Revit sintetico)")
+    ap.add_argument("buttons", nargs="*", metavar="pulsante",
+                    help="pulsanti da eseguire: {0} (default: tutti)".format(", ".join(BUTTONS)))
+    ap.add_argument("--pipes", type=int, default=100000)
+    ap.add_argument("--accessories", type=int, default=50000)
+    ap.add_argument("--generics", type=int, default=5000)
+    ap.add_argument("--filler", type=int, default=20, help="parametri di contorno per elemento")
+    ap.add_argument("--scale", type=float, default=1.0, help="fattore sulle dimensioni del modello")
+    ap.add_argument("--repeat", type=int, default=1, help="esecuzioni sullo stesso modello")
+    ap.add_argument("--dry-run", action="store_true", help="come SHIFT+click")
+    ap.add_argument("--select", type=int, default=0,
+                    help="esegue sui primi N elementi selezionati (ambito selezione)")
+    ap.add_argument("--switch", action="append", default=[],
+                    help="interruttore attivo nell'elenco del CTRL+click (ripetibile)")
+    ap.add_argument("--timing", action="store_true", help="attiva snam.timing negli script")
+    ap.add_argument("--tracemalloc", action="store_true", help="picco memoria Python dello script")
+    ap.add_argument("--inline", action="store_true", help="tutti i pulsanti nello stesso processo")
+    ap.add_argument("--json", help="scrive i risultati anche in questo file")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    names = args.buttons or list(BUTTONS)
+    for name in names:
+        if name not in BUTTONS:
+            ap.error("pulsante sconosciuto: {0}".format(name))
+
+    _patch_exists()
+    if args.child:
+        results = []
+        for name in names:
+            results.extend(run_button(name, args))
+        sys.stdout.flush()
+        print(json.dumps(results))
+        return 0
+
+    results = []
+    for name in names:
+        if args.inline:
+            results.extend(run_button(name, args))
+        else:
+            results.extend(_child(name, args))
+    print(format_table(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+"""
+Modelli e workbook sintetici per i benchmark dei pulsanti di mappatura.
+
+Il modello e' un revitstub.db.Document con:
+- tubazioni (OST_PipeCurves) su tipi BARRE_/Tubaz/altro, DN e offset variabili;
+- accessori AP (OST_PipeAccessory / OST_PipeFitting) su famiglie AP con tipi
+  "DN0100-PN75", codice SAP, tf_<parametro> per le regole e qualche tf_ non
+  mappato o SAP mancante (come nei modelli reali);
+- modelli generici placeholder (FU/SE/IM) per la mappatura IFC;
+- Project Information, livelli e Project Base Point.
+
+I workbook (Regole mappatura, CI_<codice>, Allegato 2, Allegato 3, IfcName,
+PLACEHOLDER) usano gli stessi nomi di parametro e gli stessi codici del
+modello, cosi' ogni regola trova i suoi dati. Tutto e' deterministico (seed).
+"""
+import random
+
+from revitstub import db, xlrd_mem
+from revitstub.db import (BuiltInCategory as BIC, BuiltInParameter as BIP,
+                          StorageType as ST)
+
+TITLE = "SNAM-DAM-BIM-13037_01-GASD-RC01-00"
+MODEL_CODE = "13037"
+BUILDING_CODE = "13037_01"
+
+FT = 304.8  # mm per piede (unita' interna Revit)
+
+# nomi file dei workbook (gli script li cercano per nome, la cartella non conta)
+REGOLE_XLSX = "Regole mappatura per Revit_2Dto6D.xlsx"
+CI_XLSX = "CI_{0}.xlsx".format(MODEL_CODE)
+ALLEGATO2_XLSX = "Allegato 2 - Lista Asset Affidamento.xlsx"
+ALLEGATO3_XLSX = "Allegato 3 - Classi e mappatura IFC.xlsx"
+IFCNAME_XLSX = "Allegato 1 - IfcName.xlsx"
+PLACEHOLDER_XLSX = "PLACEHOLDER.xlsx"
+
+# ---------------------------------------------------------------- regole
+
+PIPE_RULES = [
+    ("NP101_codice_impianto", "C", "GASD-13037"),
+    ("CA101_spessore", "X", 'colonna C foglio "BARRE_GASD"'),
+    ("CA102_diametro_esterno", "Z", "RBS_PIPE_OUTER_DIAMETER"),
+    ("NP102_rete", "G", '"GASD" (Rete gas) (Altro)'),
+    ("CA103_posa", "K", "Interrata;Fuori terra"),
+    ("CA104_classe_ifc", "J", "colonna E"),
+    ("NP103_stato", "P", "colonna H"),
+    ("CA105_materiale", "M", '"LC101_materiale" (ACC, Acciaio) (PE, Polietilene)'),
+    ("CA106_sigla_materiale", "L",
+     '"CA105_materiale" - acciaio[ACC] - polietilene[PE] - default[N/C]'),
+    ("NP104_note", "N/C", ""),
+]
+PIPE_SOURCES = ("LC101_materiale",)
+
+AP_RULES = [
+    ("CA201_diametro_nominale", "W", 'colonna G foglio "Consistenza Impiantistica"'),
+    ("CA202_pressione_nominale", "W", 'colonna H foglio "Consistenza Impiantistica"'),
+    ("CA002_pressione_progetto", "W", 'colonna EE foglio "Report"'),
+    ("CA008_temperatura_progetto", "W", 'colonna EE foglio "Report"'),
+    ("NP201_gestore", "C", "SNAM Rete Gas"),
+    ("NP202_valvola", "D", '"AP330" "AP450" (Valvola)'),
+    ("NP203_organo", "B", '"AP330" (Sfera)'),
+    ("NP204_giunto", "E", '"AP120_giunto_dielettrico_t00"'),
+    ("NP205_manovra", "F", '"AP330" "AP450" (Manuale) (N/A)'),
+    ("NP206_rete", "G", '"GASD" (Rete gas) (Altro)'),
+    ("CA203_classe_ifc", "J", "colonna E"),
+    ("CA204_posa", "K", "Interrata;Fuori terra"),
+    ("CA205_quota_relativa", "T", ""),
+    ("NP207_stato", "P", "colonna H"),
+    ("CA206_comando", "N", '"AP330" "AP450" [DN0100](Leva) [DN0150|DN0200](Riduttore)'),
+    ("CA207_costruttore", "R", ""),
+    ("CA208_dn_mm", "Y", "Diametro"),
+]
+AP_BAD_TF = ("tf_XX900_non_mappato",)
+
+COMMON_RULES = [
+    ("NP301_sito", "colonna E"),
+    ("NP302_codice_edificio", "colonna F"),
+    ("NP303_descrizione_edificio", "colonna G"),
+    ("NP304_impianto", "colonna J"),
+    ("NP305_committente", "SNAM S.p.A."),
+    ("NP306_progetto", "DAM"),
+    ("NP399_non_nel_modello", "colonna K"),
+    ("LC301_non_np", "colonna E"),
+]
+COMMON_IN_MODEL = [n for n, _ in COMMON_RULES if n.startswith("NP") and n != "NP399_non_nel_modello"]
+
+IFC_PARAMS = ("IfcName", "IfcObjectType")
+
+AP_FAMILY_BASES = (
+    "AP330_valvola_a_sfera_con_comando_manuale_a_leva",
+    "AP330_valvola_a_sfera_con_comando_manuale_con_riduttore",
+    "AP450_valvola_a_saracinesca_con_comando_manuale_con_chiave_a_T",
+    "AP120_giunto_dielettrico",
+    "AP210_filtro_a_Y",
+    "AP510_riduzione_concentrica",
+    "AP610_flangia_cieca",
+    "NO025_curva_3D",
+)
+AP_DN = (50, 80, 100, 150, 200, 250, 300)
+PIPE_DN = (25, 32, 40, 50, 65, 80, 100, 125, 150, 200, 250, 300, 400, 500, 600)
+PIPE_TYPES = ("BARRE_ACC_{0}", "Tubazione_PE_{0}", "Tubaz_ACC_{0}", "Condotta_{0}")
+GENERIC_TYPES = ("FU001_quadro_elettrico", "FU002_armadio", "SE003_sensore",
+                 "IM004_cabina", "IM005_riduttore", "XX006_generico")
+
+# -------------------------------------------------------------- parametri
+
+
+class ParamDefs(object):
+    """
+    Definizioni del documento, una per nome: parametri condivisi (GUID,
+    SharedParameterElement e binding di istanza) e BuiltInParameter.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.defs = {}
+        self.bindings = {}
+
+    def shared(self, name, categories=()):
+        d = self.defs.get(name)
+        if d is None:
+            d = self.defs[name] = db.Definition(name, guid=db.Guid())
+            db.SharedParameterElement(self.doc, d)
+            self.bindings[name] = db.InstanceBinding()
+            self.doc.ParameterBindings.Insert(d, self.bindings[name])
+        # stesso parametro su piu' famiglie: il binding copre tutte le categorie
+        bound = self.bindings[name].Categories
+        for c in categories:
+            if c not in bound:
+                bound.append(c)
+        return d
+
+    def builtin(self, bip_name, label=None):
+        d = self.defs.get(bip_name)
+        if d is None:
+            d = self.defs[bip_name] = db.Definition(label or bip_name, getattr(BIP, bip_name))
+        return d
+
+
+class Kind(object):
+    """
+    Parametri di una famiglia di elementi: lista di (definizione, StorageType)
+    e layout condiviso per get_Parameter. values(el_values) -> lista Parameter.
+    """
+
+    def __init__(self, specs):
+        self.specs = specs
+        self.layout = db.make_layout([d for d, _ in specs])
+        self.pos = dict((d.Name, i) for i, (d, _) in enumerate(specs))
+
+    def params(self, values):
+        return [db.Parameter(d, st, values.get(d.Name)) for d, st in self.specs]
+
+
+def _shared_specs(defs, names, storage=ST.String, cats=()):
+    return [(defs.shared(n, cats), storage) for n in names]
+
+
+def _filler_specs(defs, n, cats):
+    # parametri "di contorno" che ogni famiglia reale si porta dietro:
+    # rendono realistico il costo di LookupParameter / el.Parameters
+    return _shared_specs(defs, ["Commento_{0:02d}".format(i) for i in range(n)], ST.String, cats)
+
+
+def _type_element(doc, defs, cls, category, family, type_name, extra=()):
+    sym = cls(doc, type_name, category)
+    sym.add_param(db.Parameter(defs.builtin("SYMBOL_FAMILY_NAME_PARAM", "Family Name"), ST.String, family,
+                               read_only=True))
+    sym.add_param(db.Parameter(defs.builtin("SYMBOL_NAME_PARAM", "Type Name"), ST.String, type_name,
+                               read_only=True))
+    # parametri IFC di tipo (IfcClassNameObject con WRITE_ON_TYPE)
+    sym.add_param(db.Parameter(defs.builtin("IFC_EXPORT_ELEMENT_TYPE_AS", "Type IFC Export As"), ST.String, None))
+    sym.add_param(db.Parameter(defs.builtin("IFC_EXPORT_PREDEFINEDTYPE_TYPE", "Type IFC Predefined Type"),
+                               ST.String, None))
+    for d, st, v in extra:
+        sym.add_param(db.Parameter(d, st, v))
+    return sym
+
+
+# ---------------------------------------------------------------- modello
+
+
+def build_model(pipes=0, accessories=0, generics=0, filled=False, filler=20, seed=1):
+    """
+    Documento sintetico. filled=True valorizza i parametri CA/NP/LC/VAR
+    (modello gia' mappato: utile per Clean e per i rilanci).
+    """
+    rnd = random.Random(seed)
+    doc = db.Document(TITLE, "C:\\Progetti\\{0}.rvt".format(TITLE))
+    defs = ParamDefs(doc)
+    cat = dict((bic, db.Category(getattr(BIC, bic), bic[4:]))
+               for bic in ("OST_PipeCurves", "OST_PipeAccessory", "OST_PipeFitting",
+                           "OST_GenericModel", "OST_ProjectInformation", "OST_ProjectBasePoint"))
+
+    # livelli e Project Base Point (regola T degli accessori)
+    levels = []
+    for i, elev_mm in enumerate((-3000.0, 0.0, 3500.0, 7000.0)):
+        lv = db.Level(doc, "Livello {0}".format(i), elev_mm / FT)
+        lv.add_param(db.Parameter(defs.builtin("LEVEL_ELEV", "Elevation"), ST.Double, elev_mm / FT))
+        levels.append(lv)
+    pbp = db.BasePoint(doc, "Project Base Point", cat["OST_ProjectBasePoint"])
+    pbp.add_param(db.Parameter(defs.builtin("BASEPOINT_ELEVATION_PARAM", "Elev"), ST.Double, 0.0))
+
+    _project_info(doc, defs, cat["OST_ProjectInformation"])
+
+    if pipes:
+        _pipes(doc, defs, cat, rnd, pipes, filled, filler, levels)
+    if accessories:
+        _accessories(doc, defs, cat, rnd, accessories, filled, filler, levels)
+    if generics:
+        _generics(doc, defs, cat, rnd, generics, filled, filler)
+    return doc
+
+
+def _project_info(doc, defs, category):
+    pi = db.ProjectInfo(doc, "Project Information", category)
+    for bip in ("PROJECT_BUILDING_NAME", "PROJECT_STATUS", "PROJECT_NAME", "PROJECT_NUMBER"):
+        pi.add_param(db.Parameter(defs.builtin(bip), ST.String, None))
+    for name in ("BuildingDescription", "IfcDescription", "SiteDescription", "SiteLandTitleNumber",
+                 "SiteLongName", "SiteName", "BuildingLongName"):
+        pi.add_param(db.Parameter(defs.shared(name, [category]), ST.String, None))
+    return pi
+
+
+def _ifc_specs(defs, cats):
+    return (_shared_specs(defs, IFC_PARAMS, ST.String, cats) +
+            [(defs.builtin("IFC_EXPORT_ELEMENT_AS", "Export to IFC As"), ST.String),
+             (defs.builtin("IFC_EXPORT_PREDEFINEDTYPE", "IFC Predefined Type"), ST.String)])
+
+
+def _filled_value(name, rnd):
+    return "{0}_v{1}".format(name[:5], rnd.randint(1, 9))
+
+
+def _pipes(doc, defs, cat, rnd, n, filled, filler, levels):
+    cats = [cat["OST_PipeCurves"]]
+    targets = [name for name, code, _ in PIPE_RULES]
+    kind = Kind(
+        [(defs.builtin("RBS_PIPE_DIAMETER_PARAM", "Diameter"), ST.Double),
+         (defs.builtin("RBS_PIPE_OUTER_DIAMETER", "Outside Diameter"), ST.Double),
+         (defs.builtin("RBS_OFFSET_PARAM", "Middle Elevation"), ST.Double)] +
+        _shared_specs(defs, targets + list(PIPE_SOURCES) + COMMON_IN_MODEL, ST.String, cats) +
+        _ifc_specs(defs, cats) +
+        _filler_specs(defs, filler, cats))
+    types = []
+    for pattern in PIPE_TYPES:
+        for dn in PIPE_DN:
+            name = pattern.format("DN{0}".format(dn))
+            types.append((_type_element(doc, defs, db.ElementType, cat["OST_PipeCurves"],
+                                        "Pipe Types", name), dn))
+    fill_names = targets + COMMON_IN_MODEL if filled else ()
+    for i in range(n):
+        typ, dn = types[rnd.randrange(len(types))]
+        values = {
+            "Diameter": dn / FT,
+            "Outside Diameter": (dn * 1.1 + 3.3) / FT,
+            "Middle Elevation": rnd.uniform(-1500.0, 3000.0) / FT,
+            "LC101_materiale": "ACC" if typ.Name.find("PE") < 0 else "PE",
+        }
+        for name in fill_names:
+            values[name] = _filled_value(name, rnd)
+        el = db.Element(doc, "Pipe", cat["OST_PipeCurves"], typ.Id)
+        el.set_params(kind.layout, kind.params(values))
+        el.LevelId = levels[1].Id
+
+
+def _ap_family_names(n_types):
+    names = []
+    k = 0
+    while len(names) < n_types:
+        for base in AP_FAMILY_BASES:
+            names.append("{0}_t{1:02d}".format(base, k))
+        k += 1
+    return names[:n_types]
+
+
+def sap_code(i):
+    return 10000000 + i
+
+
+def _accessories(doc, defs, cat, rnd, n, filled, filler, levels, n_families=40):
+    cats = [cat["OST_PipeAccessory"], cat["OST_PipeFitting"]]
+    targets = [name for name, _, _ in AP_RULES]
+    tf_names = ["tf_" + t for t in targets] + list(AP_BAD_TF)
+    kind = Kind(
+        [(defs.builtin("FAMILY_LEVEL_PARAM", "Level"), ST.ElementId),
+         (defs.builtin("INSTANCE_FREE_HOST_OFFSET_PARAM", "Offset from Host"), ST.Double),
+         (defs.builtin("INSTANCE_ELEVATION_PARAM", "Elevation from Level"), ST.Double),
+         (defs.shared("Diametro", cats), ST.Double)] +
+        _shared_specs(defs, ["NP259_codice_sap"] + targets + tf_names + COMMON_IN_MODEL, ST.String, cats) +
+        _ifc_specs(defs, cats) +
+        _filler_specs(defs, filler, cats))
+    types = []
+    for fam in _ap_family_names(n_families):
+        for dn in AP_DN:
+            category = cat["OST_PipeFitting"] if fam.startswith(("AP510", "NO025")) else cat["OST_PipeAccessory"]
+            sym = _type_element(doc, defs, db.FamilySymbol, category, fam, "DN{0:04d}-PN75".format(dn))
+            types.append((sym, category, dn))
+    fill_names = targets + COMMON_IN_MODEL if filled else ()
+    for i in range(n):
+        sym, category, dn = types[rnd.randrange(len(types))]
+        lv = levels[rnd.randrange(len(levels))]
+        values = {
+            "Level": lv.Id,
+            "Offset from Host": rnd.uniform(-2000.0, 2000.0) / FT,
+            "Elevation from Level": rnd.uniform(-2000.0, 2000.0) / FT,
+            "Diametro": dn / FT,
+            # ~2% senza codice SAP (warning a fine run)
+            "NP259_codice_sap": str(sap_code(i)) if rnd.random() > 0.02 else None,
+            "tf_CA207_costruttore": rnd.choice(("Pietro Fiorentini", "Valvitalia", "Petrolvalves")),
+            "tf_XX900_non_mappato": "x",
+        }
+        for t in targets:
+            values.setdefault("tf_" + t, "1")
+        for name in fill_names:
+            values[name] = _filled_value(name, rnd)
+        el = db.FamilyInstance(doc, sym.Name, category, sym.Id)
+        el.set_params(kind.layout, kind.params(values))
+        el.LevelId = lv.Id
+
+
+def _generics(doc, defs, cat, rnd, n, filled, filler):
+    category = cat["OST_GenericModel"]
+    cats = [category]
+    kind = Kind(_shared_specs(defs, COMMON_IN_MODEL, ST.String, cats) +
+                _ifc_specs(defs, cats) + _filler_specs(defs, filler, cats))
+    types = [_type_element(doc, defs, db.FamilySymbol, category, "Placeholder", t) for t in GENERIC_TYPES]
+    for i in range(n):
+        sym = types[rnd.randrange(len(types))]
+        values = dict((name, _filled_value(name, rnd)) for name in COMMON_IN_MODEL) if filled else {}
+        el = db.FamilyInstance(doc, sym.Name, category, sym.Id)
+        el.set_params(kind.layout, kind.params(values))
+
+# -------------------------------------------------------------- workbook
+
+
+def _sheet(name, rows_by_col, nrows=None):
+    return xlrd_mem.Sheet(name, rows_by_col, nrows)
+
+
+def _columns(header, rows):
+    """{indice: colonna} da header {indice: titolo} e righe {indice: valore}."""
+    cols = dict((c, [h]) for c, h in header.items())
+    for r, row in enumerate(rows, 1):
+        for c, v in row.items():
+            col = cols.setdefault(c, [""] * r)
+            col.extend([""] * (r - len(col)))
+            col.append(v)
+    n = len(rows) + 1
+    for col in cols.values():
+        col.extend([""] * (n - len(col)))
+    return cols
+
+
+def regole_workbook():
+    B, C, D = 1, 2, 3
+    hdr = {B: "Nome parametro", C: "Codice regola", D: "Descrizione regola"}
+    barre = _columns(hdr, [{B: n, C: c, D: d} for n, c, d in PIPE_RULES])
+    gasd = _columns({B: "DN", C: "Spessore"},
+                    [{B: "DN {0}".format(dn), C: round(2.0 + dn / 50.0, 2)} for dn in PIPE_DN])
+    ap = _columns(hdr, [{B: n, C: c, D: d} for n, c, d in AP_RULES])
+    common = _columns({B: "Nome parametro", C: "Regola"}, [{B: n, C: r} for n, r in COMMON_RULES])
+    return xlrd_mem.Book([
+        _sheet("BARRE (CATEGORIA TUBAZIONI)", barre),
+        _sheet("BARRE_GASD", gasd),
+        _sheet("AP (Accessori per tubazioni)", ap),
+        _sheet("PARAMETRI COMUNI", common),
+    ])
+
+
+def ci_workbook(n_sap, seed=2):
+    """CI_<codice>: Report (2 righe CA002/CA008 per SAP) e Consistenza Impiantistica."""
+    rnd = random.Random(seed)
+    SAP, DZ, EA, EE, EG = 1, 129, 130, 134, 136
+    report = {SAP: ["Codice SAP"], DZ: ["Parametro"], EA: ["Parametro (alt)"],
+              EE: ["Valore"], EG: ["Valore (alt)"]}
+    G, H, N = 6, 7, 13
+    consist = {G: ["DN"], H: ["PN"], N: ["Codice SAP"]}
+    for i in range(n_sap):
+        sap = float(sap_code(i))  # xlrd legge i numeri come float
+        for code, label, value in (("CA002", "CA002 Pressione di progetto", rnd.choice((12.0, 24.0, 75.0))),
+                                   ("CA008", "CA008 Temperatura di progetto", rnd.choice((-10.0, 50.0)))):
+            report[SAP].append(sap)
+            report[DZ].append(label)
+            report[EA].append("")
+            report[EE].append(value)
+            report[EG].append("")
+        consist[G].append(float(rnd.choice(AP_DN)))
+        consist[H].append(75.0)
+        consist[N].append(sap)
+    return xlrd_mem.Book([_sheet("Report", report), _sheet("Consistenza Impiantistica", consist)])
+
+
+def allegato2_workbook(n_assets=5000):
+    E, F, G, J, K = 4, 5, 6, 9, 10
+    rows = []
+    for i in range(n_assets):
+        # codici misti: numerici (letti come float) e testo "xxxxx_yy"
+        code = float(20000 + i) if i % 2 else "{0}_{1:02d}".format(20000 + i, i % 7)
+        rows.append({E: "Sito {0}".format(i), F: code, G: "Impianto {0}".format(i),
+                     J: "RC{0:02d}".format(i % 5), K: "Cabina"})
+    rows.append({E: "Centrale di Minerbio", F: BUILDING_CODE, G: "Impianto di riduzione",
+                 J: "GASD", K: "Distribuzione"})
+    rows.append({E: "Centrale di Minerbio", F: BUILDING_CODE, G: "Cabina di regolazione",
+                 J: "RC01", K: "Regolazione"})
+    hdr = {E: "Denominazione", F: "Codice edificio", G: "Descrizione", J: "Impianto tipo", K: "Tipologia"}
+    return xlrd_mem.Book([_sheet("Lista Asset Affidamento", _columns(hdr, rows))])
+
+
+def _family_codes():
+    codes = sorted(set(b[:5] for b in AP_FAMILY_BASES) | set(t[:5] for t in GENERIC_TYPES))
+    return codes + ["BARRE"]
+
+
+def allegato3_workbook(n_filler=500):
+    """Elenco NO/AP/IM/SE/FU: A = codice (prefisso 5), E = IfcObjectType, F = Export As."""
+    A, E, F = 0, 4, 5
+    hdr = {A: "Codice", E: "IfcObjectType", F: "IfcExportAs"}
+    sheets = []
+    for sheet, prefix in (("Elenco IM", "IM"), ("Elenco SE", "SE"), ("Elenco FU", "FU"),
+                          ("Elenco AP", "AP"), ("Elenco NO", "NO")):
+        rows = [{A: c, E: "Ifc_{0}".format(c), F: "IfcBuildingElementProxy"}
+                for c in _family_codes() if c.startswith(prefix) or (prefix == "NO" and c == "BARRE")]
+        rows += [{A: "{0}{1:03d}".format(prefix, 900 - i), E: "IfcFlowController", F: ""}
+                 for i in range(n_filler // 5)]
+        sheets.append(_sheet(sheet, _columns(hdr, rows)))
+    return xlrd_mem.Book(sheets)
+
+
+def ifcname_workbook(n_filler=2000):
+    """IfcName (A = nome, B = codice) + IM (A = codice, B = nome)."""
+    A, B = 0, 1
+    rows = [{A: "Tubazione", B: "BARRE"}, {A: "Curva", B: "NO025"}]
+    rows += [{A: "Nome_{0}".format(c), B: c} for c in _family_codes()]
+    # nomi che compaiono dentro i nomi famiglia AP330/AP450 (match per sottostringa)
+    rows += [{A: "valvola_a_sfera", B: "AP330"},
+             {A: "valvola_a_sfera_con_comando_manuale_con_riduttore", B: "AP330"},
+             {A: "valvola_a_saracinesca", B: "AP450"}]
+    rows += [{A: "IfcNameFiller{0:05d}".format(i), B: "ZZ{0:03d}".format(i % 1000)} for i in range(n_filler)]
+    im = [{A: t[:5], B: "Nome_IM_{0}".format(t[:5])} for t in GENERIC_TYPES if t.startswith("IM")]
+    return xlrd_mem.Book([
+        _sheet("IfcName", _columns({A: "IfcName", B: "Codice"}, rows)),
+        _sheet("IM", _columns({A: "Codice", B: "IfcName"}, im)),
+    ])
+
+
+def placeholder_workbook():
+    A = 0
+    fu = [{A: t} for t in GENERIC_TYPES if t.startswith("FU")]
+    se = [{A: t} for t in GENERIC_TYPES if t.startswith("SE")]
+    return xlrd_mem.Book([_sheet("FU", _columns({A: "Placeholder"}, fu)),
+                          _sheet("SE", _columns({A: "Placeholder"}, se))])
+
+
+def register_workbooks(n_sap):
+    """Registra in revitstub.xlrd_mem tutti i workbook usati dai pulsanti."""
+    xlrd_mem.clear()
+    xlrd_mem.register(REGOLE_XLSX, regole_workbook())
+    xlrd_mem.register(CI_XLSX, ci_workbook(n_sap))
+    xlrd_mem.register(ALLEGATO2_XLSX, allegato2_workbook())
+    xlrd_mem.register(ALLEGATO3_XLSX, allegato3_workbook())
+    xlrd_mem.register(IFCNAME_XLSX, ifcname_workbook())
+    xlrd_mem.register(PLACEHOLDER_XLSX, placeholder_workbook())
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Verifica di snam.table.load_cols sul lettore .xlsx in streaming (snam.xlsx).
+
+Scrive con zipfile un piccolo .xlsx reale (stringhe condivise e inline, rich
+text, booleani, errori, formule, celle senza riferimento, celle unite, due
+fogli) e confronta le colonne di load_cols con quelle attese, cioe' i valori
+che darebbe xlrd: proiezione delle colonne, max_rows, normalized e foglio
+mancante. Gira su CPython senza xlrd (l'eccezione e' quella di bench/revitstub).
+
+Uso (dalla radice del repository):
+
+    python bench/xlsx_check.py
+
+Esce con codice 1 e l'elenco delle differenze se qualcosa non torna.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+for p in (HERE, os.path.join(ROOT, "lib")):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+import revitstub  # noqa: E402
+
+revitstub.install()
+
+import xlrd  # noqa: E402
+from snam import xlsx  # noqa: E402
+from snam.table import load_cols  # noqa: E402
+
+MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '</Types>')
+
+WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="{0}" xmlns:r="{1}"><sheets>'
+    '<sheet name="Altro" sheetId="1" r:id="rId2"/>'
+    '<sheet name="Dati" sheetId="2" r:id="rId1"/>'
+    '</sheets></workbook>').format(MAIN, REL)
+
+WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="{0}">'
+    '<Relationship Id="rId1" Type="{1}/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="{1}/worksheet" Target="worksheets/sheet2.xml"/>'
+    '<Relationship Id="rId3" Type="{1}/sharedStrings" Target="sharedStrings.xml"/>'
+    '</Relationships>').format(PKG, REL)
+
+# 0 Codice, 1 Nome, 2 AP330 (spazi esterni tolti), 3 NO025,
+# 4 "Curva 90" in due run, 5 " spazio " conservato, 6 solo nel foglio Altro
+SHARED_STRINGS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<sst xmlns="{0}" count="7" uniqueCount="7">'
+    '<si><t>Codice</t></si>'
+    '<si><t>Nome</t></si>'
+    '<si><t>  AP330 </t></si>'
+    '<si><t>NO025</t></si>'
+    '<si><r><t>Curva</t></r><r><rPr><b/></rPr><t xml:space="preserve"> 90</t></r></si>'
+    '<si><t xml:space="preserve"> spazio </t></si>'
+    '<si><t>solo altro</t></si>'
+    '</sst>').format(MAIN)
+
+# foglio Dati: intestazione, tre righe di dati, una riga senza riferimenti di
+# cella e celle unite F2:G6 che allargano il foglio a 6 righe e 7 colonne
+SHEET_DATI = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="{0}"><sheetData>'
+    '<row r="1">'
+    '<c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c>'
+    '<c r="C1" t="inlineStr"><is><t>Attivo</t></is></c><c r="D1" t="inlineStr"><is><t>Valore</t></is></c>'
+    '</row>'
+    '<row r="2">'
+    '<c r="A2" t="s"><v>2</v></c>'
+    '<c r="B2" t="inlineStr"><is><r><t>valvola_</t></r><r><t>a_sfera</t></r></is></c>'
+    '<c r="C2" t="b"><v>1</v></c><c r="D2"><v>12.5</v></c>'
+    '</row>'
+    '<row r="3">'
+    '<c r="A3" t="s"><v>3</v></c><c r="B3" t="s"><v>4</v></c>'
+    '<c r="C3" t="b"><v>0</v></c><c r="D3"><v>7</v></c><c r="E3" t="e"><v>#N/A</v></c>'
+    '</row>'
+    '<row r="4">'
+    '<c r="B4" t="str"><f>A2&amp;"x"</f><v>calc</v></c><c r="C4"/>'
+    '<c r="D4"><v>1E3</v></c><c r="E4" t="s"><v>5</v></c>'
+    '</row>'
+    '<row r="5"><c t="s"><v>0</v></c><c><v>3</v></c></row>'
+    '</sheetData>'
+    '<mergeCells count="1"><mergeCell ref="F2:G6"/></mergeCells>'
+    '</worksheet>').format(MAIN)
+
+SHEET_ALTRO = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="{0}"><sheetData>'
+    '<row r="1"><c r="A1" t="s"><v>6</v></c><c r="B1"><v>3.25</v></c></row>'
+    '</sheetData></worksheet>').format(MAIN)
+
+PARTS = [
+    ("[Content_Types].xml", CONTENT_TYPES),
+    ("xl/workbook.xml", WORKBOOK),
+    ("xl/_rels/workbook.xml.rels", WORKBOOK_RELS),
+    ("xl/sharedStrings.xml", SHARED_STRINGS),
+    ("xl/worksheets/sheet1.xml", SHEET_DATI),
+    ("xl/worksheets/sheet2.xml", SHEET_ALTRO),
+]
+
+# colonne attese del foglio Dati (valori come xlrd: float, booleani 0/1,
+# errori come codice, "" per le celle vuote)
+DATI = [
+    ["Codice", "AP330", "NO025", "", "Codice", ""],
+    ["Nome", "valvola_a_sfera", "Curva 90", "calc", 3.0, ""],
+    ["Attivo", 1, 0, "", "", ""],
+    ["Valore", 12.5, 7.0, 1000.0, "", ""],
+    ["", "", 0x2A, " spazio ", "", ""],
+    ["", "", "", "", "", ""],
+    ["", "", "", "", "", ""],
+]
+
+# (descrizione, argomenti di load_cols, colonne attese)
+CASES = [
+    ("tutte le colonne", ("Dati",), {}, DATI),
+    ("proiezione", ("Dati", (0, 2, 4)), {},
+     [DATI[0], None, DATI[2], None, DATI[4], None, None]),
+    ("colonna oltre il foglio", ("Dati", (1, 30)), {},
+     [None, DATI[1], None, None, None, None, None]),
+    # con max_rows ncols conta solo le righe lette (le celle unite non si leggono)
+    ("max_rows", ("Dati", (0, 3)), {"max_rows": 2},
+     [DATI[0][:2], None, None, DATI[3][:2]]),
+    ("normalized", ("Dati", (0, 3)), {"normalized": True},
+     [["Codice", "AP330", "NO025", "", "Codice", ""], None, None,
+      ["Valore", "12.5", "7", "1000", "", ""], None, None, None]),
+    ("altro foglio", ("Altro",), {}, [["solo altro"], [3.25]]),
+]
+
+
+def write_workbook(path):
+    zf = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+    try:
+        for name, text in PARTS:
+            zf.writestr(name, text.encode("utf-8"))
+    finally:
+        zf.close()
+
+
+def check(path):
+    """Differenze tra load_cols e le colonne attese (lista vuota se tutto torna)."""
+    errors = []
+    if not xlsx.is_xlsx(path):
+        errors.append("is_xlsx: il file non e' riconosciuto come .xlsx")
+    for label, args, kwargs, expected in CASES:
+        got = load_cols(path, *args, **kwargs)
+        if got != expected:
+            errors.append("{0}: atteso {1!r}, letto {2!r}".format(label, expected, got))
+    try:
+        load_cols(path, "Mancante")
+        errors.append("foglio mancante: nessuna eccezione")
+    except xlrd.XLRDError:
+        pass
+    return errors
+
+
+def main():
+    folder = tempfile.mkdtemp(prefix="snam_xlsx_")
+    try:
+        path = os.path.join(folder, "verifica.xlsx")
+        write_workbook(path)
+        errors = check(path)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    for e in errors:
+        print(e)
+    print("{0} casi, {1} differenze".format(len(CASES) + 1, len(errors)))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
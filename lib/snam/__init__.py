@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""
+Libreria condivisa dei pulsanti SNAM (caricata da pyRevit dalla cartella lib/
+dell'estensione).
+"""
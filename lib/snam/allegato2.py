@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Allegato 2 - Lista Asset Affidamento: indice per codice edificio condiviso
+da Project Information e Parametri Comuni.
+
+Il foglio si legge una volta e si indicizza per codice edificio normalizzato
+(colonna F) e per codice + impianto (colonna J); l'indice passa dalla cache
+su disco (snam.wbcache), quindi vale tra sessioni e si invalida da solo se
+il file cambia dimensione o mtime. La ricerca del modello e' un accesso a
+dizionario invece della lettura e scansione del foglio.
+
+L'ultimo file scelto si ricorda in LAST_PATH_FILE: i due pulsanti lo
+riusano senza chiederlo di nuovo finche' esiste. Per sceglierlo di nuovo
+c'e' l'interruttore snam.scope.REPICK_ALLEGATO2 nell'elenco del CTRL+click
+(Project Information, che non ha ambito: il CTRL+click stesso).
+"""
+import io
+import os
+import tempfile
+
+from snam import wbcache
+from snam.table import load_cols, norm
+
+SHEET = "Lista Asset Affidamento"
+TITLE = "Seleziona il file Allegato 2 - Lista Asset Affidamento"
+COL_CODE = 5        # F: codice edificio
+COL_IMPIANTO = 9    # J: impianto tipo
+
+LAST_PATH_FILE = os.path.join(os.environ.get("LOCALAPPDATA") or tempfile.gettempdir(),
+                              "SNAM_Toolbar", "allegato2_path.txt")
+
+
+def cell(row, c, default=""):
+    """Valore della colonna c della riga (default se fuori range)."""
+    return row[c] if 0 <= c < len(row) else default
+
+
+class Index(object):
+    """Righe di Allegato 2 (tuple dei valori di tutte le colonne) per codice edificio."""
+
+    def __init__(self, by_code, by_impianto):
+        self.by_code = by_code
+        self.by_impianto = by_impianto
+
+    def rows(self, code):
+        """Righe con codice edificio code (colonna F normalizzata), in ordine di foglio."""
+        return self.by_code.get(code, [])
+
+    def row(self, code, impianto):
+        """Prima riga con codice code e impianto (colonna J normalizzata) uguale, None se assente."""
+        return self.by_impianto.get((code, impianto))
+
+
+def _build(path):
+    cols = load_cols(path, SHEET)
+    codes = cols[COL_CODE] if len(cols) > COL_CODE else []
+    by_code = {}
+    by_impianto = {}
+    for r in range(1, len(codes)):
+        code = norm(codes[r])
+        if code == "":
+            continue
+        row = tuple(c[r] for c in cols)
+        by_code.setdefault(code, []).append(row)
+        by_impianto.setdefault((code, norm(cell(row, COL_IMPIANTO))), row)
+    return by_code, by_impianto
+
+
+def load_index(path):
+    """Index di Allegato 2 (dalla cache se il file non e' cambiato)."""
+    by_code, by_impianto = wbcache.cached(path, "allegato2/1:" + SHEET, lambda: _build(path))
+    return Index(by_code, by_impianto)
+
+
+def last_path():
+    """Ultimo Allegato 2 scelto, se esiste ancora (altrimenti None)."""
+    try:
+        with io.open(LAST_PATH_FILE, encoding="utf-8") as f:
+            path = f.read().strip()
+    except (IOError, OSError):
+        return None
+    return path if path and os.path.exists(path) else None
+
+
+def remember_path(path):
+    """Ricorda path come ultimo Allegato 2 scelto; errori ignorati."""
+    try:
+        folder = os.path.dirname(LAST_PATH_FILE)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with io.open(LAST_PATH_FILE, "w", encoding="utf-8") as f:
+            f.write(u"{0}".format(path))
+    except (IOError, OSError):
+        pass
+
+
+def choose_path(ask, force=False):
+    """
+    Percorso di Allegato 2: l'ultimo scelto se esiste ancora, altrimenti
+    ask() (dialogo del pulsante); force=True chiede comunque.
+    """
+    path = None if force else last_path()
+    if not path:
+        path = ask()
+        remember_path(path)
+    return path
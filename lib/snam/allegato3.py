@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Allegato 3 - Classi e mappatura IFC: tabella con indice per chiave di colonna A.
+Usato dalla regola J di Pipe mapping (chiave fissa "BARRE", match esatto e
+case-sensitive) e di AP_Accessories mapping (prefisso 5 caratteri del Family
+Name, senza distinzione maiuscole/minuscole).
+"""
+from snam.table import read_table, upper_key
+
+# chiave di colonna A normalizzata (spazi esterni rimossi, maiuscolo): AP
+normalize_key = upper_key
+
+
+def exact_key(val):
+    """Chiave di colonna A senza spazi esterni, maiuscole invariate: Pipe."""
+    return str(val).strip()
+
+
+def load_table(path, sheet, columns=None):
+    """
+    Legge il foglio una sola volta (colonna A + le colonne richieste in
+    columns, tutte se None) come snam.table.Table; passa dalla cache su disco.
+    """
+    return read_table(path, sheet, None if columns is None else [0] + list(columns))
+
+
+def find_row(table, key, col_key=normalize_key):
+    """
+    Riga di table la cui colonna A, passata per col_key, e' uguale a key
+    (None se assente); key va gia' preparata dal chiamante. A parita' di
+    chiave vince la prima riga, come nella vecchia scansione.
+    """
+    return table.find(0, key, col_key)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Impronte degli input per elemento: mappatura incrementale.
+
+Ogni pulsante calcola per elemento un'impronta compatta (digest) degli input
+che le sue regole leggono (id del tipo, codice SAP, valori dei parametri
+sorgente, righe dei workbook usate) e dei valori attuali dei parametri
+target. Per gli elementi scritti l'impronta salvata usa i valori dei target
+dopo la scrittura: se un target viene cambiato o svuotato a mano, o la
+mappatura viene annullata (Undo, modello chiuso senza salvare, file
+ripristinato), l'impronta non coincide piu' e l'elemento si rielabora. Le impronte dell'ultimo run completato
+stanno in un file accanto al modello nella cartella locale (una per modello
+e pulsante), insieme al digest del contesto (regole, firme dei workbook,
+titolo...). Al run successivo gli elementi con la stessa impronta vengono
+saltati; se il contesto e' cambiato si rielabora tutto.
+
+Il file si scrive solo dopo il Commit: un dry run o un run fallito non
+cambiano le impronte salvate. In "Run all mapping" la scrittura aspetta
+l'Assimilate del TransactionGroup (snam.pipeline.after_commit): se il
+gruppo si annulla le impronte degli stadi gia' conclusi si scartano. Un run parziale (selezione, vista, livelli:
+snam.scope) conserva le impronte degli elementi fuori ambito.
+"""
+import os
+import tempfile
+import hashlib
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from Autodesk.Revit.DB import StorageType
+
+from snam import pipeline
+
+FP_DIR = os.path.join(os.environ.get("LOCALAPPDATA") or tempfile.gettempdir(),
+                      "SNAM_Toolbar", "fingerprints")
+FP_EXT = ".bin"
+
+# metti a False per forzare sempre la rielaborazione di tutti gli elementi
+ENABLED = True
+
+
+def digest(*parts):
+    """Digest compatto (16 caratteri esadecimali) di valori semplici annidati."""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def file_signature(path):
+    """(percorso, dimensione, mtime) del file, None se non esiste: entra nel contesto."""
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return (os.path.normcase(os.path.abspath(path)), st.st_size, int(st.st_mtime))
+
+
+def param_token(prm):
+    """Valore memorizzato del parametro, confrontabile tra run (None se assente)."""
+    if prm is None:
+        return None
+    st = prm.StorageType
+    if st == StorageType.String:
+        return prm.AsString()
+    if st == StorageType.Integer:
+        return prm.AsInteger()
+    if st == StorageType.Double:
+        return round(prm.AsDouble(), 9)
+    if st == StorageType.ElementId:
+        return prm.AsElementId().IntegerValue
+    return None
+
+
+def store_path(doc, name):
+    """File delle impronte del pulsante name per il modello doc."""
+    key = u"{0}|{1}".format(os.path.normcase(doc.PathName or doc.Title or ""), name)
+    return os.path.join(FP_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + FP_EXT)
+
+
+class FingerprintStore(object):
+    """
+    Impronte {element id: digest} del run precedente (previous) e di quello
+    corrente (current); skipped conta gli elementi saltati perche' invariati.
+    partial=True: run su una parte del modello, le altre impronte restano.
+    """
+
+    def __init__(self, doc, name, context, partial=False):
+        self.path = store_path(doc, name)
+        self.context = digest(context)
+        self.previous = {}
+        self.current = {}
+        self.pending = {}  # el id -> (impronta input, {target: valore}) degli elementi da scrivere
+        self.skipped = 0
+        if ENABLED:
+            try:
+                with open(self.path, "rb") as fb:
+                    data = pickle.loads(zlib.decompress(fb.read()))
+                if data.get("context") == self.context:
+                    self.previous = data["fps"]
+            except Exception:
+                self.previous = {}
+        if partial:
+            self.current = dict(self.previous)
+
+    def unchanged(self, el_id, fp, targets=None):
+        """
+        Registra l'impronta di el_id: fp (input) piu' targets ({nome target:
+        param_token attuale}). True (e conta skipped) se uguale alla precedente;
+        altrimenti l'elemento resta in sospeso finche' save() non ricalcola
+        l'impronta con i target scritti (vedi written).
+        """
+        full = fp if targets is None else digest(fp, sorted(targets.items()))
+        self.current[el_id] = full
+        if ENABLED and self.previous.get(el_id) == full:
+            self.skipped += 1
+            return True
+        if targets is not None:
+            self.pending[el_id] = (fp, dict(targets))
+        return False
+
+    def written(self, el_id, name, prm):
+        """Scrittura riuscita del target name di el_id: l'impronta salvata usa il nuovo valore."""
+        entry = self.pending.get(el_id)
+        if entry is not None:
+            entry[1][name] = param_token(prm)
+
+    def forget(self, el_id):
+        """Non salvare l'impronta di el_id (es. scrittura fallita: va ritentato)."""
+        self.current.pop(el_id, None)
+        self.pending.pop(el_id, None)
+
+    def save(self):
+        """
+        Salva le impronte correnti (dopo il Commit); in "Run all mapping"
+        solo dopo l'Assimilate del gruppo. Errori ignorati.
+        """
+        if ENABLED:
+            pipeline.after_commit(self._write)
+
+    def _write(self):
+        for el_id, (fp, targets) in self.pending.items():
+            self.current[el_id] = digest(fp, sorted(targets.items()))
+        self.pending = {}
+        try:
+            if not os.path.isdir(FP_DIR):
+                os.makedirs(FP_DIR)
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as fb:
+                fb.write(zlib.compress(pickle.dumps({"context": self.context, "fps": self.current}, 2), 1))
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp, self.path)
+        except Exception:
+            pass
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Ricerca di molte sottostringhe in un testo con un automa Aho-Corasick.
+
+L'automa si costruisce una volta dai pattern (es. tutte le IfcName di
+Allegato 1) e una ricerca costa quanto la lunghezza del testo piu' le
+occorrenze trovate, non quanto il numero di pattern.
+"""
+from collections import deque
+
+
+class Automaton(object):
+    """Automa sui pattern (stringhe non vuote); l'indice di un pattern e' la sua posizione."""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for i, pat in enumerate(self.patterns):
+            if not pat:
+                continue
+            node = 0
+            for ch in pat:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(i)
+        # collegamenti di fallimento in ampiezza; le uscite ereditano quelle del suffisso
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                cand = self._goto[f].get(ch, 0)
+                self._fail[nxt] = cand if cand != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text):
+        """Indici dei pattern contenuti in text (senza ripetizioni, ordinati)."""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return sorted(found)
+
+    def longest(self, text):
+        """
+        Pattern piu' lungo contenuto in text (a parita' di lunghezza il primo
+        in ordine di pattern), None se nessuno: come max(matches, key=len).
+        """
+        best = None
+        for i in self.find_all(text):
+            if best is None or len(self.patterns[i]) > len(self.patterns[best]):
+                best = i
+        return self.patterns[best] if best is not None else None
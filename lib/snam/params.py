@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Risoluzione dei parametri per nome con cache per tipo.
+
+el.LookupParameter(nome) scorre ogni volta tutto il set di parametri
+dell'elemento. Elementi dello stesso tipo hanno gli stessi parametri, quindi
+il nome viene risolto una sola volta per tipo in un handle stabile (GUID se
+parametro condiviso, BuiltInParameter, altrimenti la Definition del
+ParameterElement) e le volte successive si usa l'accesso diretto
+el.get_Parameter(handle). Anche l'assenza del parametro viene memorizzata per
+tipo, cosi' i parametri mancanti non costano nulla.
+"""
+from Autodesk.Revit.DB import BuiltInParameter
+
+_UNRESOLVED = object()
+
+
+def type_key(el):
+    """Chiave di cache: id del tipo dell'elemento (per i tipi, l'elemento stesso)."""
+    tid = el.GetTypeId()
+    if tid is not None and tid.IntegerValue > 0:
+        return tid.IntegerValue
+    return -el.Id.IntegerValue
+
+
+def handle_of(prm):
+    """Handle stabile per get_Parameter: GUID, BuiltInParameter o Definition (None se prm e' None)."""
+    if prm is None:
+        return None
+    if prm.IsShared:
+        return prm.GUID
+    definition = prm.Definition
+    try:
+        bip = definition.BuiltInParameter
+        if bip != BuiltInParameter.INVALID:
+            return bip
+    except AttributeError:
+        pass
+    return definition
+
+
+class ParamResolver(object):
+    """Cache (tipo, nome) -> handle del parametro; hits/misses contano le risoluzioni riusate/nuove."""
+
+    def __init__(self):
+        self._handles = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, el, name):
+        """Come el.LookupParameter(name), ma risolto una volta per tipo."""
+        key = (type_key(el), name)
+        handle = self._handles.get(key, _UNRESOLVED)
+        if handle is _UNRESOLVED:
+            self.misses += 1
+            prm = el.LookupParameter(name)
+            self._handles[key] = handle_of(prm)
+            return prm
+        self.hits += 1
+        if handle is None:
+            return None
+        return el.get_Parameter(handle)
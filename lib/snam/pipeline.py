@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Sessione condivisa di "Run all mapping": piu' pulsanti eseguiti in sequenza
+nello stesso processo.
+
+Fuori da una sessione (click sul singolo pulsante) ogni funzione si comporta
+come prima. Durante la sessione gli stadi condividono:
+
+- i file scelti nei dialoghi (Allegato 2 si chiede una volta sola);
+- gli estratti dei workbook (snam.wbcache.MEMORY): un foglio letto da uno
+  stadio non si rilegge negli stadi successivi;
+- l'ambito (snam.scope.choose restituisce quello della sessione) e una sola
+  passata del collector sulle categorie di tutti gli stadi (Scope.elements);
+- il ParamResolver, cioe' gli handle dei parametri risolti per tipo, e le
+  istantanee dei parametri dei tipi (snam.snapshot.SnapshotCache);
+- i messaggi finali: notify() li raccoglie invece di aprire un TaskDialog
+  per stadio, e l'orchestratore li riporta nel riepilogo;
+- le azioni da fare solo a modello confermato (after_commit, es. salvare le
+  impronte di snam.fingerprint): si eseguono con commit() dopo
+  l'Assimilate del TransactionGroup e si scartano se il gruppo si annulla.
+
+Le istantanee dei parametri delle istanze (snam.snapshot.ParamSnapshot) non
+si condividono: Pipe (tubi) e AP (accessori e raccordi) leggono categorie
+disgiunte, quindi nessuna istantanea verrebbe riusata e tenerle tutte in
+sessione terrebbe vivi i Parameter di ogni elemento fino alla fine.
+"""
+from snam import wbcache
+from snam.params import ParamResolver
+from snam.snapshot import SnapshotCache
+
+_session = None
+
+
+class Session(object):
+    """Stato condiviso tra gli stadi; categories: id delle categorie della passata comune."""
+
+    def __init__(self, run_scope, categories=()):
+        self.scope = run_scope
+        self.categories = set(int(c) for c in categories)
+        self.files = {}
+        self.params = ParamResolver()
+        self.snapshots = SnapshotCache()
+        self.instances = None  # [(id categoria, elemento)] della passata comune
+        self.messages = []
+        self.on_commit = []  # azioni rimandate all'Assimilate del gruppo
+
+    def take_messages(self):
+        """Messaggi raccolti dall'ultimo stadio (e svuota la lista)."""
+        msgs, self.messages = self.messages, []
+        return msgs
+
+
+def current():
+    """Sessione attiva, None se il pulsante gira da solo."""
+    return _session
+
+
+def start(run_scope, categories=()):
+    """Apre la sessione (e la memoria dei workbook in processo)."""
+    global _session
+    _session = Session(run_scope, categories)
+    wbcache.MEMORY = {}
+    return _session
+
+
+def finish():
+    """Chiude la sessione e libera tabelle ed elementi condivisi; scarta le azioni non eseguite."""
+    global _session
+    _session = None
+    wbcache.MEMORY = None
+
+
+def after_commit(action):
+    """
+    Esegue action() a modello confermato: subito fuori sessione (lo stadio
+    chiama dopo il proprio Commit), in sessione solo con commit().
+    """
+    if _session is not None:
+        _session.on_commit.append(action)
+    else:
+        action()
+
+
+def commit():
+    """Esegue le azioni rimandate della sessione (dopo tg.Assimilate())."""
+    if _session is not None:
+        actions, _session.on_commit = _session.on_commit, []
+        for action in actions:
+            action()
+
+
+def remembered_file(title):
+    """File gia' scelto nella sessione per il dialogo title (None se nessuno)."""
+    return _session.files.get(title) if _session is not None else None
+
+
+def remember_file(title, path):
+    """Registra la scelta del dialogo title per gli stadi successivi; restituisce path."""
+    if _session is not None:
+        _session.files[title] = path
+    return path
+
+
+def resolver():
+    """ParamResolver della sessione, o uno nuovo fuori sessione."""
+    return _session.params if _session is not None else ParamResolver()
+
+
+def snapshots():
+    """SnapshotCache dei tipi della sessione, o una nuova fuori sessione."""
+    return _session.snapshots if _session is not None else SnapshotCache()
+
+
+def notify(title, msg):
+    """Messaggio finale di uno stadio: TaskDialog da solo, raccolto in sessione."""
+    if _session is not None:
+        _session.messages.append((title, msg))
+        return
+    from Autodesk.Revit.UI import TaskDialog
+    TaskDialog.Show(title, msg)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Report HTML di fine esecuzione costruito da un snam.runlog.RunLog in un solo
+documento, da passare a output.print_html con una sola chiamata.
+
+- tabella riassuntiva per famiglia e regola (ordinabile cliccando
+  sull'intestazione);
+- una sezione di dettaglio per famiglia, chiusa di default;
+- righe di dettaglio paginate: ne sono visibili page_size, le altre si
+  mostrano a blocchi con "mostra altri".
+
+La finestra di output di pyRevit non esegue i <script> inseriti con l'HTML,
+quindi il JavaScript (ES5, per il WebBrowser di Revit) sta negli onclick.
+"""
+from collections import OrderedDict
+
+from snam import runlog
+
+PAGE_SIZE = 50
+
+_JS_SORT = (
+    "var th=this,tb=th.parentNode.parentNode.parentNode.tBodies[0],i=th.cellIndex,"
+    "num=th.getAttribute('data-num'),asc=th.getAttribute('data-asc')!='1';"
+    "th.setAttribute('data-asc',asc?'1':'0');var rs=[].slice.call(tb.rows);"
+    "rs.sort(function(a,b){var x=a.cells[i].innerText,y=b.cells[i].innerText;"
+    "if(num){x=+x;y=+y;}return (x<y?-1:x>y?1:0)*(asc?1:-1);});"
+    "for(var k=0;k<rs.length;k++){tb.appendChild(rs[k]);}"
+)
+
+_JS_TOGGLE = (
+    "var d=this.nextSibling;d.style.display=d.style.display=='none'?'block':'none';"
+)
+
+_JS_MORE = (
+    "var rs=this.previousSibling.tBodies[0].rows,n=0;"
+    "for(var k=0;k<rs.length;k++){{if(n>={0}){{break;}}if(rs[k].style.display=='none'){{rs[k].style.display='';n++;}}}}"
+    "var left=0;for(k=0;k<rs.length;k++){{if(rs[k].style.display=='none'){{left++;}}}}"
+    "if(!left){{this.style.display='none';}}"
+)
+
+_LEVEL_COLORS = {
+    runlog.ERROR: "red",
+    runlog.WARNING: "purple",
+    runlog.INFO: "gray",
+    runlog.DEBUG: "gray",
+}
+
+
+def esc(value):
+    """Testo sicuro dentro HTML (e negli attributi tra virgolette doppie)."""
+    return (u"{0}".format(value).replace("&", "&amp;").replace("<", "&lt;")
+            .replace(">", "&gt;").replace('"', "&quot;"))
+
+
+def _th(label, numeric=False):
+    return u'<th style="cursor:pointer" onclick="{0}"{1}>{2}</th>'.format(
+        _JS_SORT, ' data-num="1"' if numeric else "", esc(label))
+
+
+def summary_rows(entries):
+    """
+    Righe della tabella riassuntiva: [(famiglia, regola, livello, messaggi
+    distinti, occorrenze)] aggregando i bucket per famiglia/regola/livello.
+    """
+    agg = OrderedDict()
+    for level, family, rule, _, n, _ in entries:
+        counts = agg.setdefault((family, rule, level), [0, 0])
+        counts[0] += 1
+        counts[1] += n
+    return [k + tuple(v) for k, v in agg.items()]
+
+
+def _summary_table(entries):
+    parts = [u"<table><thead><tr>",
+             _th("Famiglia"), _th("Regola"), _th("Livello"),
+             _th("Messaggi", True), _th("Occorrenze", True),
+             u"</tr></thead><tbody>"]
+    for family, rule, level, distinct, total in summary_rows(entries):
+        parts.append(u"<tr><td>{0}</td><td>{1}</td><td style=\"color:{2}\">{3}</td>"
+                     u"<td>{4}</td><td>{5}</td></tr>".format(
+                         esc(family or "-"), esc(rule or "-"), _LEVEL_COLORS.get(level, "black"),
+                         runlog.LEVEL_NAMES.get(level, level), distinct, total))
+    parts.append(u"</tbody></table>")
+    return u"".join(parts)
+
+
+def _detail_section(family, entries, page_size):
+    parts = [u'<h3 style="cursor:pointer" onclick="{0}">&#9656; {1} ({2})</h3>'.format(
+                 _JS_TOGGLE, esc(family or "-"), sum(e[4] for e in entries)),
+             u'<div style="display:none">',
+             u"<table><thead><tr>",
+             _th("Livello"), _th("Regola"), _th("Messaggio"), _th("Occorrenze", True),
+             _th("ID di esempio"),
+             u"</tr></thead><tbody>"]
+    for i, (level, _, rule, text, n, ids) in enumerate(entries):
+        hidden = u' style="display:none"' if i >= page_size else u""
+        sample = u", ".join(str(x) for x in ids) + (u", ..." if n > len(ids) else u"")
+        parts.append(u"<tr{0}><td style=\"color:{1}\">{2}</td><td>{3}</td><td>{4}</td>"
+                     u"<td>{5}</td><td>{6}</td></tr>".format(
+                         hidden, _LEVEL_COLORS.get(level, "black"),
+                         runlog.LEVEL_NAMES.get(level, level), esc(rule or "-"), esc(text), n, sample))
+    parts.append(u"</tbody></table>")
+    if len(entries) > page_size:
+        parts.append(u'<a href="#" onclick="{0}return false;">mostra altri</a>'.format(
+            _JS_MORE.format(page_size)))
+    parts.append(u"</div>")
+    return u"".join(parts)
+
+
+def render_html(log, header=(), min_level=runlog.INFO, page_size=PAGE_SIZE):
+    """
+    Documento HTML del run: righe di intestazione (header, HTML gia' pronto),
+    riepilogo per famiglia/regola e dettagli per famiglia dei bucket di log
+    con livello >= min_level.
+    """
+    entries = log.entries(min_level)
+    parts = [u"{0}<br>".format(h) for h in header]
+    if entries:
+        parts.append(_summary_table(entries))
+        groups = OrderedDict()
+        for e in entries:
+            groups.setdefault(e[1], []).append(e)
+        for family, group in groups.items():
+            parts.append(_detail_section(family, group, page_size))
+    return u"".join(parts)
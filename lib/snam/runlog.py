@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Log di esecuzione dei pulsanti di mappatura, strutturato e limitato.
+
+Ogni messaggio e' un modello con argomenti (formattato solo quando il log
+viene mostrato) e finisce in un bucket (livello, famiglia, regola, messaggio,
+argomenti) che conta le occorrenze e tiene al massimo max_samples id di
+elemento di esempio: la memoria dipende dal numero di messaggi distinti, non
+da elementi x regole. I messaggi sotto min_level vengono solo contati.
+"""
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+# cartella dei file di esecuzione (es. tempi, vedi snam.timing)
+LOG_DIR = os.path.join(os.environ.get("LOCALAPPDATA") or tempfile.gettempdir(),
+                       "SNAM_Toolbar", "logs")
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+SAMPLE_IDS = 5
+
+
+def log_path(name, suffix):
+    """Percorso in LOG_DIR per il run corrente del pulsante name (crea la cartella)."""
+    if not os.path.isdir(LOG_DIR):
+        os.makedirs(LOG_DIR)
+    return os.path.join(LOG_DIR, "{0}_{1}{2}".format(name, time.strftime("%Y%m%d_%H%M%S"), suffix))
+
+
+class RunLog(object):
+    """Bucket (livello, famiglia, regola, messaggio, argomenti) -> [conteggio, id di esempio]."""
+
+    def __init__(self, min_level=WARNING, max_samples=SAMPLE_IDS):
+        self.min_level = min_level
+        self.max_samples = max_samples
+        self.buckets = OrderedDict()
+        self.counts = {}
+
+    def add(self, level, family, rule, el_id, msg, *args):
+        """Registra msg (modello str.format con args) per l'elemento el_id (None se non applicabile)."""
+        self.counts[level] = self.counts.get(level, 0) + 1
+        if level < self.min_level:
+            return
+        key = (level, family, rule, msg, args)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [0, []]
+        bucket[0] += 1
+        if el_id is not None and len(bucket[1]) < self.max_samples:
+            bucket[1].append(el_id)
+
+    def debug(self, family, rule, el_id, msg, *args):
+        self.add(DEBUG, family, rule, el_id, msg, *args)
+
+    def info(self, family, rule, el_id, msg, *args):
+        self.add(INFO, family, rule, el_id, msg, *args)
+
+    def warning(self, family, rule, el_id, msg, *args):
+        self.add(WARNING, family, rule, el_id, msg, *args)
+
+    def error(self, family, rule, el_id, msg, *args):
+        self.add(ERROR, family, rule, el_id, msg, *args)
+
+    def count(self, level):
+        """Messaggi registrati al livello level (anche quelli solo contati)."""
+        return self.counts.get(level, 0)
+
+    def entries(self, min_level=WARNING):
+        """
+        Bucket con livello >= min_level come tuple
+        (livello, famiglia, regola, testo, conteggio, id di esempio),
+        nell'ordine di prima comparsa. Qui avviene la formattazione.
+        """
+        out = []
+        for (level, family, rule, msg, args), (n, ids) in self.buckets.items():
+            if level < min_level:
+                continue
+            text = msg.format(*args) if args else msg
+            out.append((level, family, rule, text, n, ids))
+        return out
+
+    def by_family(self, min_level=WARNING):
+        """{famiglia: [voci di entries]} nell'ordine di prima comparsa."""
+        groups = OrderedDict()
+        for entry in self.entries(min_level):
+            groups.setdefault(entry[1], []).append(entry)
+        return groups
+
+    def format_text(self, min_level=WARNING, limit=30):
+        """
+        Testo per TaskDialog: una riga per bucket, al massimo limit righe
+        (None = tutte), con conteggio e id di esempio.
+        """
+        entries = self.entries(min_level)
+        lines = []
+        for level, family, rule, text, n, ids in entries[:limit]:
+            head = " / ".join(str(x) for x in (family, rule) if x)
+            line = "- {0}: {1}".format(head, text) if head else "- " + text
+            if n > 1:
+                line += " (x{0})".format(n)
+            if ids:
+                line += " [id: {0}{1}]".format(", ".join(str(i) for i in ids),
+                                               ", ..." if n > len(ids) else "")
+            lines.append(line)
+        if limit is not None and len(entries) > limit:
+            lines.append("... altri {0} messaggi distinti".format(len(entries) - limit))
+        return "\n".join(lines)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Ambito di esecuzione dei pulsanti di mappatura: intero modello, selezione
+corrente, vista attiva, livelli o workset scelti.
+
+- click: sempre intero modello, anche se qualcosa e' selezionato;
+- CTRL+click (pyRevit imposta __forceddebugmode__): scelta dell'ambito da
+  elenco (selezione corrente, vista, livelli/workset): un run parziale e'
+  solo una scelta esplicita. Lo stesso elenco mostra gli interruttori
+  delle opzioni del run (es. ON_TYPE), che finiscono in Scope.options.
+
+Scope.collector(doc) sostituisce FilteredElementCollector(doc) negli script:
+i filtri per categoria si applicano dopo, come prima. Scope.elements(doc,
+categorie) restituisce direttamente le istanze delle categorie; dentro
+"Run all mapping" (snam.pipeline) le prende dalla passata comune. I workbook
+restano in cache (snam.wbcache), quindi un run su pochi elementi costa poco.
+"""
+from Autodesk.Revit.DB import (ElementId, ElementFilter, ElementLevelFilter, ElementMulticategoryFilter,
+                               ElementWorksetFilter, FilteredElementCollector, FilteredWorksetCollector,
+                               Level, LogicalOrFilter, WorksetKind)
+from System.Collections.Generic import List
+
+from snam import pipeline
+
+MODEL = "Intero modello"
+SELECTION = "Selezione corrente"
+VIEW = "Vista attiva"
+LEVELS = "Livelli..."
+WORKSETS = "Workset..."
+
+# interruttori del CTRL+click (Scope.options)
+ON_TYPE = "Valori IFC sul tipo"
+REPICK_ALLEGATO2 = "Scegli di nuovo Allegato 2"
+
+
+class Scope(object):
+    """
+    Ambito: kind (una delle costanti sopra), etichetta per i riepiloghi e
+    dati del filtro; options: interruttori attivati nell'elenco.
+    """
+
+    def __init__(self, kind, label=None, ids=None, view_id=None, element_filter=None):
+        self.kind = kind
+        self.label = label or kind
+        self.ids = ids
+        self.view_id = view_id
+        self.element_filter = element_filter
+        self.options = frozenset()
+
+    @property
+    def whole(self):
+        """True se l'ambito e' l'intero modello (run completo)."""
+        return self.kind == MODEL
+
+    def collector(self, doc):
+        if self.kind == SELECTION:
+            c = FilteredElementCollector(doc, List[ElementId](self.ids))
+        elif self.kind == VIEW:
+            c = FilteredElementCollector(doc, self.view_id)
+        else:
+            c = FilteredElementCollector(doc)
+        if self.element_filter is not None:
+            c = c.WherePasses(self.element_filter)
+        return c
+
+    def _instances(self, doc, categories):
+        ids = List[ElementId]([ElementId(c) for c in sorted(categories)])
+        return self.collector(doc) \
+            .WherePasses(ElementMulticategoryFilter(ids)) \
+            .WhereElementIsNotElementType() \
+            .ToElements()
+
+    def elements(self, doc, categories):
+        """Istanze (non tipi) delle categorie date (BuiltInCategory) nell'ambito, in ordine di id."""
+        wanted = set(int(c) for c in categories)
+        session = pipeline.current()
+        if session is None or session.scope is not self or not wanted <= session.categories:
+            return list(self._instances(doc, wanted))
+        if session.instances is None:
+            session.instances = [(e.Category.Id.IntegerValue, e)
+                                 for e in self._instances(doc, session.categories)]
+        return [e for c, e in session.instances if c in wanted]
+
+
+def _any_of(filters):
+    if len(filters) == 1:
+        return filters[0]
+    return LogicalOrFilter(List[ElementFilter](filters))
+
+
+def from_selection(uidoc):
+    """Ambito selezione corrente (None se la selezione e' vuota)."""
+    ids = list(uidoc.Selection.GetElementIds()) if uidoc is not None else []
+    if not ids:
+        return None
+    return Scope(SELECTION, "{0} ({1} elementi)".format(SELECTION, len(ids)), ids=ids)
+
+
+def _pick_levels(doc, forms):
+    levels = sorted(FilteredElementCollector(doc).OfClass(Level).ToElements(), key=lambda lv: lv.Elevation)
+    names = [lv.Name for lv in levels]
+    picked = forms.SelectFromList.show(names, title="Livelli da elaborare", multiselect=True)
+    if not picked:
+        return None
+    chosen = [lv for lv in levels if lv.Name in picked]
+    return Scope(LEVELS, "Livelli: " + ", ".join(lv.Name for lv in chosen),
+                 element_filter=_any_of([ElementLevelFilter(lv.Id) for lv in chosen]))
+
+
+def _pick_worksets(doc, forms):
+    if not doc.IsWorkshared:
+        forms.alert("Il modello non e' condiviso: nessun workset.")
+        return None
+    worksets = list(FilteredWorksetCollector(doc).OfKind(WorksetKind.UserWorkset))
+    picked = forms.SelectFromList.show([ws.Name for ws in worksets], title="Workset da elaborare",
+                                       multiselect=True)
+    if not picked:
+        return None
+    chosen = [ws for ws in worksets if ws.Name in picked]
+    return Scope(WORKSETS, "Workset: " + ", ".join(ws.Name for ws in chosen),
+                 element_filter=_any_of([ElementWorksetFilter(ws.Id) for ws in chosen]))
+
+
+def choose(doc, uidoc, ask=False, switches=()):
+    """
+    Ambito del run. Senza ask: intero modello (la selezione corrente non
+    restringe nulla) e nessuna opzione. Con ask mostra l'elenco, con gli
+    interruttori switches; annullare esce dallo script.
+    Dentro "Run all mapping" vale l'ambito scelto una volta dall'orchestratore.
+    """
+    session = pipeline.current()
+    if session is not None:
+        return session.scope
+    if not ask:
+        return Scope(MODEL)
+
+    selection = from_selection(uidoc)
+    from pyrevit import forms
+    options = [MODEL, VIEW, LEVELS, WORKSETS]
+    if selection is not None:
+        options.insert(0, SELECTION)
+    flags = {}
+    if switches:
+        # (scelta, {interruttore: bool}); annullando pyRevit restituisce None
+        picked = forms.CommandSwitchWindow.show(options, switches=list(switches),
+                                                message="Ambito della mappatura")
+        choice, flags = picked or (None, None)
+        flags = flags or {}
+    else:
+        choice = forms.CommandSwitchWindow.show(options, message="Ambito della mappatura")
+    scope = None
+    if choice == MODEL:
+        scope = Scope(MODEL)
+    elif choice == SELECTION:
+        scope = selection
+    elif choice == VIEW:
+        view = uidoc.ActiveView
+        scope = Scope(VIEW, "{0}: {1}".format(VIEW, view.Name), view_id=view.Id)
+    elif choice == LEVELS:
+        scope = _pick_levels(doc, forms)
+    elif choice == WORKSETS:
+        scope = _pick_worksets(doc, forms)
+    if scope is None:
+        raise SystemExit
+    scope.options = frozenset(s for s in switches if flags.get(s))
+    return scope
+
+
+def wants_choice(script_globals):
+    """Scelta dell'ambito da elenco = CTRL+click sul pulsante (__forceddebugmode__)."""
+    return bool(script_globals.get("__forceddebugmode__", False))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Istantanea dei parametri di un elemento: una sola iterazione di el.Parameters.
+
+Le regole di Pipe e AP leggono piu' volte gli stessi parametri (offset per K
+e T, NP259_codice_sap, tf_* su istanza e tipo, nome tipo...). ParamSnapshot
+scorre il set di parametri una volta e li indicizza per nome e per
+BuiltInParameter; le letture successive sono accessi a dizionario. I
+Parameter restano quelli vivi dell'elemento, quindi dopo una scrittura si
+legge il valore nuovo.
+
+I BuiltInParameter che Revit non espone in el.Parameters (parametri nascosti)
+si chiedono a el.get_Parameter alla prima lettura e si memorizzano, cosi'
+il risultato e' sempre quello di get_Parameter. Per nome vale la prima
+occorrenza, come LookupParameter.
+
+SnapshotCache tiene le istantanee dei tipi (FamilySymbol), una per type id.
+"""
+from Autodesk.Revit.DB import BuiltInParameter
+
+_MISSING = object()
+
+
+class ParamSnapshot(object):
+    """Parametri di element per nome (get) e per BuiltInParameter (bip)."""
+
+    __slots__ = ("element", "_by_name", "_by_bip")
+
+    def __init__(self, element):
+        self.element = element
+        by_name = {}
+        by_bip = {}
+        for p in element.Parameters:
+            definition = p.Definition
+            name = definition.Name
+            if name not in by_name:
+                by_name[name] = p
+            try:
+                bip = definition.BuiltInParameter
+            except AttributeError:
+                continue
+            if bip != BuiltInParameter.INVALID:
+                by_bip[bip] = p
+        self._by_name = by_name
+        self._by_bip = by_bip
+
+    def get(self, name):
+        """Come element.LookupParameter(name)."""
+        return self._by_name.get(name)
+
+    def bip(self, bip):
+        """Come element.get_Parameter(bip)."""
+        prm = self._by_bip.get(bip, _MISSING)
+        if prm is _MISSING:
+            prm = self._by_bip[bip] = self.element.get_Parameter(bip)
+        return prm
+
+    def names(self):
+        """Nomi dei parametri dell'elemento."""
+        return list(self._by_name)
+
+
+class SnapshotCache(object):
+    """Istantanee dei tipi per type id: le istanze dello stesso tipo le condividono."""
+
+    def __init__(self):
+        self._types = {}
+
+    def type_of(self, doc, el):
+        """Istantanea del tipo di el (None se el non ha tipo)."""
+        tid = el.GetTypeId()
+        key = tid.IntegerValue
+        snap = self._types.get(key, _MISSING)
+        if snap is _MISSING:
+            sym = doc.GetElement(tid) if key > 0 else None
+            snap = self._types[key] = ParamSnapshot(sym) if sym is not None else None
+        return snap
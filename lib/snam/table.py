@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Fogli Excel come tabelle per colonne, condivise da tutti i pulsanti.
+
+Le colonne si leggono in blocco e solo quelle richieste (proiezione): i
+.xlsx in streaming dal solo foglio richiesto (snam.xlsx), gli altri formati
+con xlrd (col_values); la normalizzazione dei valori e' una sola (norm) e si applica
+una volta al caricamento se richiesto. Gli indici hash sulle colonne chiave
+(codice SAP, codice edificio in colonna F, prefissi a 5 caratteri) si
+costruiscono alla prima ricerca e restano sulla tabella.
+"""
+import re
+import xlrd
+
+from snam import wbcache, xlsx
+
+_FLOAT_INT_RE = re.compile(r'^-?\d+\.0$')
+
+
+def col_letter_to_index(letter):
+    """Lettere di colonna Excel -> indice zero-based (A=0, B=1, ..., AA=26)."""
+    idx = 0
+    for c in letter:
+        if c.isalpha():
+            idx = idx * 26 + (ord(c.upper()) - ord('A') + 1)
+    return idx - 1
+
+
+def norm(val):
+    """
+    Valore di cella come testo confrontabile: xlrd legge i numeri come float,
+    quindi 13037 diventa 13037.0 e senza questa pulizia non matcha mai.
+    None -> "", float interi senza ".0", testo senza spazi esterni.
+    """
+    if val is None:
+        return ""
+    if isinstance(val, float):
+        return str(int(val)) if val.is_integer() else str(val)
+    s = str(val).strip()
+    return s[:-2] if _FLOAT_INT_RE.match(s) else s
+
+
+def upper_key(val):
+    """Chiave testo maiuscola (es. colonna A di Allegato 3)."""
+    return str(val).strip().upper()
+
+
+def prefix5_key(val):
+    """Chiave sui primi 5 caratteri, maiuscola (prefissi famiglia/tipo)."""
+    return str(val).strip()[:5].upper()
+
+
+def sheet_cols(ws, columns=None, normalized=False, max_rows=None):
+    """
+    Colonne di un foglio xlrd gia' aperto: lista lunga ws.ncols con la lista
+    dei valori per le colonne richieste (tutte se columns e' None) e None
+    per le altre. normalized=True applica norm() una volta qui; max_rows
+    limita la lettura alle prime righe.
+    """
+    cols = [None] * ws.ncols
+    if columns is None:
+        wanted = range(ws.ncols)
+    else:
+        wanted = sorted(set(c for c in columns if 0 <= c < ws.ncols))
+    end = ws.nrows if max_rows is None else min(ws.nrows, max_rows)
+    for c in wanted:
+        values = ws.col_values(c, 0, end)
+        cols[c] = [norm(v) for v in values] if normalized else values
+    return cols
+
+
+def load_cols(path, sheet, columns=None, normalized=False, max_rows=None):
+    """
+    Come sheet_cols ma apre il file (senza cache): .xlsx in streaming con
+    snam.xlsx, leggendo solo il foglio e le colonne richieste, altrimenti xlrd.
+    """
+    if xlsx.is_xlsx(path):
+        cols = xlsx.read_sheet_cols(path, sheet, columns, max_rows)
+        if normalized:
+            cols = [[norm(v) for v in c] if c is not None else None for c in cols]
+        return cols
+    wb = xlrd.open_workbook(path, on_demand=True)
+    try:
+        return sheet_cols(wb.sheet_by_name(sheet), columns, normalized, max_rows)
+    finally:
+        wb.release_resources()
+
+
+def read_cols(path, sheet, columns=None, normalized=False):
+    """Come load_cols; passa dalla cache su disco."""
+    tag = "table/1:{0}:{1}:{2}".format(
+        sheet, "all" if columns is None else sorted(set(columns)), int(bool(normalized)))
+    return wbcache.cached(path, tag, lambda: load_cols(path, sheet, columns, normalized))
+
+
+def read_table(path, sheet, columns=None, normalized=False):
+    """Table del foglio sheet (solo le colonne richieste)."""
+    return Table(read_cols(path, sheet, columns, normalized))
+
+
+class Table(object):
+    """
+    Foglio per colonne: cols[c][r]. La riga 0 e' l'intestazione e non entra
+    negli indici. Le colonne non caricate valgono None.
+    """
+
+    def __init__(self, cols):
+        self.cols = cols
+        self.nrows = max([len(c) for c in cols if c is not None] or [0])
+        self._indexes = {}
+
+    @property
+    def ncols(self):
+        return len(self.cols)
+
+    def col(self, c):
+        """Valori della colonna c ([] se fuori range o non caricata)."""
+        if 0 <= c < len(self.cols) and self.cols[c] is not None:
+            return self.cols[c]
+        return []
+
+    def value(self, r, c, default=""):
+        col = self.col(c)
+        return col[r] if 0 <= r < len(col) else default
+
+    def row_slice(self, r, columns):
+        """Valori della riga r per le colonne indicate."""
+        return [self.value(r, c) for c in columns]
+
+    def index(self, key_col, key=norm, multi=False):
+        """
+        Indice hash sulla colonna key_col: {chiave: prima riga} oppure, con
+        multi=True, {chiave: [righe]}. Le chiavi vuote non vengono indicizzate.
+        Costruito una volta e riusato.
+        """
+        ikey = (key_col, key, multi)
+        idx = self._indexes.get(ikey)
+        if idx is None:
+            idx = {}
+            col = self.col(key_col)
+            for r in range(1, len(col)):
+                k = key(col[r]) if key is not None else col[r]
+                if k == "":
+                    continue
+                if multi:
+                    idx.setdefault(k, []).append(r)
+                elif k not in idx:
+                    idx[k] = r
+            self._indexes[ikey] = idx
+        return idx
+
+    def find(self, key_col, value, key=norm):
+        """Prima riga con chiave value in key_col (None se assente)."""
+        return self.index(key_col, key).get(value)
+
+    def find_all(self, key_col, value, key=norm):
+        """Tutte le righe con chiave value in key_col."""
+        return self.index(key_col, key, multi=True).get(value, [])
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Tempi di esecuzione dei pulsanti di mappatura: fasi (lettura Excel,
+collector, CSV, valutazione regole, scritture, Commit), tempo cumulato e
+numero di chiamate per codice regola, elementi al secondo.
+
+Uso negli script a livello modulo, senza reindentare i blocchi:
+
+    timer = timing.Timer("APMapping")
+    ...                       # lettura Excel
+    timer.lap("excel")        # tempo dall'ultimo lap attribuito a "excel"
+    ...
+    timer.finish()            # tabella a video + JSON in runlog.LOG_DIR
+
+Disattivato (ENABLED = False, default; SNAM_TIMING=1 nell'ambiente lo
+attiva) lap/add_rule tornano subito, wrap restituisce la funzione originale
+e finish non fa nulla.
+"""
+import os
+import io
+import json
+import time
+from collections import OrderedDict
+
+from snam import runlog
+
+ENABLED = os.environ.get("SNAM_TIMING", "") not in ("", "0")
+
+# orologio ad alta risoluzione (time.clock sotto IronPython 2.7)
+clock = getattr(time, "perf_counter", None) or time.clock
+
+
+class Timer(object):
+    """Fasi {nome: secondi}, regole {codice: [secondi, chiamate]}, elementi elaborati."""
+
+    def __init__(self, name, enabled=None):
+        self.name = name
+        self.enabled = ENABLED if enabled is None else enabled
+        self.phases = OrderedDict()
+        self.rules = {}
+        self.elements = 0
+        self._start = self._last = clock()
+
+    def lap(self, phase):
+        """Attribuisce a phase il tempo trascorso dall'ultimo lap (o dalla creazione)."""
+        if not self.enabled:
+            return
+        now = clock()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._last)
+        self._last = now
+
+    def add_rule(self, code, seconds):
+        """Somma seconds al tempo della regola code e conta una chiamata."""
+        acc = self.rules.get(code)
+        if acc is None:
+            acc = self.rules[code] = [0.0, 0]
+        acc[0] += seconds
+        acc[1] += 1
+
+    def wrap(self, code, fn):
+        """fn cronometrata sotto la regola code (fn stessa se disattivato)."""
+        if not self.enabled:
+            return fn
+        add_rule = self.add_rule
+
+        def timed(*args):
+            t0 = clock()
+            try:
+                return fn(*args)
+            finally:
+                add_rule(code, clock() - t0)
+        return timed
+
+    def total(self):
+        return clock() - self._start
+
+    def to_dict(self):
+        total = self.total()
+        return OrderedDict([
+            ("button", self.name),
+            ("total_s", round(total, 6)),
+            ("elements", self.elements),
+            ("elements_per_s", round(self.elements / total, 1) if total > 0 else None),
+            ("phases", OrderedDict((k, round(v, 6)) for k, v in self.phases.items())),
+            ("rules", OrderedDict((code, OrderedDict([("s", round(s, 6)), ("calls", n)]))
+                                  for code, (s, n) in sorted(self.rules.items(),
+                                                             key=lambda kv: -kv[1][0]))),
+        ])
+
+    def format_text(self):
+        """Tabella compatta: fasi, regole (piu' lente prima), totale ed elementi/s."""
+        data = self.to_dict()
+        lines = ["Tempi {0}".format(self.name)]
+        for phase, s in data["phases"].items():
+            lines.append("  {0:<22} {1:>9.3f} s".format(phase, s))
+        for code, r in data["rules"].items():
+            lines.append("  regola {0:<15} {1:>9.3f} s  {2:>8} chiamate".format(code, r["s"], r["calls"]))
+        lines.append("  {0:<22} {1:>9.3f} s  {2} elementi ({3} el/s)".format(
+            "totale", data["total_s"], data["elements"], data["elements_per_s"]))
+        return "\n".join(lines)
+
+    def write_json(self):
+        """Scrive il JSON dei tempi accanto ai log di esecuzione; restituisce il percorso."""
+        path = runlog.log_path(self.name, "_timing.json")
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(self.to_dict(), ensure_ascii=False, indent=1))
+        return path
+
+    def finish(self, show=None):
+        """
+        Chiude la misura: scrive il JSON e mostra la tabella con show(testo)
+        (print se None). Non fa nulla se disattivato; restituisce il testo o None.
+        """
+        if not self.enabled:
+            return None
+        text = self.format_text()
+        try:
+            text += "\n  JSON: {0}".format(self.write_json())
+        except (IOError, OSError):
+            pass
+        if show is None:
+            print(text)
+        else:
+            show(text)
+        return text
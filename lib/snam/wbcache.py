@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Cache su disco dei fogli Excel gia' letti.
+
+Ogni voce e' il risultato di un loader (colonne di un foglio, regole, dati CI)
+serializzato con pickle + zlib in un file locale. La chiave e' percorso
+assoluto + dimensione + mtime del workbook + un tag che identifica cosa e'
+stato estratto + la versione FORMAT del modulo: se il file Excel cambia la
+voce non viene piu' trovata e invecchia fino all'eviction. Le voci meno usate di recente vengono rimosse
+quando la cartella supera CACHE_BUDGET_BYTES.
+"""
+import os
+import tempfile
+import hashlib
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+CACHE_DIR = os.path.join(os.environ.get("LOCALAPPDATA") or tempfile.gettempdir(),
+                         "SNAM_Toolbar", "wbcache")
+CACHE_BUDGET_BYTES = 128 * 1024 * 1024
+CACHE_EXT = ".bin"
+
+# versione degli estratti, entra nella chiave di ogni voce: va incrementata
+# quando cambia la struttura di una voce o la semantica di un loader
+# (snam.table, snam.xlsx, loader degli script), cosi' le voci scritte dal
+# codice precedente non vengono piu' trovate
+FORMAT = 1
+
+# metti a False per forzare sempre la rilettura degli Excel
+ENABLED = True
+
+# memoria di processo {chiave: estratto}, attiva solo durante "Run all
+# mapping" (snam.pipeline): gli stadi successivi riusano gli estratti senza
+# rileggere ne' decomprimere; None = disattivata
+MEMORY = None
+
+
+def _entry_path(path, tag):
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = u"{0}|{1}|{2}|{3}|{4}".format(os.path.normcase(path), st.st_size, int(st.st_mtime), FORMAT, tag)
+    return os.path.join(CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + CACHE_EXT)
+
+
+def _read_entry(entry):
+    with open(entry, "rb") as fb:
+        data = pickle.loads(zlib.decompress(fb.read()))
+    try:
+        # LRU: l'mtime della voce registra l'ultimo uso
+        os.utime(entry, None)
+    except OSError:
+        pass
+    return data
+
+
+def _write_entry(entry, data):
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    tmp = entry + ".tmp"
+    with open(tmp, "wb") as fb:
+        fb.write(zlib.compress(pickle.dumps(data, 2), 1))
+    if os.path.exists(entry):
+        os.remove(entry)
+    os.rename(tmp, entry)
+
+
+def evict(budget=None):
+    """Rimuove le voci usate meno di recente finche' la cache sta nel budget (byte)."""
+    budget = CACHE_BUDGET_BYTES if budget is None else budget
+    if not os.path.isdir(CACHE_DIR):
+        return
+    entries = []
+    total = 0
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(CACHE_EXT):
+            continue
+        p = os.path.join(CACHE_DIR, name)
+        try:
+            st = os.stat(p)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+        total += st.st_size
+    entries.sort()
+    for _, size, p in entries:
+        if total <= budget:
+            break
+        try:
+            os.remove(p)
+            total -= size
+        except OSError:
+            pass
+
+
+def cached(path, tag, loader):
+    """
+    Restituisce loader() per il workbook path, leggendolo dalla cache se il
+    file non e' cambiato (stesso percorso, dimensione e mtime) e la voce e'
+    della versione FORMAT corrente. tag distingue i diversi estratti dello
+    stesso file (es. "cols:PARAMETRI COMUNI").
+    Qualunque problema della cache ripiega sulla lettura diretta.
+    """
+    if MEMORY is None:
+        return _cached(path, tag, loader)
+    try:
+        key = _entry_path(path, tag)
+    except OSError:
+        key = (os.path.normcase(os.path.abspath(path)), tag)
+    if key not in MEMORY:
+        MEMORY[key] = _cached(path, tag, loader)
+    return MEMORY[key]
+
+
+def _cached(path, tag, loader):
+    if not ENABLED:
+        return loader()
+    try:
+        entry = _entry_path(path, tag)
+    except OSError:
+        return loader()
+    if os.path.exists(entry):
+        try:
+            return _read_entry(entry)
+        except Exception:
+            pass
+    data = loader()
+    try:
+        _write_entry(entry, data)
+        evict()
+    except Exception:
+        pass
+    return data
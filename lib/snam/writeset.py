@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Write set dei pulsanti di mappatura: separa la valutazione delle regole
+(plan) dalla scrittura in Revit (apply).
+
+Una voce del piano e' la tupla
+    (element_id, parametro, valore attuale, valore nuovo, codice regola, Parameter,
+     stringa di ripiego per SetValueString o None)
+e finisce nel piano solo se il valore nuovo e' diverso da quello memorizzato
+(confronto per StorageType, vedi same_value): rilanciare una mappatura su un
+modello gia' mappato non sporca gli elementi.
+Il piano si puo' esportare in CSV/JSON (dry run, nessuna transazione) oppure
+applicare dentro una transazione, raggruppato per elemento.
+"""
+import os
+import io
+import csv
+import json
+import tempfile
+import time
+from collections import OrderedDict
+
+from Autodesk.Revit.DB import StorageType, ElementId
+
+try:
+    basestring
+except NameError:  # CPython 3
+    basestring = str
+
+DRYRUN_DIR = os.path.join(os.environ.get("LOCALAPPDATA") or tempfile.gettempdir(),
+                          "SNAM_Toolbar", "dryrun")
+
+EXPORT_HEADER = ("element_id", "parameter", "old_value", "new_value", "rule")
+
+# indici della tupla voce
+EL_ID, PNAME, OLD, NEW, CODE, PRM, FALLBACK = range(7)
+
+# tolleranza per i Double (unita' interne, feet)
+DOUBLE_TOL = 1e-6
+
+
+class WritePlan(list):
+    """Lista delle voci da scrivere; unchanged conta le scritture saltate perche' identiche."""
+    unchanged = 0
+
+
+def param_to_str(prm):
+    """Valore attuale del parametro come stringa (come appare in Revit per i Double)."""
+    st = prm.StorageType
+    if st == StorageType.String:
+        return prm.AsString() or ""
+    if st == StorageType.Integer:
+        return str(prm.AsInteger())
+    if st == StorageType.Double:
+        return prm.AsValueString() or ""
+    if st == StorageType.ElementId:
+        return str(prm.AsElementId().IntegerValue)
+    return ""
+
+
+def _value_to_str(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return value if isinstance(value, basestring) else str(value)
+
+
+def _as_number(value):
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(str(value).strip().replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+
+
+def same_value(prm, value):
+    """
+    True se prm contiene gia' value: testo per i String, intero per gli
+    Integer, Double con tolleranza DOUBLE_TOL (valori numerici; le stringhe,
+    scritte con SetValueString, si confrontano con AsValueString), id per gli
+    ElementId.
+    """
+    try:
+        st = prm.StorageType
+        if st == StorageType.String:
+            return (prm.AsString() or "") == _value_to_str(value)
+        if st == StorageType.Integer:
+            n = _as_number(value)
+            if n is None:
+                return (prm.AsValueString() or "") == _value_to_str(value)
+            return prm.AsInteger() == n
+        if st == StorageType.Double:
+            if isinstance(value, (int, float)):
+                return abs(prm.AsDouble() - value) <= DOUBLE_TOL
+            return (prm.AsValueString() or "") == _value_to_str(value)
+        if st == StorageType.ElementId:
+            if isinstance(value, ElementId):
+                value = value.IntegerValue
+            return prm.AsElementId().IntegerValue == _as_number(value)
+    except Exception:
+        pass
+    return False
+
+
+def plan_write(plan, el, prm, value, code, fallback=None):
+    """
+    Aggiunge al piano la scrittura di value su prm (parametro di el).
+    fallback: testo per SetValueString se Set fallisce (es. un Double in
+    feet ripiega sulla stringa in mm), altrimenti str(value).
+    Restituisce False (e conta plan.unchanged) se prm contiene gia' value.
+    """
+    if same_value(prm, value):
+        plan.unchanged += 1
+        return False
+    plan.append((el.Id.IntegerValue, prm.Definition.Name, param_to_str(prm), value, code, prm,
+                 fallback))
+    return True
+
+
+def group_by_element(plan):
+    """{element_id: [voci]} nell'ordine in cui gli elementi sono stati pianificati."""
+    groups = OrderedDict()
+    for entry in plan:
+        groups.setdefault(entry[EL_ID], []).append(entry)
+    return groups
+
+
+def set_value(prm, value, fallback=None):
+    """
+    Set con fallback SetValueString (fallback se dato, altrimenti str(value)):
+    un valore non compatibile non deve far saltare l'intera transazione.
+    Restituisce "Set", "SetValueString" o None.
+    """
+    try:
+        prm.Set(value)
+        return "Set"
+    except:
+        try:
+            prm.SetValueString(fallback if fallback is not None else str(value))
+            return "SetValueString"
+        except:
+            return None
+
+
+def apply_plan(plan, on_result=None):
+    """
+    Scrive il piano (da chiamare dentro una transazione aperta), un elemento
+    alla volta. on_result(voce, esito) riceve l'esito di set_value.
+    Restituisce (scritti, falliti).
+    """
+    written = failed = 0
+    for entries in group_by_element(plan).values():
+        for entry in entries:
+            how = set_value(entry[PRM], entry[NEW], entry[FALLBACK])
+            if how:
+                written += 1
+            else:
+                failed += 1
+            if on_result is not None:
+                on_result(entry, how)
+    return written, failed
+
+
+def _export_rows(plan):
+    for entry in plan:
+        yield (entry[EL_ID], entry[PNAME], entry[OLD], _value_to_str(entry[NEW]), entry[CODE])
+
+
+def export_csv(plan, path):
+    with io.open(path, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.writer(f, delimiter=";")
+        w.writerow(EXPORT_HEADER)
+        for row in _export_rows(plan):
+            w.writerow(row)
+
+
+def export_json(plan, path):
+    data = [dict(zip(EXPORT_HEADER, row)) for row in _export_rows(plan)]
+    with io.open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(data, ensure_ascii=False, indent=1))
+
+
+def export_dry_run(plan, name):
+    """Esporta il piano in CSV e JSON sotto DRYRUN_DIR; restituisce i due percorsi."""
+    if not os.path.isdir(DRYRUN_DIR):
+        os.makedirs(DRYRUN_DIR)
+    base = os.path.join(DRYRUN_DIR, "{0}_{1}".format(name, time.strftime("%Y%m%d_%H%M%S")))
+    export_csv(plan, base + ".csv")
+    export_json(plan, base + ".json")
+    return base + ".csv", base + ".json"
+
+
+def is_dry_run(script_globals):
+    """Dry run = click con SHIFT sul pulsante (pyRevit imposta __shiftclick__)."""
+    return bool(script_globals.get("__shiftclick__", False))
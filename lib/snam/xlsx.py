@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Lettura in streaming di un foglio .xlsx, solo le colonne richieste.
+
+xlrd.open_workbook analizza tutti i fogli del file e tutta la tabella delle
+stringhe condivise anche quando serve un foglio e poche colonne (il CI ha
+decine di fogli e il Report 100k righe). Qui il .xlsx si apre come zip e si
+legge solo il foglio richiesto con iterparse, una riga alla volta: le celle
+delle colonne non richieste si scartano subito e ogni riga si libera dopo
+l'uso. Le stringhe condivise si decodificano alla fine, solo per gli indici
+usati dalle colonne lette, fermandosi al piu' alto. La memoria dipende
+quindi dalle colonne proiettate, non dalla dimensione del workbook.
+
+I valori sono quelli di xlrd (numeri float, booleani 0/1, errori come codice
+intero, celle vuote ""), e cosi' nrows/ncols: snam.table.norm e le tabelle
+non cambiano. max_rows ferma la lettura dopo le prime righe (es. ricerca
+dell'intestazione del Report).
+"""
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+import xlrd
+
+try:
+    unichr
+except NameError:  # CPython 3
+    unichr = chr
+
+_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_PKG = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+_WHITESPACE = "\t\n \r"
+
+_SHEET_DATA = _NS + "sheetData"
+_ROW = _NS + "row"
+_V = _NS + "v"
+_IS = _NS + "is"
+_T = _NS + "t"
+_R = _NS + "r"
+_SI = _NS + "si"
+_MERGE = _NS + "mergeCell"
+
+# testo errore -> codice, come xlrd (biffh.error_text_from_code)
+ERROR_CODES = {"#NULL!": 0x00, "#DIV/0!": 0x07, "#VALUE!": 0x0F, "#REF!": 0x17,
+               "#NAME?": 0x1D, "#NUM!": 0x24, "#N/A": 0x2A}
+
+_ESCAPE_RE = re.compile(r'_x[0-9A-Fa-f]{4}_')
+
+
+class _Shared(object):
+    """Riferimento a una stringa condivisa, risolto dopo la lettura del foglio."""
+
+    __slots__ = ("index",)
+
+    def __init__(self, index):
+        self.index = index
+
+
+def is_xlsx(path):
+    """True se path e' un .xlsx/.xlsm esistente (zip); gli altri formati restano a xlrd."""
+    if not path.lower().endswith((".xlsx", ".xlsm")):
+        return False
+    try:
+        return zipfile.is_zipfile(path)
+    except (IOError, OSError):
+        return False
+
+
+def _unescape(text):
+    if "_" in text:
+        return _ESCAPE_RE.sub(lambda m: unichr(int(m.group(0)[2:6], 16)), text)
+    return text
+
+
+def _cooked(elem):
+    """Testo di <t>/<v> come xlrd: spazi esterni tolti se non xml:space="preserve"."""
+    text = elem.text
+    if text is None:
+        return ""
+    if elem.get(_SPACE) != "preserve":
+        text = text.strip(_WHITESPACE)
+    return _unescape(text)
+
+
+def _rich_text(elem):
+    """Testo di <si>/<is>: <t> diretto piu' i <t> dei run <r> (la fonetica rPh no)."""
+    parts = []
+    for child in elem:
+        if child.tag == _T:
+            parts.append(_cooked(child))
+        elif child.tag == _R:
+            for t in child:
+                if t.tag == _T:
+                    parts.append(_cooked(t))
+    return "".join(parts)
+
+
+def _ref_col(ref):
+    """Colonna zero-based del riferimento di cella ("AB12" -> 27)."""
+    col = 0
+    for ch in ref:
+        if "A" <= ch <= "Z":
+            col = col * 26 + ord(ch) - 64
+        elif ch != "$":
+            break
+    return col - 1
+
+
+def _ref_rowcol(ref):
+    """"AB12" -> (11, 27); colonna None se il riferimento e' solo la riga."""
+    col = 0
+    for i, ch in enumerate(ref):
+        if "A" <= ch <= "Z":
+            col = col * 26 + ord(ch) - 64
+        elif ch != "$":
+            return int(ref[i:]) - 1, (col - 1 if col else None)
+    return None, col - 1
+
+
+def _members(zf):
+    """Nomi dei membri dello zip per nome minuscolo (Excel e altri non concordano sul case)."""
+    return dict((n.lower().replace("\\", "/"), n) for n in zf.namelist())
+
+
+def _parts(zf, members):
+    """(fogli {nome: membro}, membro delle stringhe condivise o None) da workbook.xml e relazioni."""
+    rels = {}
+    rels_member = members.get("xl/_rels/workbook.xml.rels")
+    if rels_member is not None:
+        for rel in ET.fromstring(zf.read(rels_member)).iter(_NS_PKG + "Relationship"):
+            target = rel.get("Target", "")
+            if target.startswith("/"):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join("xl", target))
+            rels[rel.get("Id")] = (rel.get("Type", ""), target.lower())
+    sheets = {}
+    for el in ET.fromstring(zf.read(members["xl/workbook.xml"])).iter(_NS + "sheet"):
+        rel = rels.get(el.get(_NS_REL + "id"))
+        if rel is not None and rel[1] in members:
+            sheets[el.get("name")] = members[rel[1]]
+    strings = None
+    for rel_type, target in rels.values():
+        if rel_type.endswith("/sharedStrings") and target in members:
+            strings = members[target]
+    if strings is None:
+        strings = members.get("xl/sharedstrings.xml")
+    return sheets, strings
+
+
+def _cell_value(cell, kind):
+    """Valore della cella come xlrd; None se xlrd non la registra (vuota)."""
+    if kind == "n" or kind == "s":
+        v = cell.find(_V)
+        text = v.text if v is not None else None
+        if not text:
+            return None
+        return float(text) if kind == "n" else _Shared(int(text))
+    if kind == "str":
+        v = cell.find(_V)
+        return _cooked(v) if v is not None else ""
+    if kind == "inlineStr":
+        text = None
+        for child in cell:
+            if child.tag == _IS:
+                text = _rich_text(child)
+            elif child.tag == _V:
+                text = child.text
+        return text or None
+    v = cell.find(_V)
+    text = v.text if v is not None else None
+    if kind == "b":
+        return 1 if text in ("1", "true", "on") else 0
+    if kind == "e":
+        return ERROR_CODES[text or "#N/A"]
+    # "d" (data ISO) e tipi sconosciuti: testo grezzo
+    return text or None
+
+
+def _resolve_shared(zf, member, cols):
+    """Sostituisce i _Shared nelle colonne con il testo; legge sharedStrings fino all'indice massimo."""
+    needed = set()
+    for col in cols.values():
+        for v in col:
+            if v.__class__ is _Shared:
+                needed.add(v.index)
+    if not needed:
+        return
+    texts = {}
+    last = max(needed)
+    if member is not None:
+        with zf.open(member) as stream:
+            root = None
+            i = -1
+            for event, elem in ET.iterparse(stream, ("start", "end")):
+                if event == "start":
+                    if root is None:
+                        root = elem
+                    continue
+                if elem.tag != _SI:
+                    continue
+                i += 1
+                if i in needed:
+                    texts[i] = _rich_text(elem)
+                root.clear()
+                if i >= last:
+                    break
+    for col in cols.values():
+        for r, v in enumerate(col):
+            if v.__class__ is _Shared:
+                # indice fuori tabella: xlrd fallirebbe, qui la cella resta vuota
+                col[r] = texts.get(v.index, "")
+
+
+def read_sheet_cols(path, sheet, columns=None, max_rows=None):
+    """
+    Colonne del foglio sheet nel formato di snam.table.sheet_cols: lista
+    lunga ncols con la lista dei valori (lunga nrows) per le colonne
+    richieste (tutte se columns e' None) e None per le altre. Legge solo
+    quel foglio; con max_rows si ferma dopo le prime max_rows righe (e
+    ncols conta solo le righe lette).
+    Foglio assente: xlrd.XLRDError come sheet_by_name.
+    """
+    wanted = None if columns is None else set(c for c in columns if c >= 0)
+    cols = {}
+    nrows = ncols = 0
+    zf = zipfile.ZipFile(path)
+    try:
+        members = _members(zf)
+        sheets, strings = _parts(zf, members)
+        if sheet not in sheets:
+            raise xlrd.XLRDError("No sheet named <{0!r}>".format(sheet))
+        with zf.open(sheets[sheet]) as stream:
+            data = None
+            r = -1
+            for event, elem in ET.iterparse(stream, ("start", "end")):
+                tag = elem.tag
+                if event == "start":
+                    if tag == _SHEET_DATA:
+                        data = elem
+                    continue
+                if tag == _ROW:
+                    rnum = elem.get("r")
+                    r = int(rnum) - 1 if rnum is not None else r + 1
+                    if max_rows is not None and r >= max_rows:
+                        break
+                    c = -1
+                    for cell in elem:
+                        ref = cell.get("r")
+                        c = _ref_col(ref) if ref is not None else c + 1
+                        take = wanted is None or c in wanted
+                        # fuori proiezione la cella conta solo se allarga il foglio
+                        if not take and r < nrows and c < ncols:
+                            continue
+                        kind = cell.get("t", "n")
+                        if take or kind not in ("str", "b", "e"):
+                            value = _cell_value(cell, kind)
+                            if value is None:
+                                continue
+                        else:
+                            value = None
+                        if r >= nrows:
+                            nrows = r + 1
+                        if c >= ncols:
+                            ncols = c + 1
+                        if take:
+                            col = cols.get(c)
+                            if col is None:
+                                col = cols[c] = []
+                            if len(col) > r:
+                                col[r] = value
+                            else:
+                                if len(col) < r:
+                                    col.extend([""] * (r - len(col)))
+                                col.append(value)
+                    if data is not None:
+                        data.clear()
+                elif tag == _MERGE:
+                    # come xlrd: le celle unite allargano il foglio
+                    ref = elem.get("ref") or ""
+                    last_r, last_c = _ref_rowcol(ref.split(":")[-1])
+                    if last_r is not None and last_r + 1 > nrows:
+                        nrows = last_r + 1
+                    if last_c is not None and last_c + 1 > ncols:
+                        ncols = last_c + 1
+        _resolve_shared(zf, strings, cols)
+    finally:
+        zf.close()
+    if max_rows is not None:
+        nrows = min(nrows, max_rows)
+    out = [None] * ncols
+    for c in (range(ncols) if wanted is None else sorted(wanted)):
+        if c < ncols:
+            col = cols.get(c, [])
+            del col[nrows:]
+            col.extend([""] * (nrows - len(col)))
+            out[c] = col
+    return out